@@ -0,0 +1,315 @@
+import time
+import threading
+import requests
+import metrics
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+# Default requests per second allowed for each service
+DEFAULT_RATE_LIMITS = {
+    "tmdb": 40,
+    "radarr": 20,
+    "sonarr": 20,
+    "tautulli": 10,
+    "mdblist": 5,
+}
+
+# Default number of concurrent lookups and retries for throttled or failed requests
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MAX_RETRIES = 3
+
+# Status codes that are retried after a backoff
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+# Default seconds to wait for a connection or for the next bytes of a response
+DEFAULT_TIMEOUT = 30
+
+# Default longest wait before a retry, however long a server asks to wait in Retry-After
+DEFAULT_MAX_RETRY_DELAY = 60
+
+# Lookups kept in flight per worker ahead of the last result read, for bounded results
+LOOKAHEAD_PER_WORKER = 4
+
+_lock = threading.Lock()
+_sessions = {}
+_limiters = {}
+_settings = {
+    "max_workers": DEFAULT_MAX_WORKERS,
+    "max_retries": DEFAULT_MAX_RETRIES,
+    "timeout": DEFAULT_TIMEOUT,
+    "max_retry_delay": DEFAULT_MAX_RETRY_DELAY,
+}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket allowing `rate` requests per second with bursts up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a token is available and consume it.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def configure_services(config):
+    """
+    Configure rate limits and concurrency from the loaded configuration.
+
+    Each service section may define "rate_limit" (requests per second), and the
+    optional "network" section may define "max_workers", "max_retries", "timeout" and
+    "max_retry_delay".
+
+    Args:
+        config (dict): Parsed configuration dictionary.
+    """
+    network_config = config.get("network", {})
+    with _lock:
+        # Sessions are rebuilt with the new pool size, and never shared with a forked worker
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _settings["max_workers"] = network_config.get("max_workers", DEFAULT_MAX_WORKERS)
+        _settings["max_retries"] = network_config.get("max_retries", DEFAULT_MAX_RETRIES)
+        _settings["timeout"] = network_config.get("timeout", DEFAULT_TIMEOUT)
+        _settings["max_retry_delay"] = network_config.get("max_retry_delay", DEFAULT_MAX_RETRY_DELAY)
+        for service, default_rate in DEFAULT_RATE_LIMITS.items():
+            rate = config.get(service, {}).get("rate_limit", default_rate)
+            _limiters[service] = TokenBucket(rate) if rate else None
+
+
+def get_session(service):
+    """
+    Return the shared keep-alive session for a service.
+
+    Args:
+        service (str): Name of the service, for example "tmdb".
+
+    Returns:
+        requests.Session: Session with a connection pool sized for the worker count.
+    """
+    with _lock:
+        session = _sessions.get(service)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=_settings["max_workers"])
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[service] = session
+        return session
+
+
+def get_limiter(service):
+    """
+    Return the token bucket for a service, creating it from the defaults if needed.
+    """
+    with _lock:
+        if service not in _limiters:
+            rate = DEFAULT_RATE_LIMITS.get(service)
+            _limiters[service] = TokenBucket(rate) if rate else None
+        return _limiters[service]
+
+
+def retry_delay(response, attempt):
+    """
+    Work out how long to wait before retrying a throttled or failed request.
+
+    Args:
+        response (requests.Response): The response that triggered the retry, or None.
+        attempt (int): Zero-based retry attempt.
+
+    Returns:
+        float: Delay in seconds, at most the configured max_retry_delay so a bad Retry-After
+            header cannot stall a worker.
+    """
+    delay = 2 ** attempt
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError, OverflowError):
+                pass
+    return min(max(0.0, delay), _settings["max_retry_delay"])
+
+
+def api_get(service, url, **kwargs):
+    """
+    Send a rate-limited GET request through the shared session of a service.
+
+    Requests answered with 429 or a transient 5xx status are retried, honoring the
+    Retry-After header when present. Connection errors and timeouts are retried the same way.
+
+    Args:
+        service (str): Name of the service, for example "tmdb".
+        url (str): Request URL.
+        **kwargs: Extra arguments passed to requests.Session.get.
+
+    Returns:
+        requests.Response: The final response.
+    """
+    return api_request(service, "GET", url, **kwargs)
+
+
+def api_post(service, url, **kwargs):
+    """
+    Send a rate-limited POST request through the shared session of a service, retried like api_get.
+    """
+    return api_request(service, "POST", url, **kwargs)
+
+
+def api_request(service, method, url, **kwargs):
+    """
+    Send a rate-limited request, retrying throttled and failed attempts.
+
+    Args:
+        service (str): Name of the service.
+        method (str): HTTP method, for example "GET".
+        url (str): Request URL.
+        **kwargs: Extra arguments passed to requests.Session.request. A request without a
+            "timeout" gets the configured one, so a stalled server cannot hang the run.
+
+    Returns:
+        requests.Response: The final response.
+
+    Raises:
+        requests.RequestException: If the last attempt could not connect or timed out.
+    """
+    kwargs.setdefault("timeout", _settings["timeout"])
+    session = get_session(service)
+    limiter = get_limiter(service)
+    max_retries = _settings["max_retries"]
+
+    for attempt in range(max_retries + 1):
+        if limiter:
+            start = time.perf_counter()
+            limiter.acquire()
+            metrics.record_throttle(service, time.perf_counter() - start)
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            metrics.record_http(service, time.perf_counter() - start)
+            if attempt == max_retries:
+                raise
+            delay = retry_delay(None, attempt)
+            metrics.record_throttle(service, delay, retry=True)
+            time.sleep(delay)
+            continue
+        metrics.record_http(service, time.perf_counter() - start, len(response.content))
+
+        if response.status_code not in RETRY_STATUS_CODES or attempt == max_retries:
+            return response
+
+        delay = retry_delay(response, attempt)
+        print(f"{service} returned {response.status_code}, retrying in {delay:.1f}s")
+        metrics.record_throttle(service, delay, retry=True)
+        time.sleep(delay)
+
+
+class PendingResults:
+    """
+    Results of func for a set of items, resolved on a thread pool while the caller goes on.
+
+    Items are submitted in order and the pool works through them in order. Reading the
+    result of an item waits for that item only, so the caller can act on the first results
+    while later lookups are still in flight. A lookup that fails with a network error is
+    reported and resolves to None, like a failed request.
+
+    Bounded results only keep a few lookups per worker in flight ahead of the last item read,
+    so a caller that stops early, for example when its time budget is spent, leaves the rest
+    of the items unrequested. cancel drops whatever was not read.
+
+    Args:
+        func (callable): Function taking a single item.
+        items (iterable): Items to resolve. Duplicates are resolved once.
+        on_result (callable, optional): Called with each item and its result the first time
+            the result is read, on the thread reading it.
+        known (dict, optional): Results already known, returned without calling func.
+        bounded (bool): Submit items as reading progresses instead of all up front.
+    """
+
+    def __init__(self, func, items, on_result=None, known=None, bounded=False):
+        self.func = func
+        self.on_result = on_result
+        self.delivered = dict(known or {})
+        self.pending = [item for item in dict.fromkeys(items) if item not in self.delivered]
+        self.positions = {item: position for position, item in enumerate(self.pending)}
+        self.futures = {}
+        self.ahead = _settings["max_workers"] * LOOKAHEAD_PER_WORKER if bounded else len(self.pending)
+        self.executor = ThreadPoolExecutor(max_workers=_settings["max_workers"]) if self.pending else None
+        self.submit_until(self.ahead)
+
+    def submit_until(self, count):
+        if self.executor is None:
+            return
+        for item in self.pending[len(self.futures):count]:
+            self.futures[item] = self.executor.submit(self.resolve, self.func, item)
+        if len(self.futures) == len(self.pending):
+            # The pool winds down by itself once the last item is resolved
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    @staticmethod
+    def resolve(func, item):
+        try:
+            return func(item)
+        except requests.RequestException as e:
+            # One unreachable lookup leaves its item unresolved instead of ending the run
+            print(f"Lookup of '{item}' failed: {e}")
+            return None
+
+    def get(self, item, default=None):
+        """
+        Return the result of an item, waiting for its lookup to finish.
+
+        Raises:
+            Exception: Whatever func raised for the item.
+        """
+        if item in self.delivered:
+            return self.delivered[item]
+        if item not in self.positions:
+            return default
+        self.submit_until(self.positions[item] + 1 + self.ahead)
+        future = self.futures.get(item)
+        if future is None or future.cancelled():
+            return default
+        result = future.result()
+        self.delivered[item] = result
+        if self.on_result:
+            self.on_result(item, result)
+        return result
+
+    def cancel(self):
+        """
+        Stop resolving the items that were not read. Lookups that already finished are still
+        delivered, those not started yet are dropped, and those running are left to finish.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        for item, future in list(self.futures.items()):
+            if item not in self.delivered and future.done() and not future.cancelled():
+                self.get(item)
+        self.pending = [item for item in self.pending if item in self.delivered]
+        self.positions = {item: position for position, item in enumerate(self.pending)}
@@ -0,0 +1,148 @@
+import os
+import re
+import time
+import shutil
+import zipfile
+import metrics
+
+# Extensions of the poster-set archives read in place of a directory
+ARCHIVE_EXTENSIONS = (".zip",)
+
+# Member names that mark a set as a series set
+SERIES_MEMBER_PATTERN = re.compile(r"\bSeason \d+|\bSpecials\b")
+
+
+def is_archive(path):
+    """
+    Check whether a path names a poster-set archive, by extension.
+    """
+    return str(path).lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def list_archive(archive_path):
+    """
+    List the files of an archive without extracting anything.
+
+    Directory entries, macOS resource forks, hidden files and members whose names would
+    leave the archive ("../") are skipped.
+
+    Args:
+        archive_path (str): Path to the archive.
+
+    Returns:
+        list: (member name, relative path parts, uncompressed size, mtime in ns) tuples, in archive order.
+
+    Raises:
+        OSError: If the archive cannot be read.
+    """
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            infos = archive.infolist()
+    except zipfile.BadZipFile as e:
+        raise OSError(f"Not a readable ZIP archive: {archive_path} ({e})")
+
+    members = []
+    for info in infos:
+        if info.is_dir():
+            continue
+        parts = [part for part in info.filename.replace("\\", "/").split("/") if part]
+        if not parts or "__MACOSX" in parts or parts[-1].startswith("."):
+            continue
+        if any(part in (".", "..") for part in parts) or info.filename.startswith("/"):
+            continue
+        mtime = int(time.mktime(info.date_time + (0, 0, -1)) * 1_000_000_000)
+        members.append((info.filename, parts, info.file_size, mtime))
+    return members
+
+
+def archive_kind(members):
+    """
+    Guess whether an archive holds a movie set or a series set from its member names.
+
+    Returns:
+        str: "series" if any member is a season or specials poster, otherwise "movies".
+    """
+    if any(SERIES_MEMBER_PATTERN.search(parts[-1]) for _, parts, _, _ in members):
+        return "series"
+    return "movies"
+
+
+def archive_root(unsorted_dir, archive_path):
+    """
+    Return the virtual directory an archive given on the command line is read as.
+
+    Series sets are read as a folder of the unsorted "series" directory and every other set
+    as a folder of the "movies" directory, as if the archive had been extracted there.
+
+    Args:
+        unsorted_dir (str): Path to the unsorted directory.
+        archive_path (str): Path to the archive.
+
+    Returns:
+        str: Path of the virtual directory.
+
+    Raises:
+        OSError: If the archive cannot be read.
+    """
+    return os.path.join(unsorted_dir, archive_kind(list_archive(archive_path)), os.path.basename(archive_path))
+
+
+class ArchiveCache:
+    """
+    Keeps each archive open while its members are read, so the central directory is parsed once.
+    """
+
+    def __init__(self):
+        self.archives = {}
+
+    def open_member(self, archive_path, member):
+        """
+        Open a member of an archive for reading, as a binary file object.
+        """
+        archive = self.archives.get(archive_path)
+        if archive is None:
+            try:
+                archive = zipfile.ZipFile(archive_path)
+            except zipfile.BadZipFile as e:
+                raise OSError(f"Not a readable ZIP archive: {archive_path} ({e})")
+            self.archives[archive_path] = archive
+        return archive.open(member)
+
+    def close(self):
+        for archive in self.archives.values():
+            archive.close()
+        self.archives.clear()
+
+
+def extract_member(archive_path, member, target, archives=None):
+    """
+    Stream one archive member to its target path without writing it anywhere else first.
+
+    The member is written to a temporary name next to the target and renamed into place
+    once complete, so the target never holds a partial file. The archive is left untouched.
+
+    Args:
+        archive_path (str): Path to the archive.
+        member (str): Name of the member in the archive.
+        target (str): Destination path.
+        archives (ArchiveCache, optional): Open archives shared across extractions.
+    """
+    target = str(target)
+    own_archives = archives is None
+    archives = archives or ArchiveCache()
+    partial = os.path.join(os.path.dirname(target), f".{os.path.basename(target)}.partial")
+    try:
+        with archives.open_member(archive_path, member) as source, open(partial, "wb") as target_file:
+            shutil.copyfileobj(source, target_file)
+            size = target_file.tell()
+        os.replace(partial, target)
+    except (OSError, zipfile.BadZipFile) as e:
+        if os.path.exists(partial):
+            os.remove(partial)
+        if isinstance(e, zipfile.BadZipFile):
+            raise OSError(f"Failed to read {member} from {archive_path}: {e}")
+        raise
+    finally:
+        if own_archives:
+            archives.close()
+    metrics.record_move(size)
@@ -0,0 +1,327 @@
+import os
+import json
+import time
+import metrics
+from scan_manifest import ScanManifest
+
+# Top-level folders of the sorted tree tracked by the index
+ASSET_KINDS = ("movies", "series", "collections")
+
+# Version of the persisted index layout; other versions are rebuilt
+ASSET_INDEX_VERSION = 1
+
+# Artwork every library item should have, by file name without extension. Series also need
+# one SeasonNN image per Sonarr season.
+DEFAULT_MOVIE_ASSETS = ("poster",)
+DEFAULT_SERIES_ASSETS = ("poster",)
+
+
+def season_asset(season):
+    """
+    Return the name of the image of a season, as the default rename rules write it.
+    """
+    return f"Season{season:02d}"
+
+
+def movie_directory(movie):
+    """
+    Return the sorted directory of a Radarr movie relative to the sorted tree, as create_movie_directory builds it.
+
+    Returns:
+        str: For example "movies/Heat (1995)", or None if Radarr has no usable path.
+    """
+    if not movie.path or not movie.root_folder_path:
+        return None
+    return "/".join(("movies", os.path.relpath(movie.path, movie.root_folder_path).replace(os.sep, "/")))
+
+
+def series_directory(series):
+    """
+    Return the sorted directory of a Sonarr series relative to the sorted tree, as create_series_directory builds it.
+
+    Returns:
+        str: For example "series/Dark (2017)", or None if Sonarr has no path for the series.
+    """
+    if not series.path:
+        return None
+    return f"series/{os.path.basename(series.path)}"
+
+
+class AssetIndex:
+    """
+    Persistent index of the artwork in the sorted tree: the file names in every movie,
+    series and collection directory.
+
+    The index is built from a scan of the sorted tree once, then kept up to date from the
+    operations each run applies, so later runs and reports never walk the tree again.
+    Directories are keyed by their path relative to the sorted tree with "/" separators.
+    """
+
+    def __init__(self, sorted_dir, directories=None):
+        self.sorted_dir = os.path.normpath(str(sorted_dir))
+        self.directories = {key: set(names) for key, names in (directories or {}).items()}
+
+    def __len__(self):
+        return len(self.directories)
+
+    def relative(self, path):
+        """
+        Return a path relative to the sorted tree with "/" separators, or None if it lies outside the tracked folders.
+        """
+        path = os.path.normpath(str(path))
+        if not path.startswith(self.sorted_dir + os.sep):
+            return None
+        relative = os.path.relpath(path, self.sorted_dir).replace(os.sep, "/")
+        if relative.split("/", 1)[0] not in ASSET_KINDS:
+            return None
+        return relative
+
+    @classmethod
+    def from_manifest(cls, sorted_dir, manifest):
+        """
+        Build the index from a scan manifest holding the sorted tree.
+        """
+        index = cls(sorted_dir)
+        for kind in ASSET_KINDS:
+            root = os.path.join(index.sorted_dir, kind)
+            for entry in manifest.files(under=root):
+                index.add_file(entry.path)
+            for dir_path in manifest.directories:
+                if dir_path.startswith(root + os.sep):
+                    index.add_directory(dir_path)
+        return index
+
+    @classmethod
+    def scan(cls, sorted_dir):
+        """
+        Build the index with one walk of the sorted tree.
+        """
+        manifest = ScanManifest()
+        for kind in ASSET_KINDS:
+            manifest.scan(os.path.join(sorted_dir, kind))
+        return cls.from_manifest(sorted_dir, manifest)
+
+    def add_directory(self, path):
+        relative = self.relative(path)
+        if relative and "/" in relative:
+            self.directories.setdefault(relative, set())
+
+    def remove_directory(self, path):
+        relative = self.relative(path)
+        if relative:
+            self.directories.pop(relative, None)
+
+    def rename_directory(self, source, target):
+        """
+        Move a directory and the directories below it to a new path.
+        """
+        old = self.relative(source)
+        new = self.relative(target)
+        for relative in [key for key in self.directories if key == old or key.startswith(old + "/")]:
+            names = self.directories.pop(relative)
+            if new and "/" in new:
+                self.directories[new + relative[len(old):]] = names
+
+    def add_file(self, path):
+        relative = self.relative(os.path.dirname(os.path.normpath(str(path))))
+        if relative and "/" in relative:
+            self.directories.setdefault(relative, set()).add(os.path.basename(str(path)))
+
+    def remove_file(self, path):
+        relative = self.relative(os.path.dirname(os.path.normpath(str(path))))
+        if relative in self.directories:
+            self.directories[relative].discard(os.path.basename(str(path)))
+
+    def record_operations(self, operations):
+        """
+        Update the index with applied plan operations. Paths outside the sorted tree are ignored.
+
+        Args:
+            operations (iterable): Operations as stored in a Plan.
+        """
+        for operation in operations:
+            kind = operation[0]
+            if kind == "mkdir":
+                self.add_directory(operation[1])
+            elif kind == "rmdir":
+                self.remove_directory(operation[1])
+            elif kind == "remove":
+                self.remove_file(operation[1])
+            elif kind == "rename" and self.relative(operation[1]) in self.directories:
+                self.rename_directory(operation[1], operation[2])
+            elif kind in ("move", "rename"):
+                self.remove_file(operation[1])
+                self.add_file(operation[2])
+            elif kind == "extract":
+                self.add_file(operation[3])
+
+    def assets(self, relative):
+        """
+        Return the lowercase file names without extension in a directory, or None if the directory is not in the index.
+        """
+        names = self.directories.get(relative)
+        if names is None:
+            return None
+        return {os.path.splitext(name)[0].lower() for name in names}
+
+    def missing(self, relative, required):
+        """
+        Return the required assets a directory lacks, in the order given.
+
+        Args:
+            relative (str): Directory relative to the sorted tree.
+            required (iterable): Asset names without extension, such as "poster" or "Season01".
+
+        Returns:
+            list: Missing asset names. Every required asset is missing when the directory does not exist.
+        """
+        assets = self.assets(relative) or set()
+        return [name for name in required if name.lower() not in assets]
+
+    def save(self, path):
+        """
+        Persist the index to disk, replacing the previous copy atomically.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        payload = {
+            "version": ASSET_INDEX_VERSION,
+            "created": time.time(),
+            "sorted_dir": self.sorted_dir,
+            "directories": {key: sorted(names) for key, names in sorted(self.directories.items())},
+        }
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(payload, file, separators=(",", ":"))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def read(cls, path, sorted_dir):
+        """
+        Read a persisted index of a sorted tree.
+
+        Returns:
+            AssetIndex: The index, or None if missing, unreadable or built for another tree.
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as file:
+                payload = json.load(file)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Ignoring unreadable asset index '{path}': {e}")
+            return None
+        if payload.get("version") != ASSET_INDEX_VERSION:
+            return None
+        if payload.get("sorted_dir") != os.path.normpath(str(sorted_dir)):
+            return None
+        return cls(sorted_dir, payload.get("directories", {}))
+
+
+def load_asset_index(sorted_dir, cache_path=None, manifest=None):
+    """
+    Load the asset index of a sorted tree, building it when no persisted copy exists.
+
+    Args:
+        sorted_dir (str): Path to the sorted directory.
+        cache_path (str, optional): Path of the persisted index.
+        manifest (ScanManifest, optional): Scan holding the complete sorted tree. When given,
+            the index is rebuilt from it instead of being read, at no extra cost.
+
+    Returns:
+        AssetIndex: The index.
+    """
+    if manifest is not None:
+        return AssetIndex.from_manifest(sorted_dir, manifest)
+    if cache_path:
+        index = AssetIndex.read(cache_path, sorted_dir)
+        if index is not None:
+            metrics.record_cache_hit("asset_index")
+            return index
+    print("Building the asset index from the sorted directory...")
+    return AssetIndex.scan(sorted_dir)
+
+
+def invalidate_asset_index(cache_path):
+    """
+    Delete a persisted asset index that may no longer match the sorted tree, so it is rebuilt on next use.
+    """
+    if cache_path and os.path.exists(cache_path):
+        os.remove(cache_path)
+
+
+def missing_artwork(asset_index, radarr_index=None, sonarr_index=None, coverage_config=None):
+    """
+    Compare the asset index with the Radarr and Sonarr libraries and list the missing artwork.
+
+    Every library item is looked up once in the index, so the report takes time in proportion
+    to the size of the library and never touches the sorted tree.
+
+    Args:
+        asset_index (AssetIndex): Index of the sorted tree.
+        radarr_index (dict, optional): Radarr library index keyed by TMDB ID.
+        sonarr_index (SonarrIndex, optional): Sonarr library index.
+        coverage_config (dict, optional): The "coverage" configuration section, with
+            "movie_assets", "series_assets", "seasons" and "specials".
+
+    Returns:
+        list: Dicts with "kind", "title", "year", "directory" (relative to the sorted tree)
+            and "missing" (asset names), for every item missing at least one asset.
+    """
+    coverage_config = coverage_config or {}
+    movie_assets = coverage_config.get("movie_assets", DEFAULT_MOVIE_ASSETS)
+    series_assets = coverage_config.get("series_assets", DEFAULT_SERIES_ASSETS)
+    include_seasons = coverage_config.get("seasons", True)
+    include_specials = coverage_config.get("specials", False)
+
+    report = []
+    for movie in (radarr_index or {}).values():
+        directory = movie_directory(movie)
+        missing = asset_index.missing(directory, movie_assets) if directory else list(movie_assets)
+        if missing:
+            report.append({"kind": "movie", "title": movie.title, "year": movie.year, "directory": directory,
+                           "missing": missing})
+
+    for series in sonarr_index.series if sonarr_index else ():
+        required = list(series_assets)
+        if include_seasons:
+            required.extend(season_asset(season) for season in series.seasons or ()
+                            if season > 0 or include_specials)
+        directory = series_directory(series)
+        missing = asset_index.missing(directory, required) if directory else required
+        if missing:
+            report.append({"kind": "series", "title": series.title, "year": series.year, "directory": directory,
+                           "missing": missing})
+    return report
+
+
+def write_missing_report(report, sorted_dir, path):
+    """
+    Write a missing-artwork report as JSON, with the list of sorted directories to target next.
+
+    Args:
+        report (list): Items returned by missing_artwork.
+        sorted_dir (str): Path to the sorted directory.
+        path (str): Path of the JSON file to write.
+    """
+    directories = sorted({os.path.join(sorted_dir, *item["directory"].split("/"))
+                          for item in report if item["directory"]})
+    payload = {"created": time.time(), "sorted_dir": sorted_dir, "items": report, "directories": directories}
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(payload, file, indent=4)
+    os.replace(temp_path, path)
+
+
+def read_missing_directories(path):
+    """
+    Read the sorted directories listed by the last missing-artwork report.
+
+    Returns:
+        list: Directory paths, or None if there is no readable report.
+    """
+    try:
+        with open(path, "r") as file:
+            return json.load(file).get("directories", [])
+    except (OSError, json.JSONDecodeError):
+        return None
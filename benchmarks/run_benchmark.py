@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+
+# The benchmark drives the modules of the repository root directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+import kometa_posters
+from api_client import configure_services
+from disambiguation import DisambiguationQueue
+from stub_services import StubServices
+from synthetic_tree import generate_tree
+
+# Default tree sizes, in unsorted posters
+DEFAULT_SIZES = (1000, 10000)
+
+# Steps recorded by metrics.step, in the order a run goes through them, with their labels.
+# The apply stage runs alongside the other steps; its busy time is reported.
+STEP_LABELS = (
+    ("library_index", "   library index"),
+    ("scan", "   scan"),
+    ("collections", "1. collection posters"),
+    ("movie_directories", "2. movie directories"),
+    ("series_directories", "3. series directories"),
+    ("disambiguation", "   queued selections"),
+    ("movie_moves", "4. movie poster moves"),
+    ("series_moves", "5. series poster moves"),
+    ("cleanup", "6. empty directories"),
+    ("movie_renames", "7. movie renames"),
+    ("series_renames", "8. series renames"),
+    ("apply", "   apply stage (busy)"),
+)
+
+
+def benchmark_config(base_url, cache_dir, rate_limit, max_workers, sonarr_index=False):
+    """
+    Build a configuration pointing every service at the stand-in.
+    """
+    config = {service: {"api_key": "benchmark", "base_url": base_url, "rate_limit": rate_limit}
+              for service in ("radarr", "sonarr", "tmdb")}
+    config["sonarr"]["library_index"] = sonarr_index
+    config["tautulli"] = {"api_key": "benchmark", "base_url": f"{base_url}/api/v2"}
+    config["mdblist"] = {"api_key": "benchmark", "base_url": base_url, "enabled": True}
+    config["cache"] = {"directory": cache_dir}
+    config["network"] = {"max_workers": max_workers}
+    return config
+
+
+def run_size(posters, args):
+    """
+    Generate a tree of the given size and time one full pipeline run over it.
+
+    Returns:
+        dict: Timings, request counts and tree counts of the run.
+    """
+    work_dir = tempfile.mkdtemp(prefix=f"kometa-bench-{posters}-", dir=args.work_dir)
+    try:
+        start = time.perf_counter()
+        counts = generate_tree(work_dir, posters, args.seed)
+        generate_seconds = time.perf_counter() - start
+
+        services = StubServices(
+            movies=max(counts["movies_needed"], args.library_movies),
+            series=max(counts["series_needed"], args.library_series),
+            latency=args.latency,
+            jitter=args.jitter,
+        )
+        with services:
+            config = benchmark_config(services.base_url, os.path.join(work_dir, "cache"), args.rate_limit,
+                                      args.max_workers, args.sonarr_index)
+            configure_services(config)
+            queue = DisambiguationQueue(os.path.join(work_dir, "disambiguation_queue.json"))
+
+            run_metrics = metrics.start_run()
+            start = time.perf_counter()
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                with metrics.step("library_index"):
+                    radarr_index = kometa_posters.load_library_index(config)
+                    sonarr_index = kometa_posters.load_series_index(config)
+                kometa_posters.run_pipeline(
+                    sorted_dir=os.path.join(work_dir, "sorted"),
+                    unsorted_dir=os.path.join(work_dir, "unsorted"),
+                    config=config,
+                    radarr_index=radarr_index,
+                    disambiguation_queue=queue,
+                    sonarr_index=sonarr_index,
+                )
+            total = time.perf_counter() - start
+
+            # Step timings come from the run metrics, like the run report
+            labels = dict(STEP_LABELS)
+            timings = {labels.get(name, f"   {name}"): step.wall_time for name, step in run_metrics.steps.items()
+                       if step.wall_time}
+
+        return {
+            "posters": posters,
+            "generate_seconds": generate_seconds,
+            "total_seconds": total,
+            "steps": dict(timings),
+            "requests": dict(services.requests),
+            "queued": len(queue),
+            "tree": counts,
+        }
+    finally:
+        if args.keep:
+            print(f"Kept benchmark tree in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def print_results(results):
+    labels = [label for _, label in STEP_LABELS]
+    labels += sorted({label for result in results for label in result["steps"]} - set(labels))
+    header = f"{'step':<26}" + "".join(f"{result['posters']:>12,}" for result in results)
+    print(header)
+    print("-" * len(header))
+    for label in labels:
+        print(f"{label:<26}" + "".join(f"{result['steps'].get(label, 0.0):>12.3f}" for result in results))
+    print("-" * len(header))
+    print(f"{'total':<26}" + "".join(f"{result['total_seconds']:>12.3f}" for result in results))
+    print(f"{'tree generation':<26}" + "".join(f"{result['generate_seconds']:>12.3f}" for result in results))
+    endpoints = sorted({endpoint for result in results for endpoint in result["requests"]})
+    for endpoint in endpoints:
+        print(f"{'GET ' + endpoint:<26}" + "".join(f"{result['requests'].get(endpoint, 0):>12,}" for result in results))
+    print(f"{'left in queue':<26}" + "".join(f"{result['queued']:>12,}" for result in results))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the poster pipeline on synthetic trees.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help="Tree sizes in unsorted posters (default: 1000 10000). 100000 is supported.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Stand-in delay per request in seconds (default: 0).")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random delay per request in seconds.")
+    parser.add_argument("--library-movies", type=int, default=0,
+                        help="Minimum number of movies in the stand-in library. Defaults to what the tree needs.")
+    parser.add_argument("--library-series", type=int, default=0,
+                        help="Minimum number of series in the stand-in library. Defaults to what the tree needs.")
+    parser.add_argument("--rate-limit", type=float, default=0,
+                        help="Requests per second per service. 0 disables rate limiting (default).")
+    parser.add_argument("--max-workers", type=int, default=8, help="Concurrent lookups (default: 8).")
+    parser.add_argument("--sonarr-index", action="store_true",
+                        help="Resolve series from the Sonarr library index instead of /series/lookup.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the trees (default: 0).")
+    parser.add_argument("--work-dir", help="Directory to generate the trees in. Defaults to the system temp directory.")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated trees.")
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    results = []
+    for posters in args.sizes:
+        print(f"Running benchmark with {posters:,} posters...", file=sys.stderr)
+        results.append(run_size(posters, args))
+
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+import json
+import bisect
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Maximum number of results returned by one search or lookup, like a TMDB results page
+RESULTS_PER_PAGE = 20
+
+
+def movie_title(movie_id):
+    return f"Movie {movie_id}"
+
+
+def movie_year(movie_id):
+    return 1980 + movie_id % 45
+
+
+def series_title(series_id):
+    return f"Show {series_id}"
+
+
+def series_year(series_id):
+    return 1990 + series_id % 35
+
+
+def play_count(item_id):
+    """
+    Synthetic Tautulli play count, spread unevenly so priority ordering has something to sort.
+    """
+    return (item_id * 37) % 101
+
+
+def movie_library(size):
+    """
+    Build a Radarr /movie payload with `size` movies. Movie n has TMDB ID n.
+    """
+    movies = []
+    for movie_id in range(1, size + 1):
+        folder = f"{movie_title(movie_id)} ({movie_year(movie_id)})"
+        movies.append({
+            "tmdbId": movie_id,
+            "imdbId": f"tt{movie_id:07d}",
+            "title": movie_title(movie_id),
+            "year": movie_year(movie_id),
+            "path": f"/media/movies/{folder}",
+            "rootFolderPath": "/media/movies",
+            "overview": f"Synthetic movie {movie_id}.",
+        })
+    return movies
+
+
+def series_library(size):
+    """
+    Build a Sonarr series payload with `size` series. Series n has TVDB ID n and TMDB ID 500000 + n,
+    as the MDBList stand-in reports.
+    """
+    series = []
+    for series_id in range(1, size + 1):
+        folder = f"{series_title(series_id)} ({series_year(series_id)})"
+        series.append({
+            "tvdbId": series_id,
+            "tmdbId": 500000 + series_id,
+            "title": series_title(series_id),
+            "year": series_year(series_id),
+            "path": f"/media/tv/{folder}",
+            "seasons": [{"seasonNumber": number} for number in range(0, 13)],
+            "overview": f"Synthetic series {series_id}.",
+        })
+    return series
+
+
+class TitleIndex:
+    """
+    Title lookup answering like a search engine: the exact title first, then titles starting with the query.
+    """
+
+    def __init__(self, items):
+        self.by_title = {}
+        for item in items:
+            self.by_title.setdefault(item["title"].lower(), []).append(item)
+        self.titles = sorted(self.by_title)
+
+    def search(self, query, page=1):
+        query = query.lower().strip()
+        matches = list(self.by_title.get(query, []))
+        # Titles sharing the prefix are adjacent in sorted order
+        position = bisect.bisect_left(self.titles, query)
+        while position < len(self.titles) and len(matches) < page * RESULTS_PER_PAGE:
+            title = self.titles[position]
+            if not title.startswith(query):
+                break
+            if title != query:
+                matches.extend(self.by_title[title])
+            position += 1
+        start = (page - 1) * RESULTS_PER_PAGE
+        return matches[start:start + RESULTS_PER_PAGE]
+
+
+class StubServices:
+    """
+    Local HTTP stand-in for the Radarr, Sonarr, TMDB, Tautulli and MDBList endpoints used by the pipeline.
+
+    Serves GET /movie (Radarr library), GET /series (Sonarr library), GET /series/lookup?term=,
+    GET /search/movie?query=&page=, the Tautulli GET /api/v2?cmd=get_libraries and
+    cmd=get_library_media_info&section_id= commands and the MDBList batch lookups
+    POST /{imdb,tmdb,tvdb}/{movie,show} from synthetic libraries, with an optional delay per
+    request to mimic network latency.
+
+    Args:
+        movies (int): Number of movies in the Radarr library and TMDB.
+        series (int): Number of series in the Sonarr library.
+        latency (float): Seconds to wait before answering each request.
+        jitter (float): Extra random delay of up to this many seconds per request.
+    """
+
+    def __init__(self, movies=1000, series=200, latency=0.0, jitter=0.0, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        self.movies = movie_library(movies)
+        self.series = series_library(series)
+        self.movie_search = TitleIndex(self.movies)
+        self.series_search = TitleIndex(self.series)
+        # The library payloads are large and never change, so they are encoded once
+        self.movies_body = json.dumps(self.movies).encode()
+        self.series_body = json.dumps(self.series).encode()
+        # MDBList IDs of every item, looked up by (media type, source, ID)
+        self.media_ids = {}
+        for movie in self.movies:
+            ids = {"imdb": movie["imdbId"], "tmdb": movie["tmdbId"], "tvdb": None}
+            for source, value in ids.items():
+                self.media_ids[("movie", source, value)] = ids
+        for series in self.series:
+            ids = {"imdb": f"tt{9000000 + series['tvdbId']}", "tmdb": 500000 + series["tvdbId"], "tvdb": series["tvdbId"]}
+            for source, value in ids.items():
+                self.media_ids[("show", source, value)] = ids
+
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                services.handle(self)
+
+            def do_POST(self):
+                services.handle(self)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def tautulli(self, query):
+        """
+        Answer a Tautulli command: section 1 holds the movies and section 2 the series.
+        """
+        if query.get("cmd", [""])[0] == "get_libraries":
+            return [{"section_id": "1", "section_type": "movie"}, {"section_id": "2", "section_type": "show"}]
+        items = self.movies if query.get("section_id", [""])[0] == "1" else self.series
+        id_key = "tmdbId" if items is self.movies else "tvdbId"
+        return {"data": [
+            {
+                "title": item["title"],
+                "year": item["year"],
+                "play_count": play_count(item[id_key]),
+                "added_at": str(1_600_000_000 + item[id_key]),
+            }
+            for item in items
+        ]}
+
+    def handle(self, handler):
+        url = urlparse(handler.path)
+        query = parse_qs(url.query)
+        path = url.path.rstrip("/")
+
+        if handler.command == "POST":
+            length = int(handler.headers.get("Content-Length") or 0)
+            request = json.loads(handler.rfile.read(length) or b"{}")
+            source, media_type = (["", ""] + path.strip("/").split("/"))[-2:]
+            endpoint = f"POST /{source}/{media_type}"
+            found = [self.media_ids.get((media_type, source, value)) for value in request.get("ids", [])]
+            body = json.dumps([{"ids": ids} for ids in found if ids]).encode()
+        elif path.endswith("/search/movie"):
+            endpoint = "/search/movie"
+            page = int(query.get("page", ["1"])[0])
+            results = self.movie_search.search(query.get("query", [""])[0], page)
+            body = json.dumps({
+                "page": page,
+                "results": [
+                    {
+                        "id": movie["tmdbId"],
+                        "title": movie["title"],
+                        "release_date": f"{movie['year']}-01-01",
+                        "overview": movie["overview"],
+                    }
+                    for movie in results
+                ],
+            }).encode()
+        elif path.endswith("/series/lookup"):
+            endpoint = "/series/lookup"
+            body = json.dumps(self.series_search.search(query.get("term", [""])[0])).encode()
+        elif path.endswith("/series"):
+            endpoint = "/series"
+            body = self.series_body
+        elif path.endswith("/movie"):
+            endpoint = "/movie"
+            body = self.movies_body
+        elif path.endswith("/api/v2"):
+            endpoint = f"tautulli {query.get('cmd', [''])[0]}"
+            body = json.dumps({"response": {"result": "success", "data": self.tautulli(query)}}).encode()
+        else:
+            endpoint = "unknown"
+            body = None
+
+        with self.lock:
+            self.requests[endpoint] += 1
+
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+        if body is None:
+            handler.send_response(404)
+            handler.send_header("Content-Length", "0")
+            handler.end_headers()
+            return
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve synthetic Radarr, Sonarr, TMDB, Tautulli and MDBList endpoints.")
+    parser.add_argument("--movies", type=int, default=1000, help="Number of movies in the library (default: 1000).")
+    parser.add_argument("--series", type=int, default=200, help="Number of series in the library (default: 200).")
+    parser.add_argument("--latency", type=float, default=0.0, help="Delay per request in seconds (default: 0).")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random delay per request in seconds.")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default: 8765).")
+    args = parser.parse_args(argv)
+
+    services = StubServices(args.movies, args.series, args.latency, args.jitter, port=args.port)
+    print(f"Serving {args.movies} movies and {args.series} series on {services.base_url}. Press Ctrl+C to stop.")
+    try:
+        services.server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\nRequests served: {dict(services.requests)}")
+    finally:
+        services.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
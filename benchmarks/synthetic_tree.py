@@ -0,0 +1,130 @@
+import os
+import random
+import argparse
+from collections import Counter
+
+from stub_services import movie_title, movie_year, series_title, series_year
+
+# Share of the posters generated for each kind
+COLLECTION_SHARE = 0.02
+MOVIE_SHARE = 0.48
+
+# Share of the movies that already have a sorted directory, and of those that already have a poster
+EXISTING_MOVIE_SHARE = 0.3
+EXISTING_POSTER_SHARE = 0.5
+
+# Movie posters are grouped in set folders of this size, like extracted poster packs
+SET_SIZE = 25
+
+# Small valid JPEG and PNG headers, so the files look like images without taking space
+JPEG_BYTES = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00\xff\xd9"
+PNG_BYTES = b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x02\x00\x00\x00"
+
+
+def write_poster(path, extension):
+    # The file name is embedded so no two posters have the same contents, like real artwork
+    name = os.path.basename(path).encode()
+    with open(path, "wb") as file:
+        if extension == ".png":
+            file.write(PNG_BYTES + name)
+        else:
+            # JPEG comment segment placed before the end-of-image marker
+            file.write(JPEG_BYTES[:-2] + b"\xff\xfe" + (len(name) + 2).to_bytes(2, "big") + name + JPEG_BYTES[-2:])
+
+
+def series_poster_names(series_id, rng):
+    """
+    Return the poster names of one series: the series poster, a few seasons and sometimes specials.
+    """
+    name = f"{series_title(series_id)} ({series_year(series_id)})"
+    names = [name]
+    # Season numbers past 9 catch "Season 1" being confused with "Season 12"
+    for season in sorted(rng.sample(range(1, 13), rng.randint(1, 6))):
+        names.append(f"{name} - Season {season}")
+    if rng.random() < 0.3:
+        names.append(f"{name} - Specials")
+    return names
+
+
+def generate_tree(root, posters, seed=0):
+    """
+    Generate a synthetic unsorted/sorted tree under root.
+
+    The unsorted tree holds collection, movie, series, season and specials posters. Some movie
+    posters sit in set folders, and part of the movies already have a sorted directory. Movie n
+    and series n match the entries with ID n served by StubServices.
+
+    Args:
+        root (str): Directory to create "sorted" and "unsorted" in.
+        posters (int): Number of unsorted posters to generate.
+        seed (int): Seed for the random choices.
+
+    Returns:
+        dict: Counts of the generated files and the library sizes needed to match them,
+            under "movies_needed" and "series_needed".
+    """
+    rng = random.Random(seed)
+    sorted_dir = os.path.join(root, "sorted")
+    unsorted_movies = os.path.join(root, "unsorted", "movies")
+    unsorted_series = os.path.join(root, "unsorted", "series")
+    for dir_path in (os.path.join(sorted_dir, "movies"), os.path.join(sorted_dir, "series"), unsorted_movies, unsorted_series):
+        os.makedirs(dir_path, exist_ok=True)
+
+    counts = Counter()
+    collections = max(1, int(posters * COLLECTION_SHARE))
+    movies = max(1, int(posters * MOVIE_SHARE))
+    series_posters = max(1, posters - collections - movies)
+
+    for collection_id in range(1, collections + 1):
+        write_poster(os.path.join(unsorted_movies, f"Saga {collection_id} Collection.jpg"), ".jpg")
+        counts["collection"] += 1
+
+    for movie_id in range(1, movies + 1):
+        name = f"{movie_title(movie_id)} ({movie_year(movie_id)})"
+        extension = ".png" if rng.random() < 0.2 else ".jpg"
+        set_id = (movie_id - 1) // SET_SIZE
+        dir_path = unsorted_movies if set_id % 2 == 0 else os.path.join(unsorted_movies, f"Poster Set {set_id}")
+        os.makedirs(dir_path, exist_ok=True)
+        write_poster(os.path.join(dir_path, name + extension), extension)
+        counts["movie"] += 1
+
+        if rng.random() < EXISTING_MOVIE_SHARE:
+            movie_dir = os.path.join(sorted_dir, "movies", name)
+            os.makedirs(movie_dir, exist_ok=True)
+            counts["sorted_movie_dir"] += 1
+            if rng.random() < EXISTING_POSTER_SHARE:
+                write_poster(os.path.join(movie_dir, "poster.jpg"), ".jpg")
+                counts["sorted_poster"] += 1
+
+    series_id = 0
+    while counts["series"] + counts["season"] + counts["specials"] < series_posters:
+        series_id += 1
+        for index, name in enumerate(series_poster_names(series_id, rng)):
+            extension = ".png" if rng.random() < 0.2 else ".jpg"
+            write_poster(os.path.join(unsorted_series, name + extension), extension)
+            if index == 0:
+                counts["series"] += 1
+            elif name.endswith("Specials"):
+                counts["specials"] += 1
+            else:
+                counts["season"] += 1
+
+    result = dict(counts)
+    result["movies_needed"] = movies
+    result["series_needed"] = series_id
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic Kometa poster tree.")
+    parser.add_argument("root", help="Directory to create the sorted and unsorted trees in.")
+    parser.add_argument("--posters", type=int, default=1000, help="Number of unsorted posters (default: 1000).")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0).")
+    args = parser.parse_args(argv)
+
+    counts = generate_tree(args.root, args.posters, args.seed)
+    print(f"Generated tree in {args.root}: {counts}")
+
+
+if __name__ == "__main__":
+    main()
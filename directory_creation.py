@@ -1,11 +1,246 @@
 import os
 import re
-import requests
 from pathlib import Path
 from collections import defaultdict
+import requests
+import metrics
+from api_client import api_get, PendingResults
+from library_index import load_radarr_index, series_result, find_radarr_movie
+from id_tags import parse_id_tags, id_tag_keys, format_id_tags
+from disambiguation import movie_candidate, series_candidate
+from plan import make_directory
+from mdblist import resolve_id_tags, cross_reference
+from scan_manifest import SERIES_CATEGORIES
+
+# Language requested from TMDB searches
+TMDB_LANGUAGE = "en-US"
+
+
+def fetch_tmdb_search(tmdb_config, search_query, page=1):
+    """
+    Send a TMDB movie search request.
+
+    Args:
+        tmdb_config (dict): Configuration for accessing the TMDB API.
+        search_query (str): Movie title to search for.
+        page (int): Page of results to request.
+
+    Returns:
+        list: Search results, or None if the request failed.
+    """
+    try:
+        response = api_get("tmdb", f"{tmdb_config.get('base_url')}/search/movie", params={
+            "api_key": tmdb_config.get("api_key"),
+            "query": search_query,
+            "language": TMDB_LANGUAGE,  # Specify the language
+            "page": page  # Handle pagination
+        })
+    except requests.RequestException as e:
+        print(f"Error searching TMDB: {e}")
+        return None
+
+    if response.status_code != 200:
+        print(f"Error searching TMDB: {response.status_code} - {response.json().get('status_message', 'Unknown error')}")
+        return None
+
+    return response.json().get("results", [])
+
+
+def search_tmdb_movies(tmdb_config, search_query, page=1, tmdb_cache=None):
+    """
+    Search TMDB for movies matching a query, using the cache when available.
+
+    Args:
+        tmdb_config (dict): Configuration for accessing the TMDB API.
+        search_query (str): Movie title to search for.
+        page (int): Page of results to request.
+        tmdb_cache (TMDBCache, optional): Cache of previous search results.
+
+    Returns:
+        list: Search results, or None if the request failed.
+    """
+    if tmdb_cache:
+        results = tmdb_cache.get_search(search_query, language=TMDB_LANGUAGE, page=page)
+        if results is not None:
+            return results
+
+    results = fetch_tmdb_search(tmdb_config, search_query, page)
+    if tmdb_cache and results is not None:
+        tmdb_cache.put_search(results, search_query, language=TMDB_LANGUAGE, page=page)
+    return results
+
+
+def prefetch_tmdb_searches(tmdb_config, search_queries, tmdb_cache=None, bounded=False):
+    """
+    Start resolving the first page of several TMDB searches concurrently.
+
+    Args:
+        tmdb_config (dict): Configuration for accessing the TMDB API.
+        search_queries (iterable): Movie titles to search for.
+        tmdb_cache (TMDBCache, optional): Cache of previous search results.
+        bounded (bool): Only search a few queries ahead of the last result read, for callers
+            that may stop before reading them all.
 
+    Returns:
+        PendingResults: First page of results per search query, None for failed searches.
+            Reading a result waits for that search only.
+    """
+    cached = {}
+    pending = []
+    for search_query in dict.fromkeys(search_queries):
+        results = tmdb_cache.get_search(search_query, language=TMDB_LANGUAGE) if tmdb_cache else None
+        if results is not None:
+            cached[search_query] = results
+        else:
+            pending.append(search_query)
+
+    def cache_results(search_query, results):
+        # Cache writes stay on the thread reading the results
+        if tmdb_cache and results is not None:
+            tmdb_cache.put_search(results, search_query, language=TMDB_LANGUAGE)
+
+    return PendingResults(lambda search_query: fetch_tmdb_search(tmdb_config, search_query), pending,
+                          on_result=cache_results, known=cached, bounded=bounded)
+
+
+def lookup_sonarr_series(sonarr_config, search_query):
+    """
+    Search for a series through Sonarr's lookup endpoint.
+
+    Args:
+        sonarr_config (dict): Configuration for accessing the Sonarr API.
+        search_query (str): Series title to search for.
+
+    Returns:
+        list: Lookup results, or None if the request failed.
+    """
+    try:
+        response = api_get(
+            "sonarr",
+            f"{sonarr_config.get('base_url')}/series/lookup",
+            headers={"X-Api-Key": sonarr_config.get("api_key")},
+            params={"term": search_query},
+        )
+    except requests.RequestException as e:
+        print(f"Error searching Sonarr: {e}")
+        return None
+
+    if response.status_code != 200:
+        print(f"Error searching Sonarr: {response.status_code} - {response.text}")
+        return None
+
+    return response.json()
 
-def movie_poster_directories(sorted_dir, unsorted_movies, radarr_config, tmdb_config):
+
+def create_movie_directory(sorted_dir, movie_found, manifest=None, plan=None):
+    """
+    Create the sorted directory for a Radarr movie.
+
+    Args:
+        sorted_dir (str): Path to the sorted directory containing movie folders.
+        movie_found (RadarrMovie): Movie from the Radarr index.
+        manifest (ScanManifest, optional): Scan of the sorted tree to record the directory in.
+        plan (Plan, optional): Record the creation in this plan instead of performing it.
+
+    Returns:
+        str: Path of the created directory, or None if Radarr has no usable path.
+    """
+    # Create a directory using the Radarr "path" field
+    movie_path = movie_found.path
+    root_directory = movie_found.root_folder_path
+    if not movie_path or not root_directory:
+        print("Invalid path or root directory found in Radarr.")
+        return None
+
+    # Remove the root directory from the movie path
+    relative_path = os.path.relpath(movie_path, root_directory)
+
+    # Create the directory in the sorted directory
+    target_dir = os.path.join(sorted_dir, "movies", relative_path)
+    make_directory(target_dir, plan, manifest)
+    if manifest:
+        manifest.add_directory(os.path.dirname(target_dir))
+        manifest.add_directory(target_dir)
+    print(f"{'Planned directory' if plan is not None else 'Created directory'}: {target_dir}")
+    return target_dir
+
+
+def create_series_directory(sorted_dir, matched_series, manifest=None, plan=None):
+    """
+    Create the sorted directory for a Sonarr series.
+
+    Args:
+        sorted_dir (str): Path to the sorted directory containing series folders.
+        matched_series (dict): Series with at least "title" and "path".
+        manifest (ScanManifest, optional): Scan of the sorted tree to record the directory in.
+        plan (Plan, optional): Record the creation in this plan instead of performing it.
+
+    Returns:
+        str: Path of the created directory, or None if Sonarr has no path for the series.
+    """
+    # Get the series path from Sonarr
+    series_path = matched_series.get("path")
+    if not series_path:
+        print(f"Series '{matched_series['title']}' does not have a valid path in Sonarr.")
+        return None
+
+    # Create the directory in the sorted directory
+    target_dir = os.path.join(sorted_dir, "series", os.path.basename(series_path))
+    make_directory(target_dir, plan, manifest)
+    if manifest:
+        manifest.add_directory(os.path.dirname(target_dir))
+        manifest.add_directory(target_dir)
+    print(f"{'Planned directory' if plan is not None else 'Created directory'}: {target_dir}")
+    return target_dir
+
+
+def is_processed(journal, file_path, manifest=None):
+    """
+    Check whether an unsorted file was resolved on a previous run and its sorted directory still exists.
+
+    Args:
+        journal (ProcessedJournal): Journal of resolved files.
+        file_path (str): Path to the unsorted file.
+        manifest (ScanManifest, optional): Scan holding the file's size and modification time.
+
+    Returns:
+        bool: True if the file can be skipped.
+    """
+    target_dir = journal.processed_target(file_path, manifest)
+    if not target_dir:
+        return False
+    metrics.record_stat()
+    if not os.path.isdir(target_dir):
+        return False
+    metrics.record_cache_hit("processed_journal")
+    print(f"Skipping '{os.path.basename(file_path)}' as it was already resolved to {target_dir}")
+    return True
+
+
+def movie_query(file_name):
+    """
+    Split a movie poster file name into its search query and year.
+
+    Returns:
+        tuple: (portion of the name before the first "(", four-digit year in parentheses or None).
+    """
+    year_match = re.search(r"\((\d{4})\)", file_name)
+    return file_name.split('(')[0].strip(), year_match.group(1) if year_match else None
+
+
+def record_processed(journal, files_with_years, target_dir, manifest=None):
+    """
+    Record every file of a series group as resolved to its sorted directory.
+    """
+    if not journal:
+        return
+    for file_path, _ in files_with_years:
+        journal.record(file_path, target_dir, manifest)
+
+
+def movie_poster_directories(sorted_dir, unsorted_movies, radarr_config, tmdb_config, radarr_index=None, tmdb_cache=None,
+                             disambiguation_queue=None, manifest=None, journal=None, plan=None, title_matcher=None,
+                             scheduler=None, mdblist_config=None, on_resolved=None):
     """
     Search for movie posters in the unsorted_movies directory, query TMDB, and organize into sorted directories.
 
@@ -14,6 +249,23 @@ def movie_poster_directories(sorted_dir, unsorted_movies, radarr_config, tmdb_co
         unsorted_movies (str): Path to the unsorted movies directory.
         radarr_config (dict): Configuration for accessing the Radarr API.
         tmdb_config (dict): Configuration for accessing the TMDB API.
+        radarr_index (dict, optional): Radarr library index keyed by TMDB ID. Fetched once when omitted.
+        tmdb_cache (TMDBCache, optional): Cache of TMDB searches and previous selections.
+        disambiguation_queue (DisambiguationQueue, optional): When given, movies that cannot be matched
+            automatically are queued instead of prompting, and answered queue entries are applied.
+        manifest (ScanManifest, optional): Scan to read the unsorted files from and record new directories in.
+        journal (ProcessedJournal, optional): Journal of resolved files. Unchanged files whose sorted
+            directory still exists are skipped, and newly resolved files are recorded.
+        plan (Plan, optional): Record directory creations in this plan instead of performing them.
+        title_matcher (TitleMatcher, optional): Matcher over the Radarr library. Files it matches
+            confidently are resolved without searching TMDB.
+        scheduler (PriorityScheduler, optional): Orders the files by priority and leaves those
+            outside the budget of the run unresolved.
+        mdblist_config (dict, optional): Configuration for accessing the MDBList API. When
+            enabled, ID tags the Radarr index cannot answer are cross-referenced to TMDB IDs
+            in batches.
+        on_resolved (callable, optional): Called with each sorted directory as soon as a file
+            is resolved to it, while the searches for later files are still running.
 
     Returns:
         None
@@ -29,140 +281,231 @@ def movie_poster_directories(sorted_dir, unsorted_movies, radarr_config, tmdb_co
     if not tmdb_api_key or not tmdb_base_url:
         raise ValueError("TMDB API key or base URL is missing in configuration.")
 
+    # Fetch the Radarr library once for the whole run
+    if radarr_index is None:
+        radarr_index = load_radarr_index(radarr_config)
+        if radarr_index is None:
+            print("Unable to load the Radarr library. Skipping movie posters.")
+            return
+
     # Search for image files in the unsorted_movies directory
-    for root, _, files in os.walk(unsorted_movies):
-        for file_name in files:
-            if file_name.lower().endswith((".jpg", ".jpeg", ".png")):
-                # Extract the file path
-                file_path = os.path.join(root, file_name)
-                print(f"\nFound image file: {file_name}")
-
-                # Extract the portion of the file name before the first '('
-                search_query = file_name.split('(')[0].strip()
-
-                # Extract the year from the file name using a regex pattern
-                year_match = re.search(r"\((\d{4})\)", file_name)
-                file_year = year_match.group(1) if year_match else None
-
-                if not search_query:
-                    print(f"Skipping file '{file_name}' as no valid search query could be extracted.")
-                    continue
-
-                print(f"Using search query: '{search_query}'")
-                if file_year:
-                    print(f"Extracted year from file name: {file_year}")
-
-                # Prepare TMDB search URL
-                tmdb_search_url = f"{tmdb_base_url}/search/movie"
-                page = 1  # Start with the first page of results
-                selected_movie = None
-
-                while True:
-                    # Send the TMDB search request
-                    response = requests.get(tmdb_search_url, params={
-                        "api_key": tmdb_api_key,
-                        "query": search_query,
-                        "language": "en-US",  # Specify the language
-                        "page": page  # Handle pagination
-                    })
-
-                    if response.status_code != 200:
-                        print(f"Error searching TMDB: {response.status_code} - {response.json().get('status_message', 'Unknown error')}")
-                        break
+    poster_files = []
+    if manifest:
+        # Collection posters are left to the collection step
+        for entry in manifest.files(under=unsorted_movies, extensions=(".jpg", ".jpeg", ".png"), category="movie"):
+            poster_files.append((os.path.dirname(entry.path), entry.name))
+    else:
+        for root, _, files in os.walk(unsorted_movies):
+            for file_name in files:
+                if file_name.lower().endswith((".jpg", ".jpeg", ".png")):
+                    poster_files.append((root, file_name))
+
+    # Skip files resolved on a previous run
+    if journal:
+        poster_files = [
+            (root, file_name)
+            for root, file_name in poster_files
+            if not is_processed(journal, os.path.join(root, file_name), manifest)
+        ]
+
+    # Most-watched titles first, within the budget of the run
+    if scheduler:
+        poster_files = scheduler.order(poster_files, lambda poster_file: poster_file[1])
+
+    # Resolve ID-tagged files straight from the Radarr index
+    tagged_files = {}
+    for _, file_name in poster_files:
+        tags = parse_id_tags(file_name)
+        if tags:
+            tagged_files[file_name] = tags
+    by_imdb_id = None
+    if any("imdb" in tags for tags in tagged_files.values()):
+        by_imdb_id = {movie.imdb_id.lower(): movie for movie in radarr_index.values() if movie.imdb_id}
+
+    # Cross-reference the tags Radarr does not know to TMDB IDs in a few batched MDBList requests
+    id_references = {}
+    if mdblist_config and mdblist_config.get("enabled"):
+        unknown_tags = [tags for tags in tagged_files.values() if not find_radarr_movie(radarr_index, tags, by_imdb_id)]
+        if unknown_tags:
+            id_references = resolve_id_tags(mdblist_config, "movie", unknown_tags, "tmdb")
+
+    # Match titles against the local library, then resolve the first page of every remaining TMDB search concurrently
+    library_matches = {}
+    search_queries = []
+    for _, file_name in poster_files:
+        if file_name in tagged_files:
+            continue
+        search_query, file_year = movie_query(file_name)
+        if tmdb_cache and search_query and tmdb_cache.get_selection(search_query, file_year):
+            continue
+        if disambiguation_queue is not None and disambiguation_queue.answer("movie", file_name):
+            continue
+        library_match = title_matcher.match(search_query, file_year) if title_matcher else None
+        if library_match:
+            library_matches[file_name] = library_match
+        else:
+            search_queries.append(search_query)
+    if library_matches:
+        print(f"Matched {len(library_matches)} movie poster(s) against the Radarr library without searching TMDB.")
+    # Under a scheduler, searches follow the files it admits instead of running ahead of its time budget
+    prefetched = prefetch_tmdb_searches(tmdb_config, [query for query in search_queries if query], tmdb_cache,
+                                        bounded=scheduler is not None)
+
+    for root, file_name in poster_files:
+        if scheduler and not scheduler.take(file_name):
+            continue
 
-                    # Parse the search results
-                    results = response.json().get("results", [])
-                    if not results:
-                        print("No movies found on TMDB for this search query.")
-                        break
+        # Extract the file path
+        file_path = os.path.join(root, file_name)
+        print(f"\nFound image file: {file_name}")
+
+        # Use the movie named by the file's ID tags, without searching
+        tags = tagged_files.get(file_name)
+        if tags:
+            movie_found = find_radarr_movie(radarr_index, tags, by_imdb_id)
+            if not movie_found and id_references:
+                movie_found = radarr_index.get(cross_reference(id_references, tags, "tmdb"))
+            if not movie_found:
+                print(f"No movie with ID tag {format_id_tags(tags)} found in Radarr. Skipping this file.")
+                continue
+            metrics.record_cache_hit("id_tag")
+            print(f"Matched by ID tag {format_id_tags(tags)}: {movie_found.title} ({movie_found.year})")
+            target_dir = create_movie_directory(sorted_dir, movie_found, manifest, plan)
+            if target_dir and journal:
+                journal.record(file_path, target_dir, manifest)
+            if target_dir and on_resolved:
+                on_resolved(target_dir)
+            continue
 
-                    # Attempt to automatically match a result based on the year
-                    for result in results:
-                        release_date = result.get('release_date', None)
-                        release_year = release_date.split("-")[0] if release_date else None
-                        if file_year and release_year == file_year:
-                            selected_movie = result
-                            print(f"Automatically matched movie: {result['title']} ({release_year})")
-                            break
+        # Extract the portion of the file name before the first '(' and the year in parentheses
+        search_query, file_year = movie_query(file_name)
 
-                    if selected_movie:
-                        break
+        if not search_query:
+            print(f"Skipping file '{file_name}' as no valid search query could be extracted.")
+            continue
 
-                    # If no automatic match, display the top 5 results for manual selection
-                    print("\nSearch Results:")
-                    for i, result in enumerate(results[:5], start=1):
-                        title = result['title']
-                        release_date = result.get('release_date', 'Unknown release date')
-                        overview = result.get('overview', 'No overview available')
-                        print(f"{i}. {title} ({release_date}) - {overview}")
-
-                    # Check if there are more results to display (for pagination)
-                    show_more_option = len(results) > 5
-                    if show_more_option:
-                        print("6. Show next page of results")
-
-                    # Get user selection
-                    try:
-                        selection = int(input("Select a movie (1-6): "))
-                        if 1 <= selection <= len(results[:5]):
-                            selected_movie = results[selection - 1]
-                            break
-                        elif selection == 6 and show_more_option:
-                            page += 1  # Load the next page
-                        else:
-                            print("Invalid selection. Please try again.")
-                    except ValueError:
-                        print("Invalid input. Please enter a number.")
-
-                if not selected_movie:
-                    print("No movie selected. Skipping this file.")
-                    continue
-
-                # Get the TMDB ID of the selected movie
-                tmdb_id = selected_movie["id"]
-                print(f"Selected movie: {selected_movie['title']} (TMDB ID: {tmdb_id})")
-
-                # Use the TMDB ID to search for the movie in Radarr
-                radarr_movie_url = f"{radarr_base_url}/movie"
-                response = requests.get(
-                    radarr_movie_url,
-                    headers={"X-Api-Key": radarr_api_key}
-                )
-
-                if response.status_code != 200:
-                    print(f"Error fetching movies from Radarr: {response.status_code}")
-                    continue
-
-                radarr_movies = response.json()
-                movie_found = None
-                for movie in radarr_movies:
-                    if movie.get("tmdbId") == tmdb_id:
-                        movie_found = movie
-                        break
+        print(f"Using search query: '{search_query}'")
+        if file_year:
+            print(f"Extracted year from file name: {file_year}")
+
+        page = 1  # Start with the first page of results
+
+        # Reuse the movie chosen for this title on a previous run
+        selected_movie = tmdb_cache.get_selection(search_query, file_year) if tmdb_cache else None
+        if selected_movie:
+            metrics.record_cache_hit("tmdb_selection")
+            print(f"Using cached selection: {selected_movie['title']}")
+
+        # Reuse an answer given to the disambiguation queue
+        if not selected_movie and disambiguation_queue is not None:
+            selected_movie = disambiguation_queue.answer("movie", file_name)
+            if selected_movie:
+                print(f"Using queued selection: {selected_movie['title']}")
+
+        # Use the confident match against the Radarr library
+        movie_found = None
+        if not selected_movie and file_name in library_matches:
+            confidence, movie_found = library_matches[file_name]
+            metrics.record_cache_hit("title_matcher")
+            print(f"Matched from the Radarr library: {movie_found.title} ({movie_found.year}), confidence {confidence:.2f}")
+
+        queued = False
+        while not selected_movie and not movie_found:
+            results = prefetched.get(search_query) if page == 1 else None
+            if results is None:
+                results = search_tmdb_movies(tmdb_config, search_query, page=page, tmdb_cache=tmdb_cache)
+            if results is None:
+                break
 
-                if not movie_found:
-                    print("Movie not found in Radarr.")
-                    continue
+            # Parse the search results
+            if not results:
+                print("No movies found on TMDB for this search query.")
+                break
 
-                # Create a directory using the Radarr "path" field
-                movie_path = movie_found.get("path")
-                root_directory = movie_found.get("rootFolderPath")
-                if not movie_path or not root_directory:
-                    print("Invalid path or root directory found in Radarr.")
-                    continue
+            # Attempt to automatically match a result based on the year
+            for result in results:
+                release_date = result.get('release_date', None)
+                release_year = release_date.split("-")[0] if release_date else None
+                if file_year and release_year == file_year:
+                    selected_movie = result
+                    print(f"Automatically matched movie: {result['title']} ({release_year})")
+                    break
 
-                # Remove the root directory from the movie path
-                relative_path = os.path.relpath(movie_path, root_directory)
+            if selected_movie:
+                break
 
-                # Create the directory in the sorted directory
-                target_dir = os.path.join(sorted_dir, "movies", relative_path)
-                os.makedirs(target_dir, exist_ok=True)
-                print(f"Created directory: {target_dir}")
+            # Defer the choice instead of blocking on input
+            if disambiguation_queue is not None:
+                disambiguation_queue.add("movie", file_name, search_query, file_year,
+                                         [movie_candidate(result) for result in results])
+                print("No automatic match. Queued for disambiguation.")
+                queued = True
+                break
+
+            # If no automatic match, display the top 5 results for manual selection
+            print("\nSearch Results:")
+            for i, result in enumerate(results[:5], start=1):
+                title = result['title']
+                release_date = result.get('release_date', 'Unknown release date')
+                overview = result.get('overview', 'No overview available')
+                print(f"{i}. {title} ({release_date}) - {overview}")
+
+            # Check if there are more results to display (for pagination)
+            show_more_option = len(results) > 5
+            if show_more_option:
+                print("6. Show next page of results")
+
+            # Get user selection
+            try:
+                selection = int(input("Select a movie (1-6): "))
+                if 1 <= selection <= len(results[:5]):
+                    selected_movie = results[selection - 1]
+                    break
+                elif selection == 6 and show_more_option:
+                    page += 1  # Load the next page
+                else:
+                    print("Invalid selection. Please try again.")
+            except ValueError:
+                print("Invalid input. Please enter a number.")
 
-                # Do not move the image file; leave it in its original location
-                print(f"Image file remains in: {file_path}")            
+        if queued:
+            continue
+        if not selected_movie and not movie_found:
+            print("No movie selected. Skipping this file.")
+            continue
 
-def series_poster_directories(sorted_dir, unsorted_series, sonarr_config):
+        if not movie_found:
+            # Get the TMDB ID of the selected movie
+            tmdb_id = selected_movie["id"]
+            if tmdb_cache:
+                tmdb_cache.put_selection(search_query, file_year, selected_movie)
+            print(f"Selected movie: {selected_movie['title']} (TMDB ID: {tmdb_id})")
+
+            # Use the TMDB ID to look up the movie in the Radarr index
+            movie_found = radarr_index.get(tmdb_id)
+            if not movie_found:
+                print("Movie not found in Radarr.")
+                continue
+
+        target_dir = create_movie_directory(sorted_dir, movie_found, manifest, plan)
+        if not target_dir:
+            continue
+        if journal:
+            journal.record(file_path, target_dir, manifest)
+        if disambiguation_queue is not None:
+            disambiguation_queue.resolve("movie", file_name)
+
+        # Do not move the image file; leave it in its original location
+        print(f"Image file remains in: {file_path}")            
+        if on_resolved:
+            on_resolved(target_dir)
+
+    # Searches of files left out by the scheduler are dropped rather than waited for
+    prefetched.cancel()
+
+def series_poster_directories(sorted_dir, unsorted_series, sonarr_config, disambiguation_queue=None, manifest=None,
+                              journal=None, plan=None, sonarr_index=None, title_matcher=None, scheduler=None,
+                              mdblist_config=None, on_resolved=None):
     """
     Search for series posters in the unsorted_series directory using Sonarr's API and organize into sorted directories.
     Automatically match the series if the year in the file name matches the release year in the Sonarr lookup.
@@ -171,6 +514,23 @@ def series_poster_directories(sorted_dir, unsorted_series, sonarr_config):
         sorted_dir (str): Path to the sorted directory containing series folders.
         unsorted_series (str): Path to the unsorted series directory.
         sonarr_config (dict): Configuration for accessing the Sonarr API.
+        disambiguation_queue (DisambiguationQueue, optional): When given, series that cannot be matched
+            automatically are queued instead of prompting, and answered queue entries are applied.
+        manifest (ScanManifest, optional): Scan to read the unsorted files from and record new directories in.
+        journal (ProcessedJournal, optional): Journal of resolved files. Groups whose files are all
+            unchanged and whose sorted directory still exists are skipped.
+        plan (Plan, optional): Record directory creations in this plan instead of performing them.
+        sonarr_index (SonarrIndex, optional): Local index of the Sonarr library. Groups are resolved
+            from it, and only groups it does not know are sent to /series/lookup.
+        title_matcher (TitleMatcher, optional): Matcher over the Sonarr library, tried for groups
+            whose title the index does not know exactly.
+        scheduler (PriorityScheduler, optional): Orders the groups by priority and leaves those
+            outside the budget of the run unresolved.
+        mdblist_config (dict, optional): Configuration for accessing the MDBList API. When
+            enabled, IMDb and TMDB tags the Sonarr index cannot answer are cross-referenced to
+            TVDB IDs in batches.
+        on_resolved (callable, optional): Called with each sorted directory as soon as a group
+            is resolved to it, while the lookups for later groups are still running.
 
     Returns:
         None
@@ -184,26 +544,118 @@ def series_poster_directories(sorted_dir, unsorted_series, sonarr_config):
     # Regular expression to extract "SERIES (YEAR)" from file names
     series_pattern = re.compile(r"^(.*? \((\d{4})\))")  # Match "SERIES (YEAR)" pattern
 
-    # Group all image files by "SERIES (YEAR)"
+    # Group all image files by "SERIES (YEAR)", keeping the first ID tags seen in each group
     series_groups = defaultdict(list)
+    group_tags = {}
+
+    if manifest:
+        image_paths = [
+            entry.path
+            for entry in manifest.files(under=unsorted_series, extensions=(".jpg", ".jpeg", ".png"), category=SERIES_CATEGORIES)
+        ]
+    else:
+        image_paths = [
+            os.path.join(root, file_name)
+            for root, _, files in os.walk(unsorted_series)
+            for file_name in files
+            if file_name.lower().endswith((".jpg", ".jpeg", ".png"))
+        ]
+
+    for file_path in image_paths:
+        file_name = os.path.basename(file_path)
+        if journal and is_processed(journal, file_path, manifest):
+            continue
 
-    for root, _, files in os.walk(unsorted_series):
-        for file_name in files:
-            if file_name.lower().endswith((".jpg", ".jpeg", ".png")):
-                # Extract the file path
-                file_path = os.path.join(root, file_name)
-
-                # Match the series name and year using the regex pattern
-                match = series_pattern.match(file_name)
-                if match:
-                    series_key = match.group(1)  # Extract the "SERIES (YEAR)" part
-                    series_year = match.group(2)  # Extract the year
-                    series_groups[series_key].append((file_path, series_year))
-                else:
-                    print(f"Skipping file '{file_name}' as it does not match the expected pattern.")
+        # Match the series name and year using the regex pattern
+        match = series_pattern.match(file_name)
+        tags = parse_id_tags(file_name)
+        if match:
+            series_key = match.group(1)  # Extract the "SERIES (YEAR)" part
+            series_year = match.group(2)  # Extract the year
+            series_groups[series_key].append((file_path, series_year))
+        elif tags:
+            # Tagged files without a year are grouped by their ID
+            series_key = id_tag_keys(tags)[0]
+            series_groups[series_key].append((file_path, None))
+        else:
+            print(f"Skipping file '{file_name}' as it does not match the expected pattern.")
+            continue
+        if tags:
+            group_tags.setdefault(series_key, tags)
+
+    # Most-watched series first, within the budget of the run
+    if scheduler:
+        ordered_keys = scheduler.order(series_groups, lambda key: os.path.basename(series_groups[key][0][0]))
+        series_groups = {series_key: series_groups[series_key] for series_key in ordered_keys}
+
+    # Resolve ID-tagged groups by ID, the rest from the local library index, then query Sonarr concurrently
+    pending_groups = [
+        series_key for series_key in series_groups
+        if not (disambiguation_queue is not None and disambiguation_queue.answer("series", series_key))
+    ]
+    id_matches = {}
+    id_lookups = {}
+
+    # Cross-reference the tags without a TVDB ID that Sonarr does not know in a few batched MDBList requests
+    id_references = {}
+    if mdblist_config and mdblist_config.get("enabled"):
+        unknown_tags = [
+            group_tags[series_key] for series_key in pending_groups
+            if series_key in group_tags
+            and not (sonarr_index is not None and sonarr_index.get_by_tags(group_tags[series_key]))
+        ]
+        if unknown_tags:
+            id_references = resolve_id_tags(mdblist_config, "show", unknown_tags, "tvdb")
+
+    for series_key in pending_groups:
+        tags = group_tags.get(series_key)
+        if not tags:
+            continue
+        series = sonarr_index.get_by_tags(tags) if sonarr_index is not None else None
+        tvdb_id = tags.get("tvdb") or cross_reference(id_references, tags, "tvdb")
+        if not series and tvdb_id and sonarr_index is not None:
+            series = sonarr_index.get(tvdb_id)
+        if series:
+            id_matches[series_key] = series_result(series)
+            metrics.record_cache_hit("id_tag")
+        elif tvdb_id:
+            id_lookups[series_key] = tvdb_id
+        elif series_groups[series_key][0][1] is None:
+            # Without a year there is no title to fall back to; groups with one are matched by title
+            id_matches[series_key] = None
+    lookups = {}
+    if sonarr_index is not None:
+        for series_key in pending_groups:
+            if series_key in id_matches or series_key in id_lookups:
+                continue
+            search_query = series_key.split(" (")[0].strip()
+            series_year = series_groups[series_key][0][1]
+            found = sonarr_index.find(search_query, series_year, folder=series_key)
+            if found:
+                lookups[series_key] = [series_result(series) for series in found]
+                metrics.record_cache_hit("sonarr_index")
+                continue
+            library_match = title_matcher.match(search_query, series_year) if title_matcher else None
+            if library_match:
+                confidence, series = library_match
+                lookups[series_key] = [series_result(series)]
+                metrics.record_cache_hit("title_matcher")
+                print(f"Matched '{search_query}' to {series.title} ({series.year}) from the Sonarr library, confidence {confidence:.2f}")
+        if lookups:
+            print(f"Resolved {len(lookups)} of {len(pending_groups)} series group(s) from the Sonarr library index.")
+    # Lookups are sent in processing order, and each group only waits for its own
+    remote_lookups = PendingResults(
+        lambda search_query: lookup_sonarr_series(sonarr_config, search_query),
+        [f"tvdb:{id_lookups[series_key]}" if series_key in id_lookups else series_key.split(" (")[0].strip()
+         for series_key in pending_groups
+         if series_key in id_lookups or (series_key not in lookups and series_key not in id_matches)],
+        bounded=scheduler is not None,
+    )
 
     # Process each series group
     for series_key, files_with_years in series_groups.items():
+        if scheduler and not scheduler.take(os.path.basename(files_with_years[0][0])):
+            continue
         print(f"\nProcessing series group: {series_key}")
         print("Files in group:")
         for file_path, _ in files_with_years:
@@ -215,15 +667,41 @@ def series_poster_directories(sorted_dir, unsorted_series, sonarr_config):
         series_year = files_with_years[0][1]  # Use the year from the first file in the group
         print(f"Using search query: '{search_query}' with year: {series_year}")
 
-        # Query Sonarr API for the series
-        sonarr_search_url = f"{sonarr_base_url}/series/lookup"
-        response = requests.get(sonarr_search_url, headers={"X-Api-Key": sonarr_api_key}, params={"term": search_query})
+        # Reuse an answer given to the disambiguation queue
+        matched_series = disambiguation_queue.answer("series", series_key) if disambiguation_queue is not None else None
+        if matched_series:
+            print(f"Using queued selection: {matched_series['title']}")
+            target_dir = create_series_directory(sorted_dir, matched_series, manifest, plan)
+            if target_dir:
+                disambiguation_queue.resolve("series", series_key)
+                record_processed(journal, files_with_years, target_dir, manifest)
+                if on_resolved:
+                    on_resolved(target_dir)
+            continue
 
-        if response.status_code != 200:
-            print(f"Error searching Sonarr: {response.status_code} - {response.text}")
+        # Use the series named by the group's ID tags, without searching
+        if series_key in id_lookups:
+            tvdb_id = id_lookups[series_key]
+            results = remote_lookups.get(f"tvdb:{tvdb_id}") or []
+            id_matches[series_key] = next((result for result in results if result.get("tvdbId") == tvdb_id), None)
+        if series_key in id_matches:
+            matched_series = id_matches[series_key]
+            if not matched_series:
+                print(f"No series with ID tag {format_id_tags(group_tags[series_key])} found in Sonarr. Skipping this group.")
+                continue
+            print(f"Matched by ID tag {format_id_tags(group_tags[series_key])}: {matched_series['title']} ({matched_series.get('year')})")
+            target_dir = create_series_directory(sorted_dir, matched_series, manifest, plan)
+            if target_dir:
+                record_processed(journal, files_with_years, target_dir, manifest)
+                if on_resolved:
+                    on_resolved(target_dir)
+            continue
+
+        # Use the index match or the Sonarr lookup resolved for this series
+        results = lookups[series_key] if series_key in lookups else remote_lookups.get(search_query)
+        if results is None:
             continue
 
-        results = response.json()
         if not results:
             print("No series found in Sonarr for this search query.")
             continue
@@ -237,6 +715,13 @@ def series_poster_directories(sorted_dir, unsorted_series, sonarr_config):
                 print(f"Automatically matched series: {result['title']} ({premiere_date})")
                 break
 
+        # Defer the choice instead of blocking on input
+        if not matched_series and disambiguation_queue is not None:
+            disambiguation_queue.add("series", series_key, search_query, series_year,
+                                     [series_candidate(result) for result in results])
+            print("No automatic match. Queued for disambiguation.")
+            continue
+
         # If no automatic match, display results for manual selection
         if not matched_series:
             print("\nSearch Results:")
@@ -271,16 +756,61 @@ def series_poster_directories(sorted_dir, unsorted_series, sonarr_config):
             print("No series selected. Skipping this group.")
             continue
 
-        # Get the series path from Sonarr
-        series_path = matched_series.get("path")
-        if not series_path:
-            print(f"Series '{matched_series['title']}' does not have a valid path in Sonarr.")
+        target_dir = create_series_directory(sorted_dir, matched_series, manifest, plan)
+        if not target_dir:
             continue
-
-        # Create the directory in the sorted directory
-        target_dir = os.path.join(sorted_dir, "series", os.path.basename(series_path))
-        os.makedirs(target_dir, exist_ok=True)
-        print(f"Created directory: {target_dir}")
+        record_processed(journal, files_with_years, target_dir, manifest)
+        if disambiguation_queue is not None:
+            disambiguation_queue.resolve("series", series_key)
+        if on_resolved:
+            on_resolved(target_dir)
 
         # Skip the remaining files in the group
-        print(f"Skipping the rest of the files for series '{series_key}' as the series has been processed.")
\ No newline at end of file
+        print(f"Skipping the rest of the files for series '{series_key}' as the series has been processed.")
+
+    # Lookups of groups left out by the scheduler are dropped rather than waited for
+    remote_lookups.cancel()
+
+
+def apply_queued_selections(sorted_dir, disambiguation_queue, radarr_index=None, tmdb_cache=None, manifest=None,
+                            plan=None, on_movie_resolved=None, on_series_resolved=None):
+    """
+    Create the sorted directories for every answered entry in the disambiguation queue.
+
+    Args:
+        sorted_dir (str): Path to the sorted directory.
+        disambiguation_queue (DisambiguationQueue): Queue holding the answers.
+        radarr_index (dict, optional): Radarr library index keyed by TMDB ID. Movie answers are kept
+            queued when it is not available.
+        tmdb_cache (TMDBCache, optional): Cache that remembers the selected movie per title and year.
+        manifest (ScanManifest, optional): Scan of the sorted tree to record new directories in.
+        plan (Plan, optional): Record directory creations in this plan instead of performing them.
+        on_movie_resolved (callable, optional): Called with each movie directory created or found.
+        on_series_resolved (callable, optional): Called with each series directory created or found.
+
+    Returns:
+        None
+    """
+    for kind, key, candidate in disambiguation_queue.answered():
+        print(f"\nApplying queued selection for {key}: {candidate['title']}")
+        if kind == "movie":
+            if radarr_index is None:
+                continue
+            search_query, file_year = movie_query(key)
+            if tmdb_cache and search_query:
+                tmdb_cache.put_selection(search_query, file_year, candidate)
+            movie_found = radarr_index.get(candidate["id"])
+            if not movie_found:
+                print("Movie not found in Radarr.")
+                continue
+            target_dir = create_movie_directory(sorted_dir, movie_found, manifest, plan)
+            if target_dir:
+                disambiguation_queue.resolve(kind, key)
+                if on_movie_resolved:
+                    on_movie_resolved(target_dir)
+        else:
+            target_dir = create_series_directory(sorted_dir, candidate, manifest, plan)
+            if target_dir:
+                disambiguation_queue.resolve(kind, key)
+                if on_series_resolved:
+                    on_series_resolved(target_dir)
\ No newline at end of file
@@ -0,0 +1,146 @@
+import os
+import json
+
+# Number of candidates kept for each queued item
+MAX_CANDIDATES = 10
+
+
+def movie_candidate(result):
+    """
+    Reduce a TMDB search result to the fields needed to pick and apply it later.
+    """
+    return {
+        "id": result.get("id"),
+        "title": result.get("title"),
+        "year": (result.get("release_date") or "").split("-")[0] or None,
+        "overview": result.get("overview"),
+    }
+
+
+def series_candidate(result):
+    """
+    Reduce a Sonarr lookup result to the fields needed to pick and apply it later.
+    """
+    return {
+        "id": result.get("tvdbId"),
+        "title": result.get("title"),
+        "year": result.get("year"),
+        "overview": result.get("overview"),
+        "path": result.get("path"),
+    }
+
+
+class DisambiguationQueue:
+    """
+    File-backed queue of movies and series whose automatic match failed.
+
+    Each entry holds the candidate list for one poster file (movies) or series group
+    (series). An entry is answered by setting its "selected_id" to the id of one of its
+    candidates, either through the batch prompt or by editing the queue file offline.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                try:
+                    for entry in json.load(file):
+                        self.entries[(entry["kind"], entry["key"])] = entry
+                except (json.JSONDecodeError, KeyError, TypeError) as e:
+                    raise ValueError(f"Failed to parse disambiguation queue '{path}': {e}")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, kind, key, query, year, candidates):
+        """
+        Queue an item with its candidates, keeping any answer already given for it.
+        """
+        entry = self.entries.get((kind, key))
+        selected_id = entry.get("selected_id") if entry else None
+        self.entries[(kind, key)] = {
+            "kind": kind,
+            "key": key,
+            "query": query,
+            "year": year,
+            "candidates": candidates[:MAX_CANDIDATES],
+            "selected_id": selected_id,
+        }
+
+    def answer(self, kind, key):
+        """
+        Return the selected candidate for an item, or None if it is unanswered.
+        """
+        entry = self.entries.get((kind, key))
+        if not entry or entry.get("selected_id") is None:
+            return None
+        for candidate in entry["candidates"]:
+            if str(candidate["id"]) == str(entry["selected_id"]):
+                return candidate
+        return None
+
+    def answered(self):
+        """
+        Return (kind, key, candidate) for every answered entry.
+        """
+        answers = []
+        for kind, key in list(self.entries):
+            candidate = self.answer(kind, key)
+            if candidate:
+                answers.append((kind, key, candidate))
+        return answers
+
+    def pending(self):
+        """
+        Return the entries that still need an answer.
+        """
+        return [entry for (kind, key), entry in self.entries.items() if self.answer(kind, key) is None]
+
+    def resolve(self, kind, key):
+        """
+        Remove an item once it has been applied.
+        """
+        self.entries.pop((kind, key), None)
+
+    def prompt(self):
+        """
+        Ask for a selection for every pending entry in one batch.
+        """
+        pending = self.pending()
+        if not pending:
+            return
+
+        print(f"\n{len(pending)} item(s) need a manual selection.")
+        for entry in pending:
+            print(f"\n{entry['kind'].capitalize()}: {entry['key']}")
+            print(f"Search query: '{entry['query']}' (year: {entry['year'] or 'unknown'})")
+            for i, candidate in enumerate(entry["candidates"], start=1):
+                overview = candidate.get("overview") or "No overview available"
+                print(f"{i}. {candidate['title']} ({candidate.get('year') or 'Unknown year'}) - {overview}")
+
+            while True:
+                try:
+                    selection = int(input(f"Select a {entry['kind']} (1-{len(entry['candidates'])}, 0 to skip): "))
+                    if selection == 0:
+                        break
+                    if 1 <= selection <= len(entry["candidates"]):
+                        entry["selected_id"] = entry["candidates"][selection - 1]["id"]
+                        break
+                    print("Invalid selection. Please try again.")
+                except ValueError:
+                    print("Invalid input. Please enter a number.")
+
+    def save(self):
+        """
+        Write the queue to disk, removing the file once the queue is empty.
+        """
+        if not self.entries:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(list(self.entries.values()), file, indent=4)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,221 @@
+import os
+import errno
+import shutil
+import metrics
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Default number of files copied at the same time across filesystems
+DEFAULT_TRANSFER_WORKERS = 4
+
+# Largest chunk handed to the kernel per copy call
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Errors meaning a kernel-side copy is not supported between these two files
+UNSUPPORTED_COPY_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF)
+
+# Errors meaning the filesystem does not support hard links
+UNSUPPORTED_LINK_ERRORS = (errno.EPERM, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EMLINK, errno.ENOSYS)
+
+
+class DeviceCache:
+    """
+    Remembers the device of each directory so same-filesystem moves can use an atomic rename.
+    """
+
+    def __init__(self):
+        self.devices = {}
+
+    def device(self, dir_path):
+        if dir_path not in self.devices:
+            metrics.record_stat()
+            self.devices[dir_path] = os.stat(dir_path).st_dev
+        return self.devices[dir_path]
+
+    def same_device(self, source, target):
+        return self.device(os.path.dirname(source)) == self.device(os.path.dirname(target))
+
+
+def kernel_copy(copy_call, source_fd, target_fd, size):
+    """
+    Copy size bytes with a kernel-side copy call until the whole file is written.
+
+    Returns:
+        bool: False if the call is not supported for these files and nothing was copied.
+    """
+    copied = 0
+    while copied < size:
+        try:
+            written = copy_call(source_fd, target_fd, min(COPY_CHUNK_SIZE, size - copied), copied)
+        except OSError as e:
+            if copied == 0 and e.errno in UNSUPPORTED_COPY_ERRORS:
+                return False
+            raise
+        if written == 0:
+            break
+        copied += written
+    return True
+
+
+def copy_file_range_call(source_fd, target_fd, count, offset):
+    return os.copy_file_range(source_fd, target_fd, count, offset, offset)
+
+
+def sendfile_call(source_fd, target_fd, count, offset):
+    return os.sendfile(target_fd, source_fd, offset, count)
+
+
+def copy_file_contents(source, target):
+    """
+    Copy a file without passing its contents through Python where the platform allows it.
+
+    copy_file_range is tried first, which lets NFS 4.2 and other network filesystems copy on
+    the server. sendfile is used next, and a buffered copy is the last resort.
+
+    Args:
+        source (str): Path to the file to copy.
+        target (str): Path of the copy.
+
+    Returns:
+        int: Number of bytes copied.
+
+    Raises:
+        OSError: If the copy fails or the copy does not have the size of the source.
+    """
+    with open(source, "rb") as source_file, open(target, "wb") as target_file:
+        source_fd = source_file.fileno()
+        target_fd = target_file.fileno()
+        size = os.fstat(source_fd).st_size
+
+        copied = False
+        if hasattr(os, "copy_file_range"):
+            copied = kernel_copy(copy_file_range_call, source_fd, target_fd, size)
+        if not copied and hasattr(os, "sendfile"):
+            copied = kernel_copy(sendfile_call, source_fd, target_fd, size)
+        if not copied:
+            shutil.copyfileobj(source_file, target_file)
+
+        target_file.flush()
+        if os.fstat(target_fd).st_size != size:
+            raise OSError(errno.EIO, f"Size mismatch after copying {source}", target)
+    shutil.copystat(source, target)
+    return size
+
+
+def rename_exclusive(source, target):
+    """
+    Rename a file, failing instead of replacing an existing target, without checking for it first.
+
+    The file is hard-linked to its new name, which fails if the name is taken, then its old
+    name is removed. A link left by an interrupted rename is recognized and finished.
+
+    Args:
+        source (str): Path to the file.
+        target (str): New path of the file.
+
+    Returns:
+        bool: True if the file was renamed, False if the filesystem has no hard links and
+            nothing was done.
+
+    Raises:
+        FileExistsError: If another file already has the target name.
+        OSError: With errno EXDEV if source and target are on different filesystems.
+    """
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        if not os.path.samefile(source, target):
+            raise
+    except OSError as e:
+        if e.errno in UNSUPPORTED_LINK_ERRORS:
+            return False
+        raise
+    os.unlink(source)
+    return True
+
+
+def transfer_file(source, target, devices=None, exclusive=False):
+    """
+    Move a file, renaming it on the same filesystem and copying it across filesystems.
+
+    Cross-device copies are written to a temporary name next to the target and renamed into
+    place once their size is verified, so the target never holds a partial file. The source
+    is only deleted after that.
+
+    Args:
+        source (str): Path to the file to move.
+        target (str): Destination path.
+        devices (DeviceCache, optional): Device lookups shared across moves.
+        exclusive (bool): Never replace an existing target. The move is tried as an exclusive
+            rename first, so no device lookup is needed and a collision fails the move instead
+            of costing a stat before every move.
+
+    Raises:
+        FileExistsError: In exclusive mode, if the target already exists.
+    """
+    source = str(source)
+    target = str(target)
+    devices = devices or DeviceCache()
+    same_device = None
+    if exclusive:
+        try:
+            if rename_exclusive(source, target):
+                metrics.record_move()
+                return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            same_device = False
+    if same_device is None:
+        same_device = devices.same_device(source, target)
+    if same_device:
+        os.rename(source, target)
+        metrics.record_move()
+        return
+
+    partial = os.path.join(os.path.dirname(target), f".{os.path.basename(target)}.partial")
+    try:
+        size = copy_file_contents(source, partial)
+        if not (exclusive and rename_exclusive(partial, target)):
+            os.replace(partial, target)
+    except OSError:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    os.remove(source)
+    metrics.record_move(size)
+
+
+def transfer_files(moves, devices=None, max_workers=DEFAULT_TRANSFER_WORKERS, exclusive=False):
+    """
+    Move several files on a bounded pool of worker threads.
+
+    Copies spend their time in the kernel, so they run in parallel up to max_workers.
+
+    Args:
+        moves (iterable): (key, source, target) tuples. The key identifies the move in the results.
+        devices (DeviceCache, optional): Device lookups shared across moves.
+        max_workers (int): Maximum number of concurrent moves.
+        exclusive (bool): Never replace an existing target, see transfer_file.
+
+    Yields:
+        tuple: (key, error) as each move finishes, with error None on success. Once a move
+            fails, moves that have not started yet are cancelled.
+    """
+    devices = devices or DeviceCache()
+    # The workers count their moves towards the step of the calling thread
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), initializer=metrics.pin_thread,
+                            initargs=(metrics.current_step(),)) as executor:
+        futures = {
+            executor.submit(transfer_file, source, target, devices, exclusive): key
+            for key, source, target in moves
+        }
+        failed = False
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            error = future.exception()
+            if error is not None and not failed:
+                failed = True
+                for pending in futures:
+                    pending.cancel()
+            yield futures[future], error
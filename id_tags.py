@@ -0,0 +1,55 @@
+import re
+
+# ID tags as written by Radarr, Sonarr and poster sets: "{tmdb-27205}", "{imdb-tt1375666}",
+# and the "[tvdbid-81189]" form used by Jellyfin
+ID_TAG_PATTERN = re.compile(r"[\{\[](tmdb|tvdb|imdb)(?:id)?-(tt\d+|\d+)[\}\]]", re.IGNORECASE)
+
+
+def parse_id_tags(name):
+    """
+    Extract the ID tags of a file or directory name.
+
+    Args:
+        name (str): File name, directory name or path.
+
+    Returns:
+        dict: Mapping of "tmdb", "tvdb" or "imdb" to the ID, with TMDB and TVDB IDs as integers.
+            The first tag of each source wins.
+    """
+    tags = {}
+    for match in ID_TAG_PATTERN.finditer(name or ""):
+        source, value = match.group(1).lower(), match.group(2)
+        if source == "imdb":
+            if value.lower().startswith("tt"):
+                tags.setdefault(source, value.lower())
+        elif value.isdigit():
+            tags.setdefault(source, int(value))
+    return tags
+
+
+def strip_id_tags(name):
+    """
+    Remove the ID tags from a name and collapse the whitespace left behind.
+    """
+    return " ".join(ID_TAG_PATTERN.sub(" ", name or "").split())
+
+
+def id_tag_keys(tags):
+    """
+    Return the match keys of parsed ID tags, such as "tmdb-27205".
+    """
+    return [f"{source}-{value}" for source, value in sorted(tags.items())]
+
+
+def format_id_tags(tags):
+    """
+    Format parsed ID tags for messages, such as "{tmdb-27205}".
+    """
+    return " ".join(f"{{{key}}}" for key in id_tag_keys(tags))
+
+
+def tags_conflict(tags, other_tags):
+    """
+    Check whether two sets of ID tags name different items for a source they share.
+    """
+    return any(other_tags[source] != value for source, value in tags.items() if source in other_tags)
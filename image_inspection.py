@@ -0,0 +1,180 @@
+import os
+import struct
+import metrics
+from processed_journal import file_hash
+
+# Bytes read from the start of a file to identify its format and, except for JPEG, its size
+HEADER_SIZE = 32
+
+# JPEG start-of-frame markers, which hold the image size. C4 (DHT), C8 (JPG) and CC (DAC) are not frames.
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# JPEG markers that stand alone without a length field
+JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+
+def read_jpeg_size(file):
+    """
+    Find the size of a JPEG by seeking from marker to marker until the first frame header.
+
+    Only the marker headers are read; the compressed data in between is skipped.
+
+    Args:
+        file (file): Binary file positioned just after the SOI marker.
+
+    Returns:
+        tuple: (width, height), or None if no frame header was found.
+    """
+    while True:
+        byte = file.read(1)
+        while byte and byte != b"\xff":
+            byte = file.read(1)
+        # Markers may be preceded by any number of fill bytes
+        while byte == b"\xff":
+            byte = file.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker == 0xD9:
+            return None
+        length_bytes = file.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack(">H", length_bytes)[0]
+        if marker in JPEG_SOF_MARKERS:
+            frame = file.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack(">xHH", frame)
+            return width, height
+        file.seek(length - 2, os.SEEK_CUR)
+
+
+def read_image_header(path, manifest=None):
+    """
+    Read the format and pixel size of an image from its header, without decoding it.
+
+    PNG, GIF and BMP sizes are at a fixed offset in the first bytes of the file. JPEG sizes
+    are in the first frame header, found by skipping from marker to marker.
+
+    Args:
+        path (str): Path to the image.
+        manifest (ScanManifest, optional): Scan to open the file through, so archive members can be read.
+
+    Returns:
+        tuple: (format, width, height) with format one of "jpeg", "png", "gif" or "bmp", or
+            None if the format is not recognized or the header is truncated.
+    """
+    with manifest.open(path) if manifest else open(path, "rb") as file:
+        header = file.read(HEADER_SIZE)
+        if header.startswith(b"\x89PNG\r\n\x1a\n") and header[12:16] == b"IHDR" and len(header) >= 24:
+            width, height = struct.unpack(">II", header[16:24])
+            return "png", width, height
+        if header[:6] in (b"GIF87a", b"GIF89a") and len(header) >= 10:
+            width, height = struct.unpack("<HH", header[6:10])
+            return "gif", width, height
+        if header.startswith(b"BM") and len(header) >= 26:
+            if struct.unpack("<I", header[14:18])[0] == 12:
+                width, height = struct.unpack("<HH", header[18:22])
+            else:
+                width, height = struct.unpack("<ii", header[18:26])
+            # Top-down bitmaps store a negative height
+            return "bmp", width, abs(height)
+        if header.startswith(b"\xff\xd8"):
+            file.seek(2)
+            size = read_jpeg_size(file)
+            if size is None:
+                return None
+            return ("jpeg",) + size
+    return None
+
+
+class ImageInspector:
+    """
+    Per-run cache of the sizes, content hashes and pixel sizes of candidate images.
+
+    Each piece is read on first use only, so files that never compete with another file
+    are neither hashed nor opened.
+    """
+
+    def __init__(self, manifest=None):
+        self.manifest = manifest
+        self.sizes = {}
+        self.digests = {}
+        self.headers = {}
+
+    def size(self, path):
+        """
+        Return the size of a file in bytes, from the manifest when it holds it.
+        """
+        path = str(path)
+        if path not in self.sizes:
+            if self.manifest:
+                self.sizes[path] = self.manifest.stat(path)[0]
+            else:
+                metrics.record_stat()
+                self.sizes[path] = os.stat(path).st_size
+        return self.sizes[path]
+
+    def digest(self, path):
+        """
+        Return the SHA-256 digest of a file, streamed in blocks.
+        """
+        path = str(path)
+        if path not in self.digests:
+            self.digests[path] = file_hash(path, self.manifest)
+        return self.digests[path]
+
+    def header(self, path):
+        """
+        Return (format, width, height) of an image, or None if its header cannot be read.
+        """
+        path = str(path)
+        if path not in self.headers:
+            try:
+                self.headers[path] = read_image_header(path, self.manifest)
+            except (OSError, struct.error):
+                self.headers[path] = None
+        return self.headers[path]
+
+    def pixels(self, path):
+        """
+        Return the pixel count of an image, or 0 if its header cannot be read.
+        """
+        header = self.header(path)
+        return header[1] * header[2] if header else 0
+
+    def duplicates(self, candidates, existing=()):
+        """
+        Find the candidates whose contents are identical to an existing file or an earlier candidate.
+
+        Files are grouped by size first, so only files sharing a size are hashed.
+
+        Args:
+            candidates (list): Paths of the files to check, in order of preference.
+            existing (iterable): Paths of files already in place. They are never reported.
+
+        Returns:
+            dict: Mapping of each duplicate path to the path of the file it duplicates.
+        """
+        existing = [str(path) for path in existing]
+        candidates = [str(path) for path in candidates]
+        by_size = {}
+        for path in existing + candidates:
+            by_size.setdefault(self.size(path), []).append(path)
+
+        duplicates = {}
+        for paths in by_size.values():
+            if len(paths) < 2:
+                continue
+            kept = {}
+            for path in paths:
+                digest = self.digest(path)
+                if digest in kept:
+                    duplicates[path] = kept[digest]
+                else:
+                    kept[digest] = path
+        candidates = set(candidates)
+        return {path: original for path, original in duplicates.items() if path in candidates}
@@ -1,14 +1,48 @@
 import os
+import sys
 import json
+import time
+import pstats
+import cProfile
+import argparse
 from pathlib import Path
-from directory_creation import movie_poster_directories, series_poster_directories
+from concurrent.futures import ProcessPoolExecutor
+import metrics
+from api_client import configure_services
+from directory_creation import movie_poster_directories, series_poster_directories, apply_queued_selections
+from disambiguation import DisambiguationQueue
+from scan_manifest import ScanManifest
+from archives import archive_root
+from asset_index import (
+    load_asset_index,
+    invalidate_asset_index,
+    missing_artwork,
+    write_missing_report,
+    read_missing_directories,
+)
+from plan import Plan, PlanApplier, resume_plan, rollback_plan
+from file_transfer import DEFAULT_TRANSFER_WORKERS
+from processed_journal import open_processed_journal
+from watch_mode import watch_directory, DEFAULT_DEBOUNCE, DEFAULT_POLL_INTERVAL
+from library_index import load_radarr_index, load_sonarr_index, PersistedIndex, RadarrMovie, SonarrSeries, DEFAULT_INDEX_TTL
+from tmdb_cache import open_tmdb_cache, DEFAULT_TMDB_TTL, DEFAULT_TMDB_MAX_ENTRIES
 from poster_organization import (
+    PosterPlacer,
     collection_poster_move,
     movies_poster_move,
     series_poster_move,
     delete_empty_directories,
 )
-from rename_posters import rename_movie_posters, rename_series_season_specials_posters
+from rename_posters import rename_movie_posters, rename_series_season_specials_posters, rename_directory_files
+from stages import Stage, DEFAULT_MAX_PENDING
+from rename_rules import load_rename_rules
+from title_matcher import title_matcher_for, DEFAULT_MATCH_THRESHOLD, DEFAULT_MATCH_MARGIN
+from scheduler import PriorityScheduler, fetch_watch_stats
+from libraries import library_names, library_config, library_file_name, library_summary, print_summary, PrefixedOutput
+from webhooks import LibraryWebhooks, create_webhook_server, serve_webhooks, DEFAULT_WEBHOOK_HOST, DEFAULT_WEBHOOK_PORT
+
+# Number of functions printed by --profile
+PROFILE_LIMIT = 30
 
 
 def load_config():
@@ -36,6 +70,120 @@ def load_config():
             raise ValueError(f"Failed to parse JSON file: {e}")
 
 
+def get_cache_path(config, file_name):
+    """
+    Build the path of a cache file from the "cache" section of the configuration.
+
+    Args:
+        config (dict): Parsed configuration dictionary.
+        file_name (str): Name of the cache file.
+
+    Returns:
+        str: Absolute path to the cache file, or None if caching is disabled.
+    """
+    cache_dir = config.get("cache", {}).get("directory")
+    if not cache_dir:
+        return None
+
+    # Relative cache directories are resolved against the script directory
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(script_dir, cache_dir, file_name)
+
+
+def get_apply_journal_path(config):
+    """
+    Return the path of the journal used while applying a plan.
+
+    Args:
+        config (dict): Parsed configuration dictionary.
+
+    Returns:
+        str: Path in the cache directory, or next to config.json when caching is disabled.
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return get_cache_path(config, "apply_journal.jsonl") or os.path.join(
+        script_dir, library_file_name("apply_journal.jsonl", config.get("library")))
+
+
+def get_queue_path(config, queue_file=None):
+    """
+    Return the path of the disambiguation queue file.
+
+    Args:
+        config (dict): Parsed configuration dictionary.
+        queue_file (str, optional): Path given on the command line.
+
+    Returns:
+        str: queue_file, or disambiguation_queue.json next to config.json. Library profiles
+            get their own file, such as disambiguation_queue-4k.json.
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return queue_file or os.path.join(script_dir, library_file_name("disambiguation_queue.json", config.get("library")))
+
+
+def load_series_index(config):
+    """
+    Load the Sonarr library index when "library_index" is enabled in the Sonarr configuration.
+
+    Args:
+        config (dict): Parsed configuration dictionary.
+
+    Returns:
+        SonarrIndex: The index, or None if it is disabled or Sonarr could not be reached.
+    """
+    sonarr_config = config.get("sonarr", {})
+    if not sonarr_config.get("library_index"):
+        return None
+    return load_sonarr_index(
+        sonarr_config,
+        cache_path=get_cache_path(config, "sonarr_index.json"),
+        ttl=config.get("cache", {}).get("sonarr_index_ttl", DEFAULT_INDEX_TTL),
+    )
+
+
+def write_metrics(config, run_metrics):
+    """
+    Write the metrics of a run as a JSON report and, when configured, a Prometheus textfile.
+
+    Args:
+        config (dict): Parsed configuration dictionary.
+        run_metrics (RunMetrics): Metrics of the run.
+    """
+    metrics_config = config.get("metrics", {})
+    report_path = get_cache_path(config, metrics_config.get("report_file", "run_report.json"))
+    textfile_path = metrics_config.get("prometheus_textfile")
+    library = config.get("library")
+    try:
+        if report_path:
+            run_metrics.write_json(report_path)
+            print(f"Run report written to {report_path}")
+        if textfile_path:
+            # Each library writes its own textfile, with its name as a label
+            run_metrics.write_prometheus(library_file_name(textfile_path, library),
+                                         [("library", library)] if library else ())
+    except OSError as e:
+        print(f"Failed to write the run metrics: {e}")
+
+
+def print_profile(profiler, config, limit=PROFILE_LIMIT):
+    """
+    Print the functions that took the most time in a profiled run and save the full profile.
+
+    Args:
+        profiler (cProfile.Profile): The stopped profiler.
+        config (dict): Parsed configuration dictionary.
+        limit (int): Number of functions to print.
+    """
+    print(f"\nTop {limit} functions by cumulative time:")
+    stats = pstats.Stats(profiler)
+    stats.sort_stats("cumulative").print_stats(limit)
+    profile_path = get_cache_path(config, "profile.pstats")
+    if profile_path:
+        os.makedirs(os.path.dirname(profile_path), exist_ok=True)
+        stats.dump_stats(profile_path)
+        print(f"Full profile written to {profile_path}")
+
+
 def validate_directory(path):
     """
     Validate that the given path is a valid directory.
@@ -51,7 +199,911 @@ def validate_directory(path):
         exit(1)
 
 
-def main():
+def load_library_index(config):
+    """
+    Load the Radarr library index using the cache settings from the configuration.
+
+    Args:
+        config (dict): Parsed configuration dictionary.
+
+    Returns:
+        dict: Mapping of TMDB ID to RadarrMovie, or None if Radarr could not be reached.
+    """
+    return load_radarr_index(
+        config.get("radarr", {}),
+        cache_path=get_cache_path(config, "radarr_index.json"),
+        ttl=config.get("cache", {}).get("radarr_index_ttl", DEFAULT_INDEX_TTL),
+    )
+
+
+def load_title_matcher(config, index, kind):
+    """
+    Return the offline title matcher of a library index, unless "matching" is disabled.
+
+    Args:
+        config (dict): Parsed configuration dictionary.
+        index (dict or SonarrIndex): Radarr index keyed by TMDB ID, or the Sonarr index.
+        kind (str): "movies" or "series".
+
+    Returns:
+        TitleMatcher: The matcher, or None if matching is disabled or there is no index.
+    """
+    matching_config = config.get("matching", {})
+    if not matching_config.get("enabled", True):
+        return None
+    return title_matcher_for(
+        index,
+        kind,
+        threshold=matching_config.get("threshold", DEFAULT_MATCH_THRESHOLD),
+        margin=matching_config.get("margin", DEFAULT_MATCH_MARGIN),
+    )
+
+
+def run_pipeline(sorted_dir, unsorted_dir, config, radarr_index, tmdb_cache=None, disambiguation_queue=None,
+                 journal=None, prompt_queue=False, dry_run=False, sonarr_index=None, archives=(), target_dirs=None,
+                 scheduler=None):
+    """
+    Run every pipeline step once over the unsorted directory.
+
+    The steps only plan their filesystem changes against the scan manifest. Posters are moved
+    into a sorted directory and renamed there as soon as the directory is resolved, and those
+    operations go to an apply stage on its own thread while later lookups are still running.
+    The apply stage applies each installment in batches with one journal for the whole run.
+    In a dry run, the plan is printed without touching anything instead.
+
+    ZIP archives in the unsorted directory, and those given in archives, are read from their
+    member lists. Their members are extracted straight to their final sorted path and name.
+    Archives in the unsorted directory are deleted once every member has been placed.
+
+    Args:
+        sorted_dir (str): Path to the sorted directory.
+        unsorted_dir (str): Path to the unsorted directory with "movies" and "series" subdirectories.
+        config (dict): Parsed configuration dictionary.
+        radarr_index (dict): Radarr library index keyed by TMDB ID, or None if Radarr is unavailable.
+        tmdb_cache (TMDBCache, optional): Cache of TMDB searches and selections.
+        disambiguation_queue (DisambiguationQueue, optional): Queue for ambiguous matches.
+        journal (ProcessedJournal, optional): Journal of processed files for incremental runs.
+        prompt_queue (bool): Whether to ask about queued matches in one batch after the lookups.
+        dry_run (bool): Print the planned changes instead of applying them.
+        sonarr_index (SonarrIndex, optional): Sonarr library index to resolve series from.
+        archives (iterable): Paths of poster-set archives to read as if they were extracted in
+            the unsorted directory. They are never deleted.
+        target_dirs (iterable, optional): Sorted directories to restrict the run to, such as those
+            of the last missing-artwork report. The sorted tree is not scanned, and only these
+            directories and those receiving posters are renamed.
+        scheduler (PriorityScheduler, optional): Orders the resolve and move steps by priority
+            and enforces the budget of the run.
+
+    Returns:
+        bool: True if the plan was printed or applied completely.
+    """
+    radarr_config = config.get("radarr", {})
+    sonarr_config = config.get("sonarr", {})
+    tmdb_config = config.get("tmdb", {})
+    unsorted_movies = os.path.join(unsorted_dir, "movies")
+    unsorted_series = os.path.join(unsorted_dir, "series")
+    # On network filesystems every stat is a round trip: files are only stat'ed when a step
+    # needs their size or time, and the apply step relies on exclusive creates instead
+    network_io = config.get("io", {}).get("network", False)
+
+    # Scan both trees once; every step reads and updates this manifest.
+    # Incremental runs leave the sorted tree alone and only visit the directories that change.
+    with metrics.step("scan"):
+        print("\nScanning directories...")
+        manifest = ScanManifest(stat_files=not network_io)
+        manifest.scan(unsorted_dir, expand_archives=True)
+        for archive_path in archives:
+            try:
+                manifest.add_archive(archive_path, archive_root(unsorted_dir, archive_path))
+            except OSError as e:
+                print(f"Skipping archive: {e}")
+        full_scan = journal is None and target_dirs is None
+        if full_scan:
+            manifest.scan(sorted_dir)
+        print(f"Found {len(manifest.files(under=unsorted_dir))} unsorted and {len(manifest.files(under=sorted_dir))} sorted files.")
+
+        # The asset index is rebuilt from a full scan for free, and otherwise read from the cache
+        asset_index_path = get_cache_path(config, "asset_index.json")
+        asset_index = None
+        if asset_index_path:
+            asset_index = load_asset_index(sorted_dir, asset_index_path, manifest if full_scan else None)
+
+        # The count budget picks the top titles across movies and series before any step starts
+        if scheduler:
+            scheduler.admit(entry.name for under in (unsorted_movies, unsorted_series)
+                            for entry in manifest.files(under=under))
+    plan = Plan()
+    transfer_config = config.get("transfer", {})
+    movie_rules = load_rename_rules(config, "movies")
+    series_rules = load_rename_rules(config, "series")
+
+    # The plan is applied in installments on a worker while later posters are still being
+    # resolved. Its bounded queue holds planning back whenever applying falls behind.
+    applier = apply_stage = None
+    if not dry_run:
+        try:
+            applier = PlanApplier(
+                get_apply_journal_path(config),
+                max_workers=transfer_config.get("max_workers", DEFAULT_TRANSFER_WORKERS),
+                exclusive=network_io,
+            )
+        except RuntimeError as e:
+            print(e)
+            return False
+        apply_stage = Stage("apply", applier.apply, transfer_config.get("max_pending", DEFAULT_MAX_PENDING),
+                            describe=lambda: f"{applier.applied} operation(s) applied or in progress")
+
+    def hand_over():
+        operations = plan.take()
+        if apply_stage and operations:
+            apply_stage.put(operations)
+
+    def abandon():
+        # What was applied stays in the journal for --resume, the asset index is rebuilt on next
+        # use, and items queued for a manual selection during this run are kept
+        if asset_index_path:
+            invalidate_asset_index(asset_index_path)
+        if disambiguation_queue is not None:
+            disambiguation_queue.save()
+
+    try:
+        # Step 1: Organize collection posters
+        with metrics.step("collections"):
+            print("\nOrganizing collection posters...")
+            collection_poster_move(
+                unsorted_dir=unsorted_dir,
+                sorted_dir=sorted_dir,
+                manifest=manifest,
+                plan=plan,
+            )
+            print("Finished organizing collection posters.")
+        hand_over()
+
+        # Posters are moved into a directory and renamed there as soon as it is resolved, so
+        # their operations reach the apply stage while the lookups of later posters are running
+        movie_placer = PosterPlacer(unsorted_dir, manifest, plan, movie_rules, "movies")
+        series_placer = PosterPlacer(unsorted_dir, manifest, plan, series_rules, "series", sibling=movie_placer)
+        streamed_dirs = set()
+
+        def streamer(placer, rules):
+            def on_resolved(target_dir):
+                if placer.place(target_dir):
+                    rename_directory_files(Path(target_dir), rules, manifest, plan)
+                    streamed_dirs.add(str(target_dir))
+                    hand_over()
+            return on_resolved
+
+        # Step 2: Process movie posters
+        with metrics.step("movie_directories"):
+            print("\nProcessing movie posters...")
+            if radarr_index is None:
+                print("Unable to load the Radarr library. Skipping movie posters.")
+            else:
+                movie_poster_directories(
+                    sorted_dir=sorted_dir,
+                    unsorted_movies=unsorted_movies,
+                    radarr_config=radarr_config,
+                    tmdb_config=tmdb_config,
+                    radarr_index=radarr_index,
+                    tmdb_cache=tmdb_cache,
+                    disambiguation_queue=disambiguation_queue,
+                    manifest=manifest,
+                    journal=journal,
+                    plan=plan,
+                    title_matcher=load_title_matcher(config, radarr_index, "movies"),
+                    scheduler=scheduler,
+                    mdblist_config=config.get("mdblist"),
+                    on_resolved=streamer(movie_placer, movie_rules),
+                )
+            print("Finished processing movie posters.")
+
+        # Step 3: Process series posters
+        with metrics.step("series_directories"):
+            print("\nProcessing series posters...")
+            series_poster_directories(
+                sorted_dir=sorted_dir,
+                unsorted_series=unsorted_series,
+                sonarr_config=sonarr_config,
+                disambiguation_queue=disambiguation_queue,
+                manifest=manifest,
+                journal=journal,
+                plan=plan,
+                sonarr_index=sonarr_index,
+                title_matcher=load_title_matcher(config, sonarr_index, "series"),
+                scheduler=scheduler,
+                mdblist_config=config.get("mdblist"),
+                on_resolved=streamer(series_placer, series_rules),
+            )
+            print("Finished processing series posters.")
+
+        # Answer the queued matches in one batch, or keep them for the next run
+        with metrics.step("disambiguation"):
+            if disambiguation_queue is not None:
+                if prompt_queue:
+                    disambiguation_queue.prompt()
+                apply_queued_selections(sorted_dir, disambiguation_queue, radarr_index, tmdb_cache, manifest, plan,
+                                        streamer(movie_placer, movie_rules), streamer(series_placer, series_rules))
+        if streamed_dirs:
+            print(f"\nPlaced and renamed posters in {len(streamed_dirs)} directory(ies) as they were resolved.")
+
+        # Step 4: Organize the remaining unsorted movie posters into sorted directories
+        with metrics.step("movie_moves"):
+            print("\nOrganizing unsorted movie posters...")
+            affected_dirs = set()
+            affected_dirs |= movies_poster_move(
+                unsorted_dir=unsorted_dir,
+                sorted_dir=sorted_dir,
+                manifest=manifest,
+                plan=plan,
+                rules=movie_rules,
+                scheduler=scheduler,
+                placer=movie_placer,
+            )
+            print("Finished organizing unsorted movie posters.")
+
+        # Step 5: Organize the remaining unsorted series posters into sorted directories
+        with metrics.step("series_moves"):
+            print("\nOrganizing unsorted series posters...")
+            affected_dirs |= series_poster_move(
+                unsorted_dir=unsorted_dir,
+                sorted_dir=sorted_dir,
+                manifest=manifest,
+                plan=plan,
+                rules=series_rules,
+                scheduler=scheduler,
+                placer=series_placer,
+            )
+            print("Finished organizing unsorted series posters.")
+            if scheduler:
+                scheduler.report()
+
+        # Step 6: Delete empty directories in the unsorted directory
+        with metrics.step("cleanup"):
+            print("\nDeleting empty directories in the unsorted directory...")
+            # The movies and series drop folders are kept so the next run finds them
+            delete_empty_directories(unsorted_dir, manifest, keep=(unsorted_movies, unsorted_series), plan=plan)
+            print("Finished deleting empty directories.")
+
+        # Incremental runs only rename inside the directories that received posters, targeted runs
+        # inside the targeted directories as well. Directories renamed as they were resolved are done.
+        only_dirs = affected_dirs - streamed_dirs if journal else None
+        if target_dirs is not None:
+            only_dirs = (affected_dirs - streamed_dirs) | {os.path.normpath(dir_path) for dir_path in target_dirs
+                                                           if manifest.exists(dir_path)}
+
+        # Step 7: Rename movie posters
+        with metrics.step("movie_renames"):
+            print("\nRenaming movie posters...")
+            rename_movie_posters(sorted_dir, manifest, only_dirs, plan, movie_rules)
+            print("Finished renaming movie posters.")
+
+        # Step 8: Rename series posters (including seasons and specials)
+        with metrics.step("series_renames"):
+            print("\nRenaming series posters (including seasons and specials)...")
+            rename_series_season_specials_posters(sorted_dir, manifest, only_dirs, plan, series_rules)
+            print("Finished renaming series posters.")
+        hand_over()
+
+        # Every member is read from here on by the apply step itself
+        manifest.close()
+        consumed_archives = manifest.consumed_archives(under=unsorted_dir)
+    except BaseException:
+        # What was handed over is still applied
+        if apply_stage:
+            try:
+                if apply_stage.close():
+                    applier.finish()
+            finally:
+                abandon()
+        raise
+
+    if dry_run:
+        print("\nDry run. Planned changes:")
+        plan.print_plan()
+        for archive_path in consumed_archives:
+            print(f"Delete extracted archive: {archive_path}")
+        return True
+
+    print(f"\nApplying the last of {len(plan)} planned change(s)...")
+    try:
+        applied = apply_stage.close() and applier.finish()
+    except BaseException:
+        abandon()
+        raise
+    print(apply_stage.summary())
+
+    # The asset index follows the applied plan; after a failure it is rebuilt on next use
+    if asset_index is not None:
+        if applied:
+            asset_index.record_operations(plan.operations)
+            asset_index.save(asset_index_path)
+        else:
+            invalidate_asset_index(asset_index_path)
+
+    # Archives are only deleted once everything extracted from them is in place
+    if applied:
+        for archive_path in consumed_archives:
+            try:
+                os.remove(archive_path)
+                print(f"Deleted extracted archive: {archive_path}")
+            except OSError as e:
+                print(f"Failed to delete archive {archive_path}: {e}")
+
+    # Queued answers are only dropped once their directories exist
+    if disambiguation_queue is not None:
+        disambiguation_queue.save()
+        if len(disambiguation_queue):
+            print(f"{len(disambiguation_queue)} item(s) left in the disambiguation queue: {disambiguation_queue.path}")
+
+    # Forget journal entries for files that have left the unsorted directory
+    if journal and applied:
+        journal.prune(entry.path for entry in manifest.files(under=unsorted_dir))
+    return applied
+
+
+def load_scheduler(config, max_items=None, max_seconds=None):
+    """
+    Build the priority scheduler of a run from the "schedule" configuration section.
+
+    Args:
+        config (dict): Parsed configuration dictionary.
+        max_items (int, optional): Count budget from the command line, overriding the configuration.
+        max_seconds (float, optional): Time budget from the command line, overriding the configuration.
+
+    Returns:
+        PriorityScheduler: The scheduler, or None if neither Tautulli ordering nor a budget is configured.
+    """
+    schedule_config = config.get("schedule", {})
+    max_items = max_items if max_items is not None else schedule_config.get("max_items")
+    max_seconds = max_seconds if max_seconds is not None else schedule_config.get("max_seconds")
+
+    # Play counts and dates added come from Tautulli in one call per library section
+    stats = None
+    if schedule_config.get("tautulli"):
+        with metrics.step("watch_stats"):
+            stats = fetch_watch_stats(config.get("tautulli", {}))
+        if stats is None:
+            print("Unable to load watch statistics from Tautulli. Keeping the scan order.")
+        else:
+            print(f"Loaded watch statistics for {len(stats)} title(s) from Tautulli")
+
+    if stats is None and not max_items and not max_seconds:
+        return None
+    return PriorityScheduler(stats, max_items, max_seconds)
+
+
+def report_missing_artwork(config, sorted_dir):
+    """
+    Print the library items that lack artwork and save the report with its directory list.
+
+    The sorted tree is read from the asset index, and only walked when no index was saved yet.
+    The report is written to missing_artwork.json in the cache directory, where --missing-only
+    reads its directory list.
+
+    Args:
+        config (dict): Parsed configuration dictionary.
+        sorted_dir (str): Path to the sorted directory.
+
+    Returns:
+        list: Items missing artwork, as returned by missing_artwork.
+    """
+    asset_index_path = get_cache_path(config, "asset_index.json")
+    asset_index = load_asset_index(sorted_dir, asset_index_path)
+    if asset_index_path:
+        asset_index.save(asset_index_path)
+
+    radarr_index = load_library_index(config)
+    sonarr_config = config.get("sonarr", {})
+    sonarr_index = None
+    if sonarr_config.get("api_key") and sonarr_config.get("base_url"):
+        sonarr_index = load_sonarr_index(
+            sonarr_config,
+            cache_path=get_cache_path(config, "sonarr_index.json"),
+            ttl=config.get("cache", {}).get("sonarr_index_ttl", DEFAULT_INDEX_TTL),
+        )
+
+    report = missing_artwork(asset_index, radarr_index, sonarr_index, config.get("coverage"))
+    print("\nMissing artwork:")
+    if not report:
+        print("Nothing is missing.")
+    for item in report:
+        print(f"{item['kind']:<7}{item['title']} ({item['year']}): {', '.join(item['missing'])}")
+    movies = sum(1 for item in report if item["kind"] == "movie")
+    print(f"{movies} movie(s) and {len(report) - movies} series missing artwork.")
+
+    report_path = get_cache_path(config, "missing_artwork.json")
+    if report_path:
+        write_missing_report(report, sorted_dir, report_path)
+        print(f"Missing-artwork report written to {report_path}")
+    return report
+
+
+def index_mtime(config, file_name):
+    """
+    Return the modification time of a persisted library index, or None if there is none.
+    """
+    cache_path = get_cache_path(config, file_name)
+    try:
+        return os.stat(cache_path).st_mtime_ns if cache_path else None
+    except FileNotFoundError:
+        return None
+
+
+def listen_for_webhooks(config, sorted_dir):
+    """
+    Keep the persisted library indexes and the sorted directories up to date from Radarr and Sonarr webhooks.
+
+    The library indexes are fetched once at start when no fresh copy is persisted; every
+    event after that patches them in place. Runs until interrupted with Ctrl+C.
+
+    Args:
+        config (dict): Parsed configuration dictionary.
+        sorted_dir (str): Path to the sorted directory.
+
+    Returns:
+        bool: False if the listener could not start.
+    """
+    radarr_path = get_cache_path(config, "radarr_index.json")
+    sonarr_path = get_cache_path(config, "sonarr_index.json")
+    if not radarr_path:
+        print("The webhook listener keeps the library indexes in the cache directory. Set cache.directory first.")
+        return False
+
+    sonarr_config = config.get("sonarr", {})
+    use_sonarr = bool(sonarr_config.get("api_key") and sonarr_config.get("base_url"))
+
+    def refresh(service):
+        if service == "radarr":
+            return load_library_index(config) is not None
+        return load_sonarr_index(
+            sonarr_config,
+            cache_path=sonarr_path,
+            ttl=config.get("cache", {}).get("sonarr_index_ttl", DEFAULT_INDEX_TTL),
+        ) is not None
+
+    indexes = {"radarr": PersistedIndex(RadarrMovie, "movies", radarr_path, config.get("radarr", {}).get("base_url"))}
+    if use_sonarr:
+        indexes["sonarr"] = PersistedIndex(SonarrSeries, "series", sonarr_path, sonarr_config.get("base_url"))
+    for service, index in indexes.items():
+        if not refresh(service) or not index.load():
+            print(f"Unable to load the {service.capitalize()} library index.")
+            return False
+
+    webhooks_config = config.get("webhooks", {})
+    webhooks = LibraryWebhooks(
+        sorted_dir,
+        {"radarr": indexes["radarr"], "sonarr": indexes.get("sonarr")},
+        refresh,
+        asset_index_path=get_cache_path(config, "asset_index.json"),
+        create_directories=webhooks_config.get("create_directories", True),
+        exclusive=config.get("io", {}).get("network", False),
+    )
+    try:
+        server = create_webhook_server(
+            webhooks,
+            host=webhooks_config.get("host", DEFAULT_WEBHOOK_HOST),
+            port=webhooks_config.get("port", DEFAULT_WEBHOOK_PORT),
+            username=webhooks_config.get("username"),
+            password=webhooks_config.get("password"),
+        )
+    except OSError as e:
+        print(f"Unable to start the webhook listener: {e}")
+        return False
+    serve_webhooks(server)
+    return True
+
+
+def watch_pipeline(sorted_dir, unsorted_dir, config, radarr_index, tmdb_cache=None, disambiguation_queue=None,
+                   journal=None, debounce=DEFAULT_DEBOUNCE, use_polling=False, sonarr_index=None):
+    """
+    Run the pipeline once, then again for every settled batch of new drops in the unsorted directory.
+
+    The library indexes, TMDB cache and API sessions stay in memory between batches. The
+    library indexes are refreshed once they are older than their configured TTL, or when
+    their persisted copy changed, such as after a webhook event.
+
+    Args:
+        sorted_dir (str): Path to the sorted directory.
+        unsorted_dir (str): Path to the unsorted directory.
+        config (dict): Parsed configuration dictionary.
+        radarr_index (dict): Radarr library index keyed by TMDB ID, or None if Radarr is unavailable.
+        tmdb_cache (TMDBCache, optional): Cache of TMDB searches and selections.
+        disambiguation_queue (DisambiguationQueue, optional): Queue for ambiguous matches.
+        journal (ProcessedJournal, optional): Journal of processed files.
+        debounce (float): Quiet period in seconds before a batch is processed.
+        use_polling (bool): Poll instead of using inotify.
+        sonarr_index (SonarrIndex, optional): Sonarr library index to resolve series from.
+    """
+    index_ttl = config.get("cache", {}).get("radarr_index_ttl", DEFAULT_INDEX_TTL)
+    series_index_ttl = config.get("cache", {}).get("sonarr_index_ttl", DEFAULT_INDEX_TTL)
+    state = {
+        "radarr_index": radarr_index,
+        "loaded": time.monotonic(),
+        "sonarr_index": sonarr_index,
+        "series_loaded": time.monotonic(),
+        "radarr_mtime": index_mtime(config, "radarr_index.json"),
+        "sonarr_mtime": index_mtime(config, "sonarr_index.json"),
+    }
+
+    def process_batch(changes=None):
+        run_metrics = metrics.start_run()
+        try:
+            radarr_mtime = index_mtime(config, "radarr_index.json")
+            if (state["radarr_index"] is None or time.monotonic() - state["loaded"] > index_ttl
+                    or radarr_mtime != state["radarr_mtime"]):
+                with metrics.step("library_index"):
+                    state["radarr_index"] = load_library_index(config) or state["radarr_index"]
+                state["loaded"] = time.monotonic()
+                state["radarr_mtime"] = index_mtime(config, "radarr_index.json")
+            sonarr_mtime = index_mtime(config, "sonarr_index.json")
+            if state["sonarr_index"] is not None and (time.monotonic() - state["series_loaded"] > series_index_ttl
+                                                      or sonarr_mtime != state["sonarr_mtime"]):
+                with metrics.step("library_index"):
+                    state["sonarr_index"] = load_series_index(config) or state["sonarr_index"]
+                state["series_loaded"] = time.monotonic()
+                state["sonarr_mtime"] = index_mtime(config, "sonarr_index.json")
+            run_pipeline(
+                sorted_dir=sorted_dir,
+                unsorted_dir=unsorted_dir,
+                config=config,
+                radarr_index=state["radarr_index"],
+                tmdb_cache=tmdb_cache,
+                disambiguation_queue=disambiguation_queue,
+                journal=journal,
+                sonarr_index=state["sonarr_index"],
+            )
+            write_metrics(config, run_metrics)
+            print("\nBatch complete.")
+        except Exception as e:
+            # A failed batch must not end the watcher; its files are picked up by the next batch
+            print(f"\nBatch failed: {e}. Waiting for the next change.")
+
+    # The first batch catches up on anything dropped while the watcher was not running
+    watch_directory(
+        unsorted_dir,
+        process_batch,
+        debounce=debounce,
+        use_polling=use_polling,
+        poll_interval=config.get("watch", {}).get("poll_interval", DEFAULT_POLL_INTERVAL),
+    )
+
+
+def parse_args(argv=None):
+    """
+    Parse the command line arguments.
+
+    Args:
+        argv (list, optional): Arguments to parse. Defaults to sys.argv.
+
+    Returns:
+        argparse.Namespace: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Organize Kometa poster assets.")
+    parser.add_argument("--sorted-dir", help="Path to the sorted directory. Prompted for when omitted.")
+    parser.add_argument("--unsorted-dir", help="Path to the unsorted directory. Prompted for when omitted.")
+    parser.add_argument(
+        "--library",
+        action="append",
+        default=[],
+        help="Process this library profile from the libraries section of config.json. Can be given more "
+             "than once; the libraries run in parallel and never prompt.",
+    )
+    parser.add_argument(
+        "--all-libraries",
+        action="store_true",
+        help="Process every library profile from the libraries section of config.json in parallel.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of libraries processed at the same time. Defaults to one worker per library.",
+    )
+    parser.add_argument(
+        "--archive",
+        action="append",
+        default=[],
+        help="Poster-set ZIP archive to sort without extracting it first. Can be given more than once.",
+    )
+    parser.add_argument(
+        "--defer-prompts",
+        action="store_true",
+        help="Queue ambiguous matches and ask about them in one batch after all lookups.",
+    )
+    parser.add_argument(
+        "--unattended",
+        action="store_true",
+        help="Never prompt. Ambiguous matches are written to the disambiguation queue file.",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only process new or changed unsorted files and only rename the sorted directories they reach.",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and process new drops as they land in the unsorted directory. Implies --unattended.",
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=DEFAULT_DEBOUNCE,
+        help=f"Seconds without new changes before a batch is processed in watch mode (default: {DEFAULT_DEBOUNCE}).",
+    )
+    parser.add_argument(
+        "--poll",
+        action="store_true",
+        help=f"Poll the unsorted directory every {DEFAULT_POLL_INTERVAL}s instead of using inotify in watch mode.",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Print every planned move, rename and directory change without touching the filesystem.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Finish applying the plan of an interrupted run, then exit.",
+    )
+    parser.add_argument(
+        "--rollback",
+        action="store_true",
+        help="Undo the changes an interrupted run already applied, then exit.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=f"Run under cProfile and print the {PROFILE_LIMIT} functions with the most cumulative time.",
+    )
+    parser.add_argument(
+        "--max-items",
+        type=int,
+        help="Only resolve and move the posters of this many titles, most-watched first. The rest "
+             "stay unsorted for the next run. Overrides schedule.max_items.",
+    )
+    parser.add_argument(
+        "--max-seconds",
+        type=float,
+        help="Stop starting new titles after this many seconds; posters of titles already started "
+             "are still moved. Overrides schedule.max_seconds.",
+    )
+    parser.add_argument(
+        "--missing-report",
+        action="store_true",
+        help="Print the library items that lack a poster or season image, from the asset index "
+             "and the Radarr and Sonarr libraries, then exit.",
+    )
+    parser.add_argument(
+        "--missing-only",
+        action="store_true",
+        help="Skip the sorted directory scan and only rename inside the directories listed by the "
+             "last --missing-report and those receiving posters.",
+    )
+    parser.add_argument(
+        "--webhooks",
+        action="store_true",
+        help="Listen for Radarr and Sonarr webhooks and keep the library indexes and sorted directories "
+             "up to date until stopped. Only the sorted directory is needed.",
+    )
+    parser.add_argument(
+        "--queue-file",
+        help="Path to the disambiguation queue file. Defaults to disambiguation_queue.json next to config.json, "
+             "or disambiguation_queue-<library>.json for library profiles.",
+    )
+    return parser.parse_args(argv)
+
+
+def finish_interrupted_run(config, resume):
+    """
+    Finish or undo an interrupted run from its apply journal, without a new scan.
+
+    Args:
+        config (dict): Parsed configuration dictionary.
+        resume (bool): Resume the run when True, roll it back otherwise.
+
+    Returns:
+        bool: True if every operation was applied or undone.
+    """
+    # The sorted tree changes outside a normal run, so the asset index is rebuilt on next use
+    invalidate_asset_index(get_cache_path(config, "asset_index.json"))
+    journal_path = get_apply_journal_path(config)
+    if resume:
+        return resume_plan(
+            journal_path,
+            config.get("transfer", {}).get("max_workers", DEFAULT_TRANSFER_WORKERS),
+            exclusive=config.get("io", {}).get("network", False),
+        )
+    return rollback_plan(journal_path)
+
+
+def run_library(config, sorted_dir, unsorted_dir, args):
+    """
+    Process one sorted and unsorted directory pair with the services of a configuration.
+
+    Args:
+        config (dict): Parsed configuration dictionary, or the configuration of a library profile.
+        sorted_dir (str): Path to the sorted directory.
+        unsorted_dir (str): Path to the unsorted directory.
+        args (argparse.Namespace): Parsed command line arguments.
+
+    Returns:
+        dict: Summary of the run, as printed by the library summary.
+    """
+    cache_config = config.get("cache", {})
+    library = config.get("library")
+
+    if args.missing_report:
+        report_missing_artwork(config, sorted_dir)
+        return library_summary(library, "ok")
+    if args.webhooks:
+        return library_summary(library, "stopped" if listen_for_webhooks(config, sorted_dir) else "failed")
+
+    # Targeted runs work from the directories of the last missing-artwork report
+    target_dirs = None
+    if args.missing_only:
+        target_dirs = read_missing_directories(get_cache_path(config, "missing_artwork.json") or "")
+        if target_dirs is None:
+            print("No missing-artwork report was found. Run with --missing-report first.")
+            return library_summary(library, "failed")
+
+    # Nobody is around to answer prompts while watching
+    if args.watch:
+        args.unattended = True
+        args.incremental = True
+
+    # Ambiguous matches are queued instead of prompted for in deferred and unattended modes
+    disambiguation_queue = None
+    if args.defer_prompts or args.unattended:
+        try:
+            disambiguation_queue = DisambiguationQueue(get_queue_path(config, args.queue_file))
+        except ValueError as e:
+            print(e)
+            return library_summary(library, "failed")
+
+    # Incremental runs skip files recorded in the processed-file journal
+    journal = None
+    if args.incremental:
+        journal = open_processed_journal(
+            get_cache_path(config, "processed_journal.sqlite"),
+            use_hash=cache_config.get("journal_hash", False),
+            read_only=args.dry_run,
+        )
+        if journal is None:
+            print("Incremental runs need a cache directory. Processing everything.")
+
+    run_metrics = metrics.start_run()
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+
+    # Load the Radarr library once and keep the TMDB cache open for the whole run
+    with metrics.step("library_index"):
+        radarr_index = load_library_index(config)
+        sonarr_index = load_series_index(config)
+    tmdb_cache = open_tmdb_cache(
+        get_cache_path(config, "tmdb_cache.sqlite"),
+        ttl=cache_config.get("tmdb_ttl", DEFAULT_TMDB_TTL),
+        max_entries=cache_config.get("tmdb_max_entries", DEFAULT_TMDB_MAX_ENTRIES),
+    )
+
+    status = "dry run" if args.dry_run else "ok"
+    if args.watch:
+        watch_pipeline(sorted_dir, unsorted_dir, config, radarr_index, tmdb_cache, disambiguation_queue, journal,
+                       debounce=args.debounce, use_polling=args.poll, sonarr_index=sonarr_index)
+        status = "stopped"
+    else:
+        completed = run_pipeline(
+            sorted_dir=sorted_dir,
+            unsorted_dir=unsorted_dir,
+            config=config,
+            radarr_index=radarr_index,
+            tmdb_cache=tmdb_cache,
+            disambiguation_queue=disambiguation_queue,
+            journal=journal,
+            prompt_queue=args.defer_prompts and not args.unattended,
+            dry_run=args.dry_run,
+            sonarr_index=sonarr_index,
+            archives=args.archive,
+            target_dirs=target_dirs,
+            scheduler=load_scheduler(config, args.max_items, args.max_seconds),
+        )
+        write_metrics(config, run_metrics)
+        if not completed:
+            status = "failed"
+
+    if profiler:
+        profiler.disable()
+        print_profile(profiler, config)
+    if tmdb_cache:
+        tmdb_cache.close()
+    if journal:
+        journal.close()
+    return library_summary(library, status, run_metrics, len(disambiguation_queue) if disambiguation_queue else 0)
+
+
+def library_worker(name, config, args):
+    """
+    Process one library profile in a worker process, with its own connection pools and rate limits.
+
+    Workers never prompt: ambiguous matches go to the library's disambiguation queue file.
+
+    Args:
+        name (str): Name of the library profile.
+        config (dict): Configuration of the library, from library_config.
+        args (argparse.Namespace): Parsed command line arguments.
+
+    Returns:
+        dict: Summary of the run.
+    """
+    sys.stdout = PrefixedOutput(sys.stdout, f"[{name}] ")
+    configure_services(config)
+    args.unattended = True
+    return run_library(config, config["sorted_dir"], config["unsorted_dir"], args)
+
+
+def run_libraries(config, args):
+    """
+    Process several library profiles in parallel worker processes and print a combined summary.
+
+    Args:
+        config (dict): Parsed configuration dictionary.
+        args (argparse.Namespace): Parsed command line arguments.
+
+    Returns:
+        bool: True if every library completed.
+    """
+    names = library_names(config) if args.all_libraries else list(dict.fromkeys(args.library))
+    if not names:
+        print("No libraries are defined in the libraries section of config.json.")
+        return False
+    workers = max(1, min(args.workers or len(names), len(names)))
+    try:
+        configs = {name: library_config(config, name, workers) for name in names}
+    except ValueError as e:
+        print(e)
+        return False
+
+    # Check every library before any of them starts
+    for name, library in configs.items():
+        unsorted_dir = library["unsorted_dir"]
+        for path in (library["sorted_dir"], unsorted_dir, os.path.join(unsorted_dir, "movies"),
+                     os.path.join(unsorted_dir, "series")):
+            if not os.path.isdir(path):
+                print(f"Error: {path} of library '{name}' is not a valid directory.")
+                return False
+    if args.resume or args.rollback:
+        results = [finish_interrupted_run(configs[name], args.resume) for name in names]
+        return all(results)
+    if not args.dry_run:
+        for name in names:
+            journal_path = get_apply_journal_path(configs[name])
+            if os.path.exists(journal_path):
+                print(f"An unfinished run of library '{name}' was found in {journal_path}. Use --resume or --rollback first.")
+                return False
+
+    print(f"Processing {len(names)} librar{'y' if len(names) == 1 else 'ies'} with {workers} worker(s)...")
+    start = time.monotonic()
+    summaries = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [(name, executor.submit(library_worker, name, configs[name], args)) for name in names]
+        for name, future in futures:
+            while True:
+                try:
+                    summaries.append(future.result())
+                except KeyboardInterrupt:
+                    # Workers receive the same Ctrl+C, stop watching and still report
+                    continue
+                except Exception as e:
+                    print(f"Library '{name}' failed: {e}")
+                    summaries.append(library_summary(name, "failed"))
+                break
+    print_summary(summaries, time.monotonic() - start)
+    return all(summary["status"] != "failed" for summary in summaries)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
     # Load configuration
     try:
         config = load_config()
@@ -59,14 +1111,62 @@ def main():
         print(e)
         exit(1)
 
-    # Extract API configurations
-    radarr_config = config.get("radarr", {})
-    sonarr_config = config.get("sonarr", {})
-    tmdb_config = config.get("tmdb", {})
+    # Set up shared connections and per-service rate limits
+    configure_services(config)
+
+    # Fail early on rename rules that do not compile
+    try:
+        load_rename_rules(config, "movies")
+        load_rename_rules(config, "series")
+    except ValueError as e:
+        print(e)
+        exit(1)
+
+    if args.watch and args.dry_run:
+        print("Error: --dry-run cannot be combined with --watch.")
+        exit(1)
+    if args.watch and args.missing_only:
+        print("Error: --missing-only cannot be combined with --watch.")
+        exit(1)
+    if args.watch and args.archive:
+        print("Error: --archive cannot be combined with --watch. Drop the archive in the unsorted directory instead.")
+        exit(1)
+    if args.webhooks and (args.watch or args.dry_run or args.missing_report or args.missing_only):
+        print("Error: --webhooks cannot be combined with --watch, --dry-run or the missing-artwork options. "
+              "Run the listener in its own process; watch mode picks up the indexes it updates.")
+        exit(1)
+
+    # Library profiles bring their own directories and services and never prompt
+    if args.library or args.all_libraries:
+        if args.sorted_dir or args.unsorted_dir or args.archive or args.queue_file:
+            print("Error: --sorted-dir, --unsorted-dir, --archive and --queue-file cannot be combined with library profiles.")
+            exit(1)
+        exit(0 if run_libraries(config, args) else 1)
+
+    # Interrupted runs are finished or undone from the apply journal, without a new scan
+    if args.resume or args.rollback:
+        exit(0 if finish_interrupted_run(config, args.resume) else 1)
+    if not args.dry_run and os.path.exists(get_apply_journal_path(config)):
+        print(f"An unfinished run was found in {get_apply_journal_path(config)}. Use --resume or --rollback first.")
+        exit(1)
+    for archive_path in args.archive:
+        if not os.path.isfile(archive_path):
+            print(f"Error: {archive_path} is not a file.")
+            exit(1)
 
     # Collect user inputs
-    sorted_dir = input("Enter the path to the sorted directory: ").strip()
-    unsorted_dir = input("Enter the path to the unsorted directory: ").strip()
+    sorted_dir = args.sorted_dir or input("Enter the path to the sorted directory: ").strip()
+
+    # The report and the webhook listener only work on the sorted side
+    if args.missing_report:
+        validate_directory(sorted_dir)
+        report_missing_artwork(config, sorted_dir)
+        exit(0)
+    if args.webhooks:
+        validate_directory(sorted_dir)
+        exit(0 if listen_for_webhooks(config, sorted_dir) else 1)
+
+    unsorted_dir = args.unsorted_dir or input("Enter the path to the unsorted directory: ").strip()
 
     # Validate directories
     validate_directory(sorted_dir)
@@ -80,63 +1180,9 @@ def main():
     validate_directory(unsorted_movies)
     validate_directory(unsorted_series)
 
-    # Step 1: Organize collection posters
-    print("\nOrganizing collection posters...")
-    collection_poster_move(
-        unsorted_dir=unsorted_dir,
-        sorted_dir=sorted_dir,
-    )
-    print("Finished organizing collection posters.")
-    
-    # Step 2: Process movie posters
-    print("\nProcessing movie posters...")
-    movie_poster_directories(
-        sorted_dir=sorted_dir,
-        unsorted_movies=unsorted_movies,
-        radarr_config=radarr_config,
-        tmdb_config=tmdb_config,
-    )
-    print("Finished processing movie posters.")
-
-    # Step 3: Process series posters
-    print("\nProcessing series posters...")
-    series_poster_directories(
-        sorted_dir=sorted_dir,
-        unsorted_series=unsorted_series,
-        sonarr_config=sonarr_config,
-    )
-    print("Finished processing series posters.")
-
-    # Step 4: Organize unsorted movie posters into sorted directories
-    print("\nOrganizing unsorted movie posters...")
-    movies_poster_move(
-        unsorted_dir=unsorted_dir,
-        sorted_dir=sorted_dir,
-    )
-    print("Finished organizing unsorted movie posters.")
-
-    # Step 5: Organize unsorted series posters into sorted directories
-    print("\nOrganizing unsorted series posters...")
-    series_poster_move(
-        unsorted_dir=unsorted_dir,
-        sorted_dir=sorted_dir,
-    )
-    print("Finished organizing unsorted series posters.")
-
-    # Step 6: Delete empty directories in the unsorted directory
-    print("\nDeleting empty directories in the unsorted directory...")
-    delete_empty_directories(unsorted_dir)
-    print("Finished deleting empty directories.")
-
-    # Step 7: Rename movie posters
-    print("\nRenaming movie posters...")
-    rename_movie_posters(sorted_dir)
-    print("Finished renaming movie posters.")
-
-    # Step 8: Rename series posters (including seasons and specials)
-    print("\nRenaming series posters (including seasons and specials)...")
-    rename_series_season_specials_posters(sorted_dir)
-    print("Finished renaming series posters.")
+    summary = run_library(config, sorted_dir, unsorted_dir, args)
+    if summary["status"] == "failed":
+        exit(1)
 
     print("\nAll tasks completed successfully!")
 
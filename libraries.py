@@ -0,0 +1,163 @@
+import os
+import io
+import time
+
+# Keys of a library profile that are not configuration sections
+PROFILE_PATH_KEYS = ("sorted_dir", "unsorted_dir")
+
+# Services whose rate limit is shared by every library, because they are reached from one address
+SHARED_SERVICES = ("tmdb",)
+
+
+def library_names(config):
+    """
+    Return the names of the library profiles defined in the "libraries" configuration section.
+    """
+    return list(config.get("libraries", {}))
+
+
+def library_config(config, name, workers=1):
+    """
+    Build the configuration of one library profile.
+
+    Every section of the profile is merged over the matching top-level section, so a profile
+    only lists what differs, for example its own "radarr" base URL and API key. Each library
+    gets its own cache directory, so indexes, caches, reports and apply journals never mix.
+    The rate limit of shared services such as TMDB is split between the workers running at
+    the same time.
+
+    Args:
+        config (dict): Parsed configuration dictionary.
+        name (str): Name of the library profile.
+        workers (int): Number of libraries processed at the same time.
+
+    Returns:
+        dict: Configuration of the library, with its name under "library" and its directories
+            under "sorted_dir" and "unsorted_dir".
+
+    Raises:
+        ValueError: If the profile does not exist or lacks its directories.
+    """
+    profiles = config.get("libraries", {})
+    if name not in profiles:
+        raise ValueError(f"Library '{name}' is not defined in the libraries section of config.json.")
+    profile = profiles[name]
+    for key in PROFILE_PATH_KEYS:
+        if not profile.get(key):
+            raise ValueError(f"Library '{name}' needs a {key}.")
+
+    merged = {key: value for key, value in config.items() if key != "libraries"}
+    for key, value in profile.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = {**merged[key], **value}
+        else:
+            merged[key] = value
+    merged["library"] = name
+
+    cache_config = dict(merged.get("cache", {}))
+    if cache_config.get("directory") and "cache" not in profile:
+        cache_config["directory"] = os.path.join(cache_config["directory"], name)
+    merged["cache"] = cache_config
+
+    for service in SHARED_SERVICES:
+        service_config = dict(merged.get(service, {}))
+        if service_config.get("rate_limit") and workers > 1:
+            service_config["rate_limit"] = service_config["rate_limit"] / workers
+        merged[service] = service_config
+    return merged
+
+
+def library_file_name(file_name, library):
+    """
+    Add the library name to a file name shared by every library, before its extension.
+
+    Args:
+        file_name (str): File name or path, for example "kometa.prom".
+        library (str): Library name, or None outside of library runs.
+
+    Returns:
+        str: For example "kometa-4k.prom", or file_name unchanged without a library.
+    """
+    if not library:
+        return file_name
+    root, extension = os.path.splitext(file_name)
+    return f"{root}-{library}{extension}"
+
+
+class PrefixedOutput(io.TextIOBase):
+    """
+    Text stream that starts every line with a prefix, so output of parallel workers stays readable.
+    """
+
+    def __init__(self, stream, prefix):
+        self.stream = stream
+        self.prefix = prefix
+        self.line_start = True
+
+    def write(self, text):
+        lines = text.split("\n")
+        output = []
+        for i, line in enumerate(lines):
+            if i > 0:
+                output.append("\n")
+                self.line_start = True
+            if line:
+                if self.line_start:
+                    output.append(self.prefix)
+                    self.line_start = False
+                output.append(line)
+        self.stream.write("".join(output))
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def library_summary(library, status, run_metrics=None, queued=0):
+    """
+    Summarize one library run for the combined summary.
+
+    Args:
+        library (str): Library name, or None outside of library runs.
+        status (str): "ok", "dry run", "failed" or "stopped".
+        run_metrics (RunMetrics, optional): Metrics of the run.
+        queued (int): Matches left in the disambiguation queue.
+
+    Returns:
+        dict: Plain values, so the summary can be sent back from a worker process.
+    """
+    totals = run_metrics.totals() if run_metrics else None
+    return {
+        "library": library or "",
+        "status": status,
+        "seconds": time.time() - run_metrics.started if run_metrics else 0.0,
+        "files_moved": totals.files_moved if totals else 0,
+        "bytes_copied": totals.bytes_copied if totals else 0,
+        "http_requests": sum(service.latency.count for service in totals.http.values()) if totals else 0,
+        "queued": queued,
+    }
+
+
+def print_summary(summaries, elapsed):
+    """
+    Print one line per library run and the totals.
+
+    Args:
+        summaries (list): Summary dicts returned by the library workers.
+        elapsed (float): Wall time of the whole run in seconds.
+    """
+    print("\nLibrary summary:")
+    header = f"{'library':<20}{'status':<10}{'seconds':>10}{'moved':>8}{'MB copied':>10}{'requests':>10}{'queued':>8}"
+    print(header)
+    print("-" * len(header))
+    for summary in summaries:
+        print(f"{summary['library']:<20}{summary['status']:<10}{summary['seconds']:>10.1f}{summary['files_moved']:>8}"
+              f"{summary['bytes_copied'] / 1_000_000:>10.1f}{summary['http_requests']:>10}{summary['queued']:>8}")
+    print("-" * len(header))
+    failed = sum(1 for summary in summaries if summary["status"] == "failed")
+    print(f"{'total':<20}{f'{failed} failed' if failed else 'ok':<10}"
+          f"{elapsed:>10.1f}"
+          f"{sum(summary['files_moved'] for summary in summaries):>8}"
+          f"{sum(summary['bytes_copied'] for summary in summaries) / 1_000_000:>10.1f}"
+          f"{sum(summary['http_requests'] for summary in summaries):>10}"
+          f"{sum(summary['queued'] for summary in summaries):>8}")
@@ -0,0 +1,506 @@
+import os
+import re
+import json
+import time
+import unicodedata
+from collections import namedtuple
+import requests
+import metrics
+from api_client import api_get
+from id_tags import strip_id_tags
+
+# Compact record holding only the Radarr fields the pipeline uses
+RadarrMovie = namedtuple("RadarrMovie", ["tmdb_id", "imdb_id", "path", "root_folder_path", "title", "year"])
+
+# Compact record holding only the Sonarr fields the pipeline uses
+SonarrSeries = namedtuple("SonarrSeries", ["tvdb_id", "imdb_id", "title", "year", "path", "seasons", "tmdb_id"])
+
+# Default lifetime of a persisted library index, in seconds
+DEFAULT_INDEX_TTL = 24 * 60 * 60
+
+
+def fetch_radarr_movies(radarr_config):
+    """
+    Download the full movie list from Radarr.
+
+    Args:
+        radarr_config (dict): Configuration for accessing the Radarr API.
+
+    Returns:
+        list: Raw movie records from Radarr, or None if the request failed.
+    """
+    radarr_api_key = radarr_config.get("api_key")
+    radarr_base_url = radarr_config.get("base_url")
+    if not radarr_api_key or not radarr_base_url:
+        raise ValueError("Radarr API key or base URL is missing in configuration.")
+
+    try:
+        response = api_get("radarr", f"{radarr_base_url}/movie", headers={"X-Api-Key": radarr_api_key})
+    except requests.RequestException as e:
+        print(f"Error fetching movies from Radarr: {e}")
+        return None
+    if response.status_code != 200:
+        print(f"Error fetching movies from Radarr: {response.status_code}")
+        return None
+    return response.json()
+
+
+def build_radarr_index(radarr_movies):
+    """
+    Build a lookup table of Radarr movies keyed by TMDB ID.
+
+    Args:
+        radarr_movies (list): Raw movie records from Radarr.
+
+    Returns:
+        dict: Mapping of TMDB ID to RadarrMovie.
+    """
+    index = {}
+    for movie in radarr_movies:
+        tmdb_id = movie.get("tmdbId")
+        if not tmdb_id:
+            continue
+        index[tmdb_id] = RadarrMovie(
+            tmdb_id=tmdb_id,
+            imdb_id=movie.get("imdbId"),
+            path=movie.get("path"),
+            root_folder_path=movie.get("rootFolderPath"),
+            title=movie.get("title"),
+            year=movie.get("year"),
+        )
+    return index
+
+
+def save_index_records(records, record_type, key, cache_path, source, created=None):
+    """
+    Persist library records to disk as compact rows.
+
+    Args:
+        records (iterable): Records of record_type.
+        record_type (type): Namedtuple type of the records.
+        key (str): Name of the list holding the rows, for example "movies".
+        cache_path (str): Path of the JSON file to write.
+        source (str): Base URL the records were fetched from.
+        created (float, optional): Time the records were fetched. Defaults to now.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    payload = {
+        "created": created or time.time(),
+        "source": source,
+        "fields": list(record_type._fields),
+        key: [list(record) for record in records],
+    }
+    temp_path = f"{cache_path}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(payload, file, separators=(",", ":"))
+    os.replace(temp_path, cache_path)
+
+
+def read_index_payload(record_type, cache_path, source):
+    """
+    Read a persisted library index of any age.
+
+    Args:
+        record_type (type): Namedtuple type of the records.
+        cache_path (str): Path of the JSON file to read.
+        source (str): Base URL the records must have been fetched from.
+
+    Returns:
+        dict: The payload with "created", "source", "fields" and the rows, or None if missing,
+            unreadable or written from another source or record layout.
+    """
+    if not os.path.exists(cache_path):
+        return None
+
+    try:
+        with open(cache_path, "r") as file:
+            payload = json.load(file)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Ignoring unreadable library index '{cache_path}': {e}")
+        return None
+
+    if payload.get("source") != source or payload.get("fields") != list(record_type._fields):
+        return None
+    return payload
+
+
+def read_index_records(record_type, key, cache_path, source, ttl=DEFAULT_INDEX_TTL):
+    """
+    Read persisted library records if they are still fresh.
+
+    Args:
+        record_type (type): Namedtuple type of the records.
+        key (str): Name of the list holding the rows.
+        cache_path (str): Path of the JSON file to read.
+        source (str): Base URL the records must have been fetched from.
+        ttl (int): Maximum age of the records in seconds.
+
+    Returns:
+        list: The records, or None if missing, stale or unreadable.
+    """
+    payload = read_index_payload(record_type, cache_path, source)
+    if payload is None:
+        return None
+    if time.time() - payload.get("created", 0) > ttl:
+        return None
+
+    return [record_type(*row) for row in payload.get(key, [])]
+
+
+class PersistedIndex:
+    """
+    A persisted library index patched one record at a time, without fetching the library again.
+
+    Records are keyed by their first field, the TMDB or TVDB ID. Records without an ID, such
+    as Sonarr series missing a TVDB ID, cannot be patched and are only kept to be saved back
+    unchanged. Patches keep the creation
+    time of the file, so it still expires after its TTL and a full refresh remains the safety
+    net for missed updates. A file rewritten by another process, such as the full refresh of
+    a pipeline run, is read again before the next patch.
+
+    Args:
+        record_type (type): RadarrMovie or SonarrSeries.
+        key (str): Name of the list holding the rows, "movies" or "series".
+        cache_path (str): Path of the persisted index.
+        source (str): Base URL of the Radarr or Sonarr instance.
+    """
+
+    def __init__(self, record_type, key, cache_path, source):
+        self.record_type = record_type
+        self.key = key
+        self.cache_path = cache_path
+        self.source = source
+        self.records = None
+        self.unkeyed = []
+        self.created = None
+        self.mtime = None
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.cache_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        """
+        Read the persisted index if it changed on disk since it was last read or written.
+
+        Returns:
+            bool: True if the index is available.
+        """
+        mtime = self._file_mtime()
+        if self.records is not None and mtime == self.mtime:
+            return True
+        payload = read_index_payload(self.record_type, self.cache_path, self.source)
+        if payload is None:
+            self.records = None
+            return False
+        records = [self.record_type(*row) for row in payload.get(self.key, [])]
+        # Records without an ID would all collapse onto a single None key
+        self.records = {record[0]: record for record in records if record[0]}
+        self.unkeyed = [record for record in records if not record[0]]
+        self.created = payload.get("created")
+        self.mtime = mtime
+        return True
+
+    def get(self, record_id):
+        return self.records.get(record_id)
+
+    def put(self, record):
+        """
+        Add or replace a record. A record without an ID is ignored.
+
+        Returns:
+            The record it replaced, or None.
+        """
+        if not record[0]:
+            return None
+        previous = self.records.get(record[0])
+        self.records[record[0]] = record
+        return previous
+
+    def remove(self, record_id):
+        """
+        Remove a record.
+
+        Returns:
+            The removed record, or None if the index did not have it.
+        """
+        return self.records.pop(record_id, None)
+
+    def save(self):
+        save_index_records([*self.records.values(), *self.unkeyed], self.record_type, self.key, self.cache_path, self.source,
+                           self.created)
+        self.mtime = self._file_mtime()
+
+
+def save_radarr_index(index, cache_path, source):
+    """
+    Persist a Radarr index to disk.
+
+    Args:
+        index (dict): Mapping of TMDB ID to RadarrMovie.
+        cache_path (str): Path of the JSON file to write.
+        source (str): Radarr base URL the index was built from.
+    """
+    save_index_records(index.values(), RadarrMovie, "movies", cache_path, source)
+
+
+def read_radarr_index(cache_path, source, ttl=DEFAULT_INDEX_TTL):
+    """
+    Read a persisted Radarr index if it is still fresh.
+
+    Args:
+        cache_path (str): Path of the JSON file to read.
+        source (str): Radarr base URL the index must have been built from.
+        ttl (int): Maximum age of the index in seconds.
+
+    Returns:
+        dict: Mapping of TMDB ID to RadarrMovie, or None if missing, stale or unreadable.
+    """
+    movies = read_index_records(RadarrMovie, "movies", cache_path, source, ttl)
+    if movies is None:
+        return None
+    return {movie.tmdb_id: movie for movie in movies}
+
+
+def find_radarr_movie(radarr_index, tags, by_imdb_id=None):
+    """
+    Return the Radarr movie named by parsed ID tags, by TMDB ID first.
+
+    Args:
+        radarr_index (dict): Radarr library index keyed by TMDB ID.
+        tags (dict): ID tags parsed from a file name.
+        by_imdb_id (dict, optional): Radarr movies keyed by lowercase IMDb ID, used for IMDb tags.
+
+    Returns:
+        RadarrMovie: The movie, or None if the library does not have it.
+    """
+    if "tmdb" in tags and tags["tmdb"] in radarr_index:
+        return radarr_index[tags["tmdb"]]
+    if "imdb" in tags and by_imdb_id:
+        return by_imdb_id.get(tags["imdb"])
+    return None
+
+
+def load_radarr_index(radarr_config, cache_path=None, ttl=DEFAULT_INDEX_TTL):
+    """
+    Load the Radarr library index, reusing a persisted copy when it is fresh.
+
+    Args:
+        radarr_config (dict): Configuration for accessing the Radarr API.
+        cache_path (str, optional): Path of the persisted index. Persistence is disabled when omitted.
+        ttl (int): Maximum age of a persisted index in seconds. A value of 0 always refetches.
+
+    Returns:
+        dict: Mapping of TMDB ID to RadarrMovie, or None if Radarr could not be reached.
+    """
+    source = radarr_config.get("base_url")
+    if cache_path and ttl:
+        index = read_radarr_index(cache_path, source, ttl)
+        if index is not None:
+            metrics.record_cache_hit("radarr_index")
+            print(f"Loaded Radarr index with {len(index)} movies from {cache_path}")
+            return index
+
+    radarr_movies = fetch_radarr_movies(radarr_config)
+    if radarr_movies is None:
+        return None
+
+    index = build_radarr_index(radarr_movies)
+    print(f"Fetched Radarr index with {len(index)} movies")
+    if cache_path:
+        save_radarr_index(index, cache_path, source)
+    return index
+
+
+def normalize_title(title):
+    """
+    Normalize a title for matching: accents removed, lowercased, "&" spelled out, apostrophes
+    and periods dropped ("S.H.I.E.L.D." becomes "shield") and other punctuation collapsed to
+    single spaces.
+
+    Args:
+        title (str): Title to normalize.
+
+    Returns:
+        str: Normalized title.
+    """
+    title = unicodedata.normalize("NFKD", title or "")
+    title = "".join(char for char in title if not unicodedata.combining(char))
+    title = title.lower().replace("&", " and ")
+    title = re.sub(r"['\u2019.]", "", title)
+    return " ".join(re.sub(r"[^\w\s]|_", " ", title).split())
+
+
+def fetch_sonarr_series(sonarr_config):
+    """
+    Download the full series list from Sonarr.
+
+    Args:
+        sonarr_config (dict): Configuration for accessing the Sonarr API.
+
+    Returns:
+        list: Raw series records from Sonarr, or None if the request failed.
+    """
+    sonarr_api_key = sonarr_config.get("api_key")
+    sonarr_base_url = sonarr_config.get("base_url")
+    if not sonarr_api_key or not sonarr_base_url:
+        raise ValueError("Sonarr API key or base URL is missing in configuration.")
+
+    try:
+        response = api_get("sonarr", f"{sonarr_base_url}/series", headers={"X-Api-Key": sonarr_api_key})
+    except requests.RequestException as e:
+        print(f"Error fetching series from Sonarr: {e}")
+        return None
+    if response.status_code != 200:
+        print(f"Error fetching series from Sonarr: {response.status_code}")
+        return None
+    return response.json()
+
+
+def build_sonarr_series(sonarr_series):
+    """
+    Convert raw Sonarr series records to SonarrSeries.
+
+    Args:
+        sonarr_series (list): Raw series records from Sonarr.
+
+    Returns:
+        list: SonarrSeries records.
+    """
+    return [
+        SonarrSeries(
+            tvdb_id=series.get("tvdbId"),
+            imdb_id=series.get("imdbId"),
+            title=series.get("title"),
+            year=series.get("year"),
+            path=series.get("path"),
+            seasons=sorted(season.get("seasonNumber") for season in series.get("seasons", [])
+                           if season.get("seasonNumber") is not None),
+            tmdb_id=series.get("tmdbId"),
+        )
+        for series in sonarr_series
+        if series.get("title")
+    ]
+
+
+def series_result(series):
+    """
+    Convert a SonarrSeries to the shape of a Sonarr /series/lookup result.
+    """
+    return {
+        "tvdbId": series.tvdb_id,
+        "imdbId": series.imdb_id,
+        "tmdbId": series.tmdb_id,
+        "title": series.title,
+        "year": series.year,
+        "path": series.path,
+    }
+
+
+class SonarrIndex:
+    """
+    In-memory index of the Sonarr library by normalized title and year, title, TVDB ID, IMDb ID,
+    TMDB ID and folder name.
+    """
+
+    def __init__(self, series):
+        self.series = list(series)
+        self.by_tvdb_id = {}
+        self.by_imdb_id = {}
+        self.by_tmdb_id = {}
+        self.by_title_year = {}
+        self.by_title = {}
+        self.by_folder = {}
+        for record in self.series:
+            if record.tvdb_id:
+                self.by_tvdb_id[record.tvdb_id] = record
+            if record.imdb_id:
+                self.by_imdb_id[record.imdb_id.lower()] = record
+            if record.tmdb_id:
+                self.by_tmdb_id[record.tmdb_id] = record
+            title = normalize_title(record.title)
+            self.by_title_year.setdefault((title, str(record.year)), []).append(record)
+            self.by_title.setdefault(title, []).append(record)
+            if record.path:
+                folder = os.path.basename(os.path.normpath(record.path.replace("\\", "/")))
+                self.by_folder[folder.lower()] = record
+                # "Title (Year) {tvdb-81189}" folders are also found by "Title (Year)"
+                self.by_folder.setdefault(strip_id_tags(folder).lower(), record)
+
+    def __len__(self):
+        return len(self.series)
+
+    def get(self, tvdb_id):
+        """
+        Return the series with a TVDB ID, or None.
+        """
+        return self.by_tvdb_id.get(tvdb_id)
+
+    def get_by_tags(self, tags):
+        """
+        Return the series named by parsed ID tags, by TVDB ID first, then IMDb and TMDB ID, or None.
+        """
+        if "tvdb" in tags and tags["tvdb"] in self.by_tvdb_id:
+            return self.by_tvdb_id[tags["tvdb"]]
+        if "imdb" in tags and tags["imdb"] in self.by_imdb_id:
+            return self.by_imdb_id[tags["imdb"]]
+        return self.by_tmdb_id.get(tags.get("tmdb"))
+
+    def find(self, title, year=None, folder=None):
+        """
+        Find the library series matching a poster group.
+
+        The folder name is tried first, then the normalized title with the year, then the
+        title alone so a wrong year still yields candidates to choose from.
+
+        Args:
+            title (str): Series title from the file name.
+            year (str, optional): Year from the file name.
+            folder (str, optional): "Title (Year)" key, compared with the Sonarr folder names.
+
+        Returns:
+            list: Matching SonarrSeries records, possibly empty.
+        """
+        if folder:
+            record = self.by_folder.get(folder.lower())
+            if record:
+                return [record]
+        title = normalize_title(title)
+        if year:
+            records = self.by_title_year.get((title, str(year)))
+            if records:
+                return records
+        return self.by_title.get(title, [])
+
+
+def load_sonarr_index(sonarr_config, cache_path=None, ttl=DEFAULT_INDEX_TTL):
+    """
+    Load the Sonarr library index, reusing a persisted copy when it is fresh.
+
+    Args:
+        sonarr_config (dict): Configuration for accessing the Sonarr API.
+        cache_path (str, optional): Path of the persisted index. Persistence is disabled when omitted.
+        ttl (int): Maximum age of a persisted index in seconds. A value of 0 always refetches.
+
+    Returns:
+        SonarrIndex: The index, or None if Sonarr could not be reached.
+    """
+    source = sonarr_config.get("base_url")
+    if cache_path and ttl:
+        series = read_index_records(SonarrSeries, "series", cache_path, source, ttl)
+        if series is not None:
+            metrics.record_cache_hit("sonarr_index")
+            print(f"Loaded Sonarr index with {len(series)} series from {cache_path}")
+            return SonarrIndex(series)
+
+    sonarr_series = fetch_sonarr_series(sonarr_config)
+    if sonarr_series is None:
+        return None
+
+    series = build_sonarr_series(sonarr_series)
+    print(f"Fetched Sonarr index with {len(series)} series")
+    if cache_path:
+        save_index_records(series, SonarrSeries, "series", cache_path, source)
+    return SonarrIndex(series)
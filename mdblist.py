@@ -0,0 +1,123 @@
+import requests
+from api_client import api_post
+
+# Maximum number of IDs sent in one MDBList batch request
+DEFAULT_BATCH_SIZE = 200
+
+# ID sources MDBList can look items up by, in order of preference
+ID_PROVIDERS = ("imdb", "tmdb", "tvdb")
+
+
+def normalize_id(provider, value):
+    """
+    Normalize an ID for comparison: IMDb IDs as lowercase strings, TMDB and TVDB IDs as integers.
+
+    Returns:
+        The normalized ID, or None if the value is empty or not a number.
+    """
+    if value in (None, ""):
+        return None
+    if provider == "imdb":
+        return str(value).lower()
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def fetch_media_batch(mdblist_config, provider, media_type, ids):
+    """
+    Look up a batch of items on MDBList by one kind of ID, in a single request.
+
+    Args:
+        mdblist_config (dict): Configuration for accessing the MDBList API.
+        provider (str): "imdb", "tmdb" or "tvdb".
+        media_type (str): "movie" or "show".
+        ids (list): IDs of the items, at most the batch size.
+
+    Returns:
+        list: Raw MDBList items, or None if the request failed.
+    """
+    try:
+        response = api_post(
+            "mdblist",
+            f"{mdblist_config['base_url']}/{provider}/{media_type}",
+            params={"apikey": mdblist_config["api_key"]},
+            json={"ids": ids},
+        )
+    except requests.RequestException as e:
+        print(f"Error fetching {media_type} IDs from MDBList: {e}")
+        return None
+
+    if response.status_code != 200:
+        print(f"Error fetching {media_type} IDs from MDBList: {response.status_code}")
+        return None
+
+    # An unreadable answer leaves the batch to the title lookups, like a failed request
+    try:
+        items = response.json()
+    except ValueError as e:
+        print(f"Error reading {media_type} IDs from MDBList: {e}")
+        return None
+    if not isinstance(items, list):
+        print(f"Error reading {media_type} IDs from MDBList: unexpected response")
+        return None
+    return items
+
+
+def resolve_id_tags(mdblist_config, media_type, tag_sets, target):
+    """
+    Cross-reference ID tags to another ID source through MDBList, in as few requests as possible.
+
+    Tag sets that already hold the target ID are left out. Every other tag set is looked up
+    by its preferred source, and the IDs of each source are sent in batches.
+
+    Args:
+        mdblist_config (dict): Configuration for accessing the MDBList API.
+        media_type (str): "movie" or "show".
+        tag_sets (iterable): ID tags parsed from file names.
+        target (str): ID source wanted, "tmdb" for Radarr or "tvdb" for Sonarr.
+
+    Returns:
+        dict: Mapping of (source, ID) to the IDs MDBList knows for the item, keyed by source.
+    """
+    if not mdblist_config.get("api_key") or not mdblist_config.get("base_url"):
+        raise ValueError("MDBList API key or base URL is missing in configuration.")
+
+    wanted = {}
+    for tags in tag_sets:
+        if target in tags:
+            continue
+        provider = next((provider for provider in ID_PROVIDERS if provider in tags), None)
+        if provider:
+            wanted.setdefault(provider, {})[normalize_id(provider, tags[provider])] = None
+
+    batch_size = mdblist_config.get("batch_size", DEFAULT_BATCH_SIZE)
+    references = {}
+    for provider, ids in wanted.items():
+        ids = list(ids)
+        for start in range(0, len(ids), batch_size):
+            items = fetch_media_batch(mdblist_config, provider, media_type, ids[start:start + batch_size])
+            for item in items or ():
+                item_ids = {source: normalize_id(source, value) for source, value in (item.get("ids") or {}).items()}
+                if item_ids.get(provider) is not None:
+                    references[(provider, item_ids[provider])] = item_ids
+    if wanted:
+        print(f"Cross-referenced {len(references)} of {sum(len(ids) for ids in wanted.values())} "
+              f"ID tag(s) to {target.upper()} IDs through MDBList.")
+    return references
+
+
+def cross_reference(references, tags, target):
+    """
+    Return the target ID of parsed ID tags from resolved MDBList references.
+
+    Returns:
+        The target ID, or None if none of the tags was resolved.
+    """
+    for provider in ID_PROVIDERS:
+        if provider in tags:
+            item_ids = references.get((provider, normalize_id(provider, tags[provider])))
+            if item_ids and item_ids.get(target) is not None:
+                return item_ids[target]
+    return None
@@ -0,0 +1,376 @@
+import os
+import json
+import time
+import threading
+import contextlib
+from collections import Counter, defaultdict
+
+# Upper bounds in seconds of the HTTP latency histogram buckets
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Step that receives counts recorded outside of any pipeline step
+OTHER_STEP = "other"
+
+# Prefix of every Prometheus metric name
+PROMETHEUS_PREFIX = "kometa_posters"
+
+
+class Histogram:
+    """
+    Cumulative latency histogram with fixed buckets, as used by Prometheus.
+    """
+
+    def __init__(self, buckets=HTTP_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "buckets": {str(bound): count for bound, count in zip(self.buckets, self.counts)},
+        }
+
+
+class ServiceMetrics:
+    """
+    HTTP counters of one service: latency, payload size and time lost to throttling.
+    """
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.response_bytes = 0
+        self.retries = 0
+        self.throttle_seconds = 0.0
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        self.response_bytes += other.response_bytes
+        self.retries += other.retries
+        self.throttle_seconds += other.throttle_seconds
+
+    def to_dict(self):
+        return {
+            "requests": self.latency.count,
+            "latency": self.latency.to_dict(),
+            "response_bytes": self.response_bytes,
+            "retries": self.retries,
+            "throttle_seconds": round(self.throttle_seconds, 6),
+        }
+
+
+class StepMetrics:
+    """
+    Counters of one pipeline step.
+    """
+
+    def __init__(self):
+        self.wall_time = 0.0
+        self.files_scanned = 0
+        self.stat_calls = 0
+        self.files_moved = 0
+        self.bytes_copied = 0
+        self.cache_hits = Counter()
+        self.http = defaultdict(ServiceMetrics)
+
+    def to_dict(self):
+        return {
+            "wall_time": round(self.wall_time, 6),
+            "files_scanned": self.files_scanned,
+            "stat_calls": self.stat_calls,
+            "files_moved": self.files_moved,
+            "bytes_copied": self.bytes_copied,
+            "cache_hits": dict(self.cache_hits),
+            "http": {service: service_metrics.to_dict() for service, service_metrics in sorted(self.http.items())},
+        }
+
+
+class RunMetrics:
+    """
+    Metrics of one pipeline run, broken down by step.
+
+    Steps run one after the other, so counts recorded from worker threads are attributed to
+    the step that is running. A stage running alongside the steps on its own thread pins
+    that thread, and the pools it starts, to a step of its own.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.steps = {}
+        self.current = OTHER_STEP
+        self.lock = threading.Lock()
+        self.local = threading.local()  # Step pinned to the calling thread, if any
+
+    def step_name(self):
+        return getattr(self.local, "step", None) or self.current
+
+    def step_metrics(self, name):
+        if name not in self.steps:
+            self.steps[name] = StepMetrics()
+        return self.steps[name]
+
+    @contextlib.contextmanager
+    def step(self, name):
+        """
+        Attribute everything recorded inside the block to a step and time it.
+        """
+        previous = self.current
+        with self.lock:
+            self.step_metrics(name)
+            self.current = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.steps[name].wall_time += time.perf_counter() - start
+                self.current = previous
+
+    def pin_thread(self, name):
+        """
+        Attribute everything the calling thread records to a step, whichever step is running.
+        """
+        with self.lock:
+            self.step_metrics(name)
+        self.local.step = name
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Attribute everything the calling thread records inside the block to a step and add
+        the time spent to it, while other threads keep their own steps.
+        """
+        previous = getattr(self.local, "step", None)
+        self.pin_thread(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.steps[name].wall_time += time.perf_counter() - start
+            self.local.step = previous
+
+    def add(self, field, amount=1):
+        with self.lock:
+            step = self.step_metrics(self.step_name())
+            setattr(step, field, getattr(step, field) + amount)
+
+    def cache_hit(self, cache):
+        with self.lock:
+            self.step_metrics(self.step_name()).cache_hits[cache] += 1
+
+    def observe_http(self, service, seconds, response_bytes=0):
+        with self.lock:
+            service_metrics = self.step_metrics(self.step_name()).http[service]
+            service_metrics.latency.observe(seconds)
+            service_metrics.response_bytes += response_bytes
+
+    def throttled(self, service, seconds, retry=False):
+        with self.lock:
+            service_metrics = self.step_metrics(self.step_name()).http[service]
+            service_metrics.throttle_seconds += seconds
+            if retry:
+                service_metrics.retries += 1
+
+    def totals(self):
+        """
+        Return the metrics of every step added together.
+        """
+        total = StepMetrics()
+        for step in self.steps.values():
+            total.wall_time += step.wall_time
+            total.files_scanned += step.files_scanned
+            total.stat_calls += step.stat_calls
+            total.files_moved += step.files_moved
+            total.bytes_copied += step.bytes_copied
+            total.cache_hits.update(step.cache_hits)
+            for service, service_metrics in step.http.items():
+                total.http[service].merge(service_metrics)
+        return total
+
+    def to_dict(self):
+        return {
+            "started": self.started,
+            "finished": time.time(),
+            "steps": {name: step.to_dict() for name, step in self.steps.items()},
+            "totals": self.totals().to_dict(),
+        }
+
+    def write_json(self, path):
+        """
+        Write the run report as JSON, replacing the previous report atomically.
+        """
+        write_atomically(path, json.dumps(self.to_dict(), indent=4))
+
+    def prometheus_lines(self, constant_labels=()):
+        """
+        Return the metrics in the Prometheus text format.
+
+        Args:
+            constant_labels (iterable): (name, value) label pairs added to every sample, for
+                example [("library", "4k")].
+        """
+        lines = []
+        constant_labels = list(constant_labels)
+
+        def metric(name, metric_type, help_text, samples):
+            full_name = f"{PROMETHEUS_PREFIX}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {metric_type}")
+            for suffix, labels, value in samples:
+                label_text = ",".join(f'{key}="{escape_label(label_value)}"'
+                                      for key, label_value in constant_labels + labels)
+                lines.append(f"{full_name}{suffix}{{{label_text}}} {value}" if label_text else f"{full_name}{suffix} {value}")
+
+        steps = list(self.steps.items())
+        metric("step_duration_seconds", "gauge", "Wall time of each pipeline step in the last run.",
+               [("", [("step", name)], round(step.wall_time, 6)) for name, step in steps])
+        metric("step_files_scanned", "gauge", "Files scanned by each pipeline step in the last run.",
+               [("", [("step", name)], step.files_scanned) for name, step in steps])
+        metric("step_stat_calls", "gauge", "Filesystem stat calls made by each pipeline step in the last run.",
+               [("", [("step", name)], step.stat_calls) for name, step in steps])
+        metric("step_bytes_copied", "gauge",
+               "Bytes copied across filesystems or out of archives by each pipeline step in the last run. "
+               "Same-filesystem renames copy nothing.",
+               [("", [("step", name)], step.bytes_copied) for name, step in steps])
+        metric("step_files_moved", "gauge", "Files moved by each pipeline step in the last run.",
+               [("", [("step", name)], step.files_moved) for name, step in steps])
+        metric("cache_hits", "gauge", "Cache hits in the last run.",
+               [("", [("step", name), ("cache", cache)], hits)
+                for name, step in steps for cache, hits in sorted(step.cache_hits.items())])
+
+        metric("step_http_requests", "gauge", "HTTP requests sent by each pipeline step in the last run, per service.",
+               [("", [("step", name), ("service", service)], service_metrics.latency.count)
+                for name, step in steps for service, service_metrics in sorted(step.http.items())])
+
+        totals = sorted(self.totals().http.items())
+        samples = []
+        for service, service_metrics in totals:
+            histogram = service_metrics.latency
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                samples.append(("_bucket", [("service", service), ("le", str(bound))], count))
+            samples.append(("_bucket", [("service", service), ("le", "+Inf")], histogram.count))
+            samples.append(("_sum", [("service", service)], round(histogram.sum, 6)))
+            samples.append(("_count", [("service", service)], histogram.count))
+        metric("http_request_duration_seconds", "histogram", "Latency of HTTP requests per service in the last run.",
+               samples)
+        metric("http_response_bytes", "gauge", "Bytes received per service in the last run.",
+               [("", [("service", service)], service_metrics.response_bytes) for service, service_metrics in totals])
+        metric("http_retries", "gauge", "Requests retried after a throttled or failed response in the last run.",
+               [("", [("service", service)], service_metrics.retries) for service, service_metrics in totals])
+        metric("http_throttle_seconds", "gauge", "Time spent waiting on rate limits and retry backoff in the last run.",
+               [("", [("service", service)], round(service_metrics.throttle_seconds, 6))
+                for service, service_metrics in totals])
+
+        metric("last_run_timestamp_seconds", "gauge", "Time the last run started.", [("", [], round(self.started, 3))])
+        return lines
+
+    def write_prometheus(self, path, constant_labels=()):
+        """
+        Write the metrics in the Prometheus text format, for the node_exporter textfile collector.
+        """
+        write_atomically(path, "\n".join(self.prometheus_lines(constant_labels)) + "\n")
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def write_atomically(path, text):
+    # Readers such as the textfile collector never see a partial file
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as file:
+        file.write(text)
+    os.replace(temp_path, path)
+
+
+_run = RunMetrics()
+
+
+def start_run():
+    """
+    Start collecting metrics for a new run.
+
+    Returns:
+        RunMetrics: The metrics of the new run.
+    """
+    global _run
+    _run = RunMetrics()
+    return _run
+
+
+def current_run():
+    return _run
+
+
+def step(name):
+    """
+    Attribute everything recorded inside the block to a pipeline step of the current run.
+    """
+    return _run.step(name)
+
+
+def stage(name):
+    """
+    Attribute everything the calling thread records inside the block to a step of the current
+    run, while the pipeline steps go on in other threads.
+    """
+    return _run.stage(name)
+
+
+def current_step():
+    """
+    Return the step the calling thread records to.
+    """
+    return _run.step_name()
+
+
+def pin_thread(name):
+    """
+    Attribute everything the calling thread records to a step of the current run. Used as the
+    initializer of worker pools started by a stage.
+    """
+    _run.pin_thread(name)
+
+
+def record_files_scanned(count=1):
+    _run.add("files_scanned", count)
+
+
+def record_stat(count=1):
+    _run.add("stat_calls", count)
+
+
+def record_move(size=0):
+    # Only copies pass a size: a rename moves no data, and reading its size would cost a stat
+    _run.add("files_moved")
+    if size:
+        _run.add("bytes_copied", size)
+
+
+def record_cache_hit(cache):
+    _run.cache_hit(cache)
+
+
+def record_http(service, seconds, response_bytes=0):
+    _run.observe_http(service, seconds, response_bytes)
+
+
+def record_throttle(service, seconds, retry=False):
+    _run.throttled(service, seconds, retry)
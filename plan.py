@@ -0,0 +1,466 @@
+import os
+import json
+import contextlib
+from collections import defaultdict
+from archives import ArchiveCache, extract_member
+from file_transfer import DeviceCache, copy_file_contents, rename_exclusive, transfer_file, transfer_files, DEFAULT_TRANSFER_WORKERS
+
+# Order in which operation kinds are applied
+OPERATION_ORDER = ("mkdir", "remove", "extract", "move", "rename", "rmdir")
+
+
+class Plan:
+    """
+    Ordered list of filesystem operations computed by the pipeline before anything is changed.
+
+    Operations are ("mkdir", path), ("remove", path, original), ("extract", archive, member, target),
+    ("move", source, target), ("rename", source, target) and ("rmdir", path). A removed file is
+    an exact duplicate of original, which is copied back when the removal is rolled back.
+
+    A file that the plan moves or extracts and then renames is sent straight to its new name,
+    so it is written once.
+
+    Operations can be handed out in installments with take while the plan is still growing.
+    Once taken, an operation no longer changes.
+    """
+
+    def __init__(self, operations=None):
+        self.operations = [tuple(operation) for operation in operations or []]
+        self.placed = {}  # Target of a planned move or extraction -> index of the operation
+        self.taken = 0  # Operations handed out by take
+
+    def __len__(self):
+        return len(self.operations)
+
+    def mkdir(self, path):
+        self.operations.append(("mkdir", str(path)))
+
+    def move(self, source, target):
+        self.placed[str(target)] = len(self.operations)
+        self.operations.append(("move", str(source), str(target)))
+
+    def extract(self, archive, member, target):
+        self.placed[str(target)] = len(self.operations)
+        self.operations.append(("extract", str(archive), member, str(target)))
+
+    def rename(self, source, target):
+        index = self.placed.pop(str(source), None)
+        if index is not None:
+            self.operations[index] = self.operations[index][:-1] + (str(target),)
+            self.placed[str(target)] = index
+            return
+        self.operations.append(("rename", str(source), str(target)))
+
+    def remove(self, path, original):
+        self.operations.append(("remove", str(path), str(original)))
+
+    def rmdir(self, path):
+        self.operations.append(("rmdir", str(path)))
+
+    def take(self):
+        """
+        Return the operations recorded since the last call. Files they move or extract are
+        renamed by a separate operation from now on, since these operations may already be applied.
+
+        Returns:
+            list: The new operations, in the order they were recorded.
+        """
+        operations = self.operations[self.taken:]
+        self.taken = len(self.operations)
+        self.placed = {}
+        return operations
+
+    def batched(self):
+        """
+        Return the operations grouped for execution.
+
+        Directories are created parents first and duplicates are removed before anything
+        moves, so the file each one duplicates is still in place. Extractions and moves are
+        grouped by target directory, renames by directory, and directories are removed deepest
+        first. The relative order of operations within a directory is kept.
+
+        Returns:
+            list: Operations in execution order.
+        """
+        by_kind = defaultdict(list)
+        for operation in self.operations:
+            by_kind[operation[0]].append(operation)
+
+        ordered = sorted(by_kind["mkdir"], key=lambda operation: operation[1].count(os.sep))
+        ordered.extend(by_kind["remove"])
+        for kind in ("extract", "move", "rename"):
+            groups = defaultdict(list)
+            for operation in by_kind[kind]:
+                groups[os.path.dirname(operation[-1])].append(operation)
+            for operations in groups.values():
+                ordered.extend(operations)
+        ordered.extend(sorted(by_kind["rmdir"], key=lambda operation: operation[1].count(os.sep), reverse=True))
+        return ordered
+
+    def print_plan(self):
+        """
+        Print every planned operation, grouped by kind.
+        """
+        if not self.operations:
+            print("Nothing to do.")
+            return
+
+        labels = {"mkdir": "Create directory", "move": "Move", "rename": "Rename", "rmdir": "Delete empty directory"}
+        for operation in self.batched():
+            if operation[0] == "remove":
+                print(f"Delete duplicate: {operation[1]} (same as {operation[2]})")
+            elif operation[0] == "extract":
+                print(f"Extract: {operation[2]} from {operation[1]} -> {operation[3]}")
+            elif len(operation) == 3:
+                print(f"{labels[operation[0]]}: {operation[1]} -> {operation[2]}")
+            else:
+                print(f"{labels[operation[0]]}: {operation[1]}")
+
+        counts = defaultdict(int)
+        for operation in self.operations:
+            counts[operation[0]] += 1
+        print(", ".join(f"{counts[kind]} {kind}" for kind in OPERATION_ORDER if counts[kind]))
+
+
+def make_directory(path, plan=None, manifest=None):
+    """
+    Create a directory and its parents, or record the creation in a plan.
+
+    Args:
+        path (str): Path to the directory.
+        plan (Plan, optional): Plan to record the operation in instead of performing it.
+        manifest (ScanManifest, optional): Scan used to skip directories that already exist.
+    """
+    if plan is None:
+        os.makedirs(path, exist_ok=True)
+        return
+
+    # Record each missing parent so the plan can be applied on an empty tree
+    missing = []
+    current = os.path.normpath(str(path))
+    while not (manifest.exists(current) if manifest else os.path.isdir(current)):
+        missing.append(current)
+        parent = os.path.dirname(current)
+        if parent == current:
+            break
+        current = parent
+    for dir_path in reversed(missing):
+        plan.mkdir(dir_path)
+        if manifest:
+            manifest.add_directory(dir_path)
+
+
+def move_file(source, target, plan=None, manifest=None):
+    """
+    Move a file, or record the move in a plan. Archive members are extracted instead.
+
+    Args:
+        source (str): Path to the file, or the virtual path of an archive member.
+        target (str): Destination path.
+        plan (Plan, optional): Plan to record the operation in instead of performing it.
+        manifest (ScanManifest, optional): Scan that knows which paths are archive members.
+    """
+    member = manifest.member(source) if manifest else None
+    if member:
+        if plan is None:
+            extract_member(member[0], member[1], target, manifest.archive_cache)
+        else:
+            plan.extract(member[0], member[1], target)
+    elif plan is None:
+        transfer_file(source, target)
+    else:
+        plan.move(source, target)
+
+
+def remove_duplicate(path, original, plan=None):
+    """
+    Delete a file that duplicates another one, or record the removal in a plan.
+    """
+    if plan is None:
+        os.remove(path)
+    else:
+        plan.remove(path, original)
+
+
+def rename_path(source, target, plan=None):
+    """
+    Rename a file within its directory, or record the rename in a plan.
+    """
+    if plan is None:
+        os.rename(source, target)
+    else:
+        plan.rename(source, target)
+
+
+class ApplyJournal:
+    """
+    Append-only journal of a plan being applied.
+
+    The first line holds the batched operations; every following line holds the index of
+    an operation that completed. A plan applied in installments appends the operations of each
+    later installment as another JSON line, numbered on from the earlier ones. An interrupted
+    run can be resumed or rolled back from it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def start(self, operations):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "w") as file:
+            file.write(json.dumps({"operations": operations}) + "\n")
+
+    def extend(self, operations):
+        """
+        Append the operations of another installment.
+        """
+        with open(self.path, "a") as file:
+            file.write(json.dumps({"operations": operations}) + "\n")
+            file.flush()
+
+    def load(self):
+        """
+        Return (operations, completed indexes) from the journal.
+        """
+        with open(self.path, "r") as file:
+            operations = [tuple(operation) for operation in json.loads(file.readline())["operations"]]
+            completed = []
+            for line in file:
+                line = line.strip()
+                if line.startswith("{"):
+                    operations.extend(tuple(operation) for operation in json.loads(line)["operations"])
+                elif line:
+                    completed.append(int(line))
+        return operations, completed
+
+    def rewrite(self, operations, completed):
+        with open(self.path, "w") as file:
+            file.write(json.dumps({"operations": operations}) + "\n")
+            file.writelines(f"{index}\n" for index in completed)
+
+    def mark_done(self, file, index):
+        # Flushed per operation so a crash loses at most the operation in flight
+        file.write(f"{index}\n")
+        file.flush()
+
+    def finish(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def execute_operation(operation, devices, archives=None, exclusive=False):
+    """
+    Perform one planned operation.
+
+    Args:
+        operation (tuple): Operation to perform.
+        devices (DeviceCache): Device lookups shared across the run.
+        archives (ArchiveCache, optional): Archives kept open across extractions.
+        exclusive (bool): Fail renames and moves onto an existing file instead of replacing it.
+    """
+    kind = operation[0]
+    if kind == "mkdir":
+        os.makedirs(operation[1], exist_ok=True)
+    elif kind == "rmdir":
+        os.rmdir(operation[1])
+    elif kind == "remove":
+        os.remove(operation[1])
+    elif kind == "extract":
+        extract_member(operation[1], operation[2], operation[3], archives)
+    elif kind == "rename":
+        if not (exclusive and rename_exclusive(operation[1], operation[2])):
+            os.rename(operation[1], operation[2])
+    else:
+        transfer_file(operation[1], operation[2], devices, exclusive)
+
+
+def report_failure(journal, operation, error):
+    print(f"Failed to {operation[0]} {operation[1]}: {error}")
+    print(f"Stopped. Resume with --resume or undo with --rollback (journal: {journal.path}).")
+
+
+def run_operations(journal, operations, completed=(), max_workers=DEFAULT_TRANSFER_WORKERS, exclusive=False,
+                   first=0, devices=None):
+    """
+    Perform operations in order, recording each one in the journal as it completes.
+
+    Consecutive moves are independent of each other, so they run on a pool of max_workers
+    threads. Every other operation runs on its own, in order. In exclusive mode, a rename or
+    move onto an existing file fails instead of replacing it.
+
+    Args:
+        first (int): Journal index of the first operation, for installments after the first.
+        devices (DeviceCache, optional): Device lookups shared across installments.
+
+    Returns:
+        bool: True if every operation completed.
+    """
+    devices = devices or DeviceCache()
+    archives = ArchiveCache()
+    completed = {index - first for index in completed}
+    with open(journal.path, "a") as file, contextlib.closing(archives):
+        index = 0
+        while index < len(operations):
+            if operations[index][0] == "move":
+                moves = []
+                while index < len(operations) and operations[index][0] == "move":
+                    if index not in completed:
+                        moves.append((index, operations[index][1], operations[index][2]))
+                    index += 1
+                failed = False
+                for move_index, error in transfer_files(moves, devices, max_workers, exclusive):
+                    if error is None:
+                        journal.mark_done(file, first + move_index)
+                    elif not failed:
+                        failed = True
+                        report_failure(journal, operations[move_index], error)
+                if failed:
+                    return False
+                continue
+
+            if index not in completed:
+                try:
+                    execute_operation(operations[index], devices, archives, exclusive)
+                except OSError as e:
+                    report_failure(journal, operations[index], e)
+                    return False
+                journal.mark_done(file, first + index)
+            index += 1
+    return True
+
+
+class PlanApplier:
+    """
+    Applies a plan handed over in installments while the rest of it is still being computed.
+
+    Every installment is batched and journaled on top of the earlier ones, so an interrupted
+    run is resumed or rolled back as a whole. Once an installment fails, the later ones are
+    skipped and their files stay where they are for the next run.
+
+    Args:
+        journal_path (str): Path of the apply journal.
+        max_workers (int): Maximum number of files moved at the same time.
+        exclusive (bool): Fail renames and moves onto an existing file instead of replacing it.
+
+    Raises:
+        RuntimeError: If an unfinished run is left in the journal.
+    """
+
+    def __init__(self, journal_path, max_workers=DEFAULT_TRANSFER_WORKERS, exclusive=False):
+        self.journal = ApplyJournal(journal_path)
+        if self.journal.exists():
+            raise RuntimeError(f"An unfinished run was found in {journal_path}. Use --resume or --rollback first.")
+        self.max_workers = max_workers
+        self.exclusive = exclusive
+        self.devices = DeviceCache()
+        self.applied = 0  # Operations journaled so far
+        self.failed = False
+
+    def apply(self, installments):
+        """
+        Apply one or more installments of operations as a single batch.
+
+        Args:
+            installments (list): Lists of operations, as returned by Plan.take.
+
+        Returns:
+            bool: True if every operation completed.
+        """
+        if self.failed:
+            return False
+        operations = Plan([operation for operations in installments for operation in operations]).batched()
+        if not operations:
+            return True
+
+        if self.applied:
+            self.journal.extend(operations)
+        else:
+            self.journal.start(operations)
+        first = self.applied
+        self.applied += len(operations)
+        if not run_operations(self.journal, operations, max_workers=self.max_workers, exclusive=self.exclusive,
+                              first=first, devices=self.devices):
+            self.failed = True
+        return not self.failed
+
+    def finish(self):
+        """
+        Remove the journal once every installment completed.
+
+        Returns:
+            bool: True if every operation completed.
+        """
+        if self.failed:
+            return False
+        self.journal.finish()
+        if self.applied:
+            print(f"Applied {self.applied} operation(s).")
+        return True
+
+
+def resume_plan(journal_path, max_workers=DEFAULT_TRANSFER_WORKERS, exclusive=False):
+    """
+    Finish applying the plan recorded in an apply journal.
+
+    Args:
+        journal_path (str): Path of the apply journal.
+        max_workers (int): Maximum number of files moved at the same time.
+        exclusive (bool): Fail renames and moves onto an existing file instead of replacing it.
+
+    Returns:
+        bool: True if every operation completed.
+    """
+    journal = ApplyJournal(journal_path)
+    if not journal.exists():
+        print("No unfinished run to resume.")
+        return True
+
+    operations, completed = journal.load()
+    print(f"Resuming: {len(completed)} of {len(operations)} operation(s) already done.")
+    if not run_operations(journal, operations, completed, max_workers, exclusive):
+        return False
+    journal.finish()
+    print("Resumed run completed.")
+    return True
+
+
+def rollback_plan(journal_path):
+    """
+    Undo the completed operations of an interrupted run, newest first.
+
+    Returns:
+        bool: True if every completed operation was undone.
+    """
+    journal = ApplyJournal(journal_path)
+    if not journal.exists():
+        print("No unfinished run to roll back.")
+        return True
+
+    operations, completed = journal.load()
+    devices = DeviceCache()
+    for position in range(len(completed) - 1, -1, -1):
+        kind, *paths = operations[completed[position]]
+        try:
+            if kind == "mkdir":
+                os.rmdir(paths[0])
+            elif kind == "rmdir":
+                os.makedirs(paths[0], exist_ok=True)
+            elif kind == "remove":
+                # Later operations are already undone, so the original is back where it was
+                copy_file_contents(paths[1], paths[0])
+            elif kind == "extract":
+                # The archive was never changed, so undoing an extraction only deletes the copy
+                os.remove(paths[2])
+            else:
+                execute_operation((kind, paths[1], paths[0]), devices)
+        except OSError as e:
+            print(f"Failed to undo {kind} {paths[0]}: {e}")
+            # Keep only the operations that are still applied, so a second rollback can continue
+            journal.rewrite(operations, completed[:position + 1])
+            return False
+    journal.finish()
+    print(f"Rolled back {len(completed)} operation(s).")
+    return True
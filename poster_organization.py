@@ -1,114 +1,450 @@
 import os
-import shutil
+import re
 from pathlib import Path
+from collections import defaultdict
+from plan import make_directory, move_file, remove_duplicate
+from id_tags import parse_id_tags, strip_id_tags, id_tag_keys, tags_conflict
+from image_inspection import ImageInspector
+from rename_rules import load_rename_rules
 
-def collection_poster_move(unsorted_dir, sorted_dir):
+# Image extensions handled by the move steps
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp")
+
+# Matches the leading "Name (Year)" portion of a file or directory name
+MATCH_KEY_PATTERN = re.compile(r"^(.*?\(\d{4}\))")
+
+# Drop folders of the unsorted directory, named like the kinds of sorted directories. TMDB
+# movie and TV IDs share one number space, so ID tags only pair within a kind.
+MEDIA_KINDS = ("movies", "series")
+
+def collection_poster_move(unsorted_dir, sorted_dir, manifest=None, plan=None):
     """
     Organize collection posters.
 
     Args:
         unsorted_dir (str): Path to the unsorted collections directory.
         sorted_dir (str): Path to the sorted directory for collections.
+        manifest (ScanManifest, optional): Scan of the unsorted and sorted trees. The unsorted
+            directory is walked when omitted.
+        plan (Plan, optional): Record the operations in this plan instead of performing them.
+            Requires a manifest.
+
+    Returns:
+        set: Directories that received a poster.
     """
     target_dir = os.path.join(sorted_dir, "collections")
-    os.makedirs(target_dir, exist_ok=True)
+    make_directory(target_dir, plan, manifest)
+    affected_dirs = set()
+    if manifest:
+        manifest.add_directory(target_dir)
 
     # Search for image files in the unsorted directory and its subdirectories
-    for file in Path(unsorted_dir).rglob("*"):
-        # Process only image files containing the word "collection"
-        if file.suffix.lower() in [".jpg", ".jpeg", ".png", ".gif", ".bmp"] and "collection" in file.name.lower():
-            # Create a subdirectory for each image file, removing the word "collection" from the directory name
-            subdirectory_name = file.stem.replace("collection", "").strip()  # Remove "collection" and strip whitespace
-            subdirectory_path = os.path.join(target_dir, subdirectory_name)
-            os.makedirs(subdirectory_path, exist_ok=True)
+    if manifest:
+        candidates = [Path(entry.path) for entry in manifest.files(under=unsorted_dir, extensions=IMAGE_EXTENSIONS,
+                                                                    category="collection")]
+    else:
+        candidates = Path(unsorted_dir).rglob("*")
+
+    # Group the image files containing the word "collection" by the subdirectory they belong in
+    subdirectories = defaultdict(list)
+    for file in candidates:
+        if file.suffix.lower() in IMAGE_EXTENSIONS and "collection" in file.name.lower():
+            # Remove "collection" from the directory name and strip whitespace
+            subdirectory_name = file.stem.replace("collection", "").strip()
+            subdirectories[os.path.join(target_dir, subdirectory_name)].append(file)
+
+    inspector = ImageInspector(manifest)
+    for subdirectory_path, files in subdirectories.items():
+        make_directory(subdirectory_path, plan, manifest)
+        if manifest:
+            manifest.add_directory(subdirectory_path)
 
+        # Every candidate competes for the collection's poster
+        selected, _ = select_images(subdirectory_path, files, collection_slot, manifest, plan, inspector)
+        for file in selected:
             # Rename the image file to "poster" while keeping the extension intact
             new_file_name = f"poster{file.suffix}"
             target_path = os.path.join(subdirectory_path, new_file_name)
 
             # Check if the file already exists in the target location
-            if os.path.exists(target_path):
+            if manifest.exists(target_path) if manifest else os.path.exists(target_path):
                 # File already exists, skip
                 continue
 
             # Move the image file to the new subdirectory
-            shutil.move(str(file), target_path)
+            move_file(file, target_path, plan, manifest)
+            if manifest:
+                manifest.move_file(file, target_path)
+            affected_dirs.add(subdirectory_path)
+
+    return affected_dirs
+
+
+def collection_slot(file_name):
+    """
+    Return the slot of a file in a collection directory: every collection image becomes its poster.
+    """
+    if "collection" in file_name.lower() or os.path.splitext(file_name)[0].lower() == "poster":
+        return "poster"
+    return None
+
+
+def rule_slot(rules):
+    """
+    Return a function giving the slot a file name fills once renamed by the rules, such as
+    "poster" or "season01", or None for files the rules leave alone.
+    """
+    def slot(file_name):
+        matched = rules.match(file_name)
+        return os.path.splitext(matched[1])[0].lower() if matched else None
+    return slot
+
+
+def directory_files(dir_path, manifest=None):
+    """
+    List the paths of the files already in a sorted directory.
+
+    Args:
+        dir_path (str): Path to the directory.
+        manifest (ScanManifest, optional): Scan to read the listing from instead of the filesystem.
+
+    Returns:
+        list: Paths of the files, empty if the directory does not exist yet.
+    """
+    if manifest and manifest.ensure_listed(dir_path):
+        return [entry.path for entry in manifest.listdir(dir_path)]
+    if not os.path.isdir(dir_path):
+        return []
+    with os.scandir(dir_path) as entries:
+        return [entry.path for entry in entries if entry.is_file()]
+
+
+def select_images(dir_path, candidates, slot_of, manifest=None, plan=None, inspector=None):
+    """
+    Pick the unsorted images to move into one sorted directory.
+
+    Exact duplicates of a file already in the directory or of an earlier candidate are deleted
+    instead of moved, or left in their archive. Of the candidates that fill the same slot once
+    renamed, such as poster.* or SeasonNN.*, only the one with the most pixels is moved, then
+    the largest file, then the first one found. A slot already filled in the directory keeps
+    its file, and the other candidates stay in the unsorted directory. Image sizes are read
+    from the file headers, and only files that share a size with another file are hashed.
+
+    Args:
+        dir_path (str): Path to the sorted directory.
+        candidates (list): Paths of the unsorted images matched to the directory, in walk order.
+        slot_of (callable): Returns the slot a file name fills, or None if it fills no slot.
+        manifest (ScanManifest, optional): Scan to read the directory from and update.
+        plan (Plan, optional): Record the deletions in this plan instead of performing them.
+        inspector (ImageInspector, optional): Cache of file sizes, hashes and image headers.
+
+    Returns:
+        tuple: (paths of the images to move, in candidate order; paths of the deleted duplicates).
+    """
+    inspector = inspector or ImageInspector(manifest)
+    existing = directory_files(dir_path, manifest)
+    duplicates = inspector.duplicates(candidates, existing) if len(candidates) + len(existing) > 1 else {}
+    for path, original in duplicates.items():
+        print(f"Dropping duplicate {os.path.basename(path)}: same image as {original}")
+        # Archive members are simply not extracted
+        if not (manifest and manifest.member(path)):
+            remove_duplicate(path, original, plan)
+        if manifest:
+            manifest.remove_file(path)
+
+    filled = {slot_of(os.path.basename(path)) for path in existing}
+    slots = defaultdict(list)
+    for img_path in candidates:
+        if str(img_path) not in duplicates:
+            slots[slot_of(img_path.name)].append(img_path)
+
+    selected = set()
+    for slot, images in slots.items():
+        if slot is None:
+            selected.update(images)
+        elif slot in filled:
+            print(f"Keeping the existing {slot} in {dir_path}; {len(images)} candidate(s) left unsorted.")
+        elif len(images) == 1:
+            selected.add(images[0])
+        else:
+            best = max(images, key=lambda path: (inspector.pixels(path), inspector.size(path), -images.index(path)))
+            selected.add(best)
+            header = inspector.header(best)
+            resolution = f"{header[1]}x{header[2]}" if header else "unknown resolution"
+            print(f"Picked {best.name} ({resolution}) for {slot} over {len(images) - 1} other candidate(s).")
+    return [img_path for img_path in candidates if img_path in selected], [Path(path) for path in duplicates]
+
+def poster_match_key(name):
+    """
+    Extract the normalized "Name (Year)" prefix used to pair posters with sorted directories.
+
+    Args:
+        name (str): File or directory name.
+
+    Returns:
+        str: Lowercased "name (year)" prefix with collapsed whitespace, or None if the name has no year.
+    """
+    match = MATCH_KEY_PATTERN.match(name)
+    if not match:
+        return None
+    return " ".join(match.group(1).lower().split())
+
+
+def poster_match_keys(name, kind):
+    """
+    Return every key a file or directory name can be paired by: its ID tags, then its
+    "Name (Year)" prefix without the tags.
+
+    Args:
+        name (str): File or directory name.
+        kind (str): "movies" or "series". ID tag keys are qualified by it.
+
+    Returns:
+        list: Keys such as "movies:tmdb-27205" and "inception (2010)", possibly empty.
+    """
+    keys = [f"{kind}:{key}" for key in id_tag_keys(parse_id_tags(name))]
+    key = poster_match_key(strip_id_tags(name))
+    if key:
+        keys.append(key)
+    return keys
+
 
-def movies_poster_move(sorted_dir, unsorted_dir):
+def index_unsorted_images(unsorted_dir, manifest=None):
+    """
+    Walk the unsorted directory once and group image files by their ID tags and "Name (Year)" prefix.
+
+    Args:
+        unsorted_dir (str): Path to the unsorted directory.
+        manifest (ScanManifest, optional): Scan to read the unsorted files from instead of walking.
+
+    Returns:
+        dict: Mapping of match key to a list of image paths, in walk order. A tagged image is
+            listed under each of its keys, for the kind of its drop folder, or for both kinds
+            when it lies outside the drop folders.
+    """
+    if manifest:
+        image_paths = [entry.path for entry in manifest.files(under=unsorted_dir, extensions=IMAGE_EXTENSIONS)]
+    else:
+        image_paths = [
+            os.path.join(root, file_name)
+            for root, _, files in os.walk(unsorted_dir)
+            for file_name in files
+            if os.path.splitext(file_name)[1].lower() in IMAGE_EXTENSIONS
+        ]
+
+    index = defaultdict(list)
+    for image_path in image_paths:
+        drop_folder = os.path.relpath(image_path, unsorted_dir).split(os.sep, 1)[0]
+        kinds = (drop_folder,) if drop_folder in MEDIA_KINDS else MEDIA_KINDS
+        name = os.path.basename(image_path)
+        # The "Name (Year)" key is the same for both kinds and is only listed once
+        for key in dict.fromkeys(key for kind in kinds for key in poster_match_keys(name, kind)):
+            index[key].append(Path(image_path))
+    return index
+
+
+def matching_images(dir_name, unsorted_images, moved, kind):
+    """
+    Return the unsorted images that belong in a sorted directory, ID tag matches first.
+
+    Images whose ID tags contradict the directory's tags are left out, even when the names match.
+
+    Args:
+        dir_name (str): Name of the sorted directory.
+        unsorted_images (dict): Index built by index_unsorted_images.
+        moved (set): Images already moved elsewhere.
+        kind (str): "movies" or "series", the kind of the sorted directory.
+
+    Returns:
+        list: Paths of the matching images.
+    """
+    dir_tags = parse_id_tags(dir_name)
+    candidates = []
+    for key in poster_match_keys(dir_name, kind):
+        for img_path in unsorted_images.get(key, ()):
+            if img_path in moved or img_path in candidates:
+                continue
+            if dir_tags and tags_conflict(dir_tags, parse_id_tags(img_path.name)):
+                continue
+            candidates.append(img_path)
+    return candidates
+
+
+def sorted_directories(parent_dir, manifest=None):
+    """
+    List the subdirectories of a sorted directory.
+
+    Args:
+        parent_dir (str): Path to the sorted movies or series directory.
+        manifest (ScanManifest, optional): Scan to read the listing from instead of the filesystem.
+
+    Returns:
+        list: Paths of the subdirectories, in directory order.
+    """
+    if manifest and manifest.ensure_listed(parent_dir):
+        return [Path(dir_path) for dir_path in manifest.subdirectories(parent_dir)]
+    with os.scandir(parent_dir) as entries:
+        return [Path(entry.path) for entry in entries if entry.is_dir()]
+
+
+class PosterPlacer:
+    """
+    Moves the unsorted images that belong in sorted movie or series directories, one directory at a time.
+
+    The unsorted directory is indexed once, and every directory is placed at most once, so a
+    directory can be placed as soon as it is resolved and skipped by the sweep over the
+    sorted tree that follows.
+
+    Args:
+        unsorted_dir (str): Path to the unsorted directory.
+        manifest (ScanManifest, optional): Scan of the unsorted and sorted trees, updated as files move.
+        plan (Plan, optional): Record the moves in this plan instead of performing them. Requires a manifest.
+        rules (RenameRules): Rename rules, deciding which slot each image fills.
+        kind (str): "movies" or "series", the kind of directories placed.
+        sibling (PosterPlacer, optional): Placer over the same unsorted directory for the other
+            kind of directory. Its index and its record of moved images are shared, so an image
+            is never placed twice.
+    """
+
+    def __init__(self, unsorted_dir, manifest=None, plan=None, rules=None, kind="movies", sibling=None):
+        self.manifest = manifest
+        self.kind = kind
+        self.plan = plan
+        self.slot_of = rule_slot(rules)
+        self.affected_dirs = set()
+        if sibling:
+            self.unsorted_images = sibling.unsorted_images
+            self.inspector = sibling.inspector
+            self.moved = sibling.moved
+            self.visited = sibling.visited
+            return
+        # Walk the unsorted directory once and index images by ID tag and "Name (Year)"
+        self.unsorted_images = index_unsorted_images(unsorted_dir, manifest)
+        self.inspector = ImageInspector(manifest)
+        self.moved = set()
+        self.visited = set()
+
+    def place(self, dir_path):
+        """
+        Move the best image for each slot of a directory into it, unless it was placed before.
+
+        Args:
+            dir_path (str): Path to the sorted directory.
+
+        Returns:
+            bool: True if the directory received a poster.
+        """
+        dir_path = Path(dir_path)
+        if str(dir_path) in self.visited:
+            return False
+        self.visited.add(str(dir_path))
+        candidates = matching_images(dir_path.name, self.unsorted_images, self.moved, self.kind)
+        if not candidates:
+            return False
+
+        manifest = self.manifest
+        selected, dropped = select_images(str(dir_path), candidates, self.slot_of, manifest, self.plan, self.inspector)
+        self.moved.update(dropped)
+        placed = False
+        for img_path in selected:
+            target_path = dir_path / img_path.name
+            if manifest.exists(target_path) if manifest else target_path.exists():
+                # File already exists, skip
+                continue
+            # Move the image file to the corresponding directory
+            move_file(img_path, target_path, self.plan, manifest)
+            if manifest:
+                manifest.move_file(img_path, target_path)
+            self.moved.add(img_path)
+            placed = True
+        if placed:
+            self.affected_dirs.add(str(dir_path))
+        return placed
+
+
+def movies_poster_move(sorted_dir, unsorted_dir, manifest=None, plan=None, rules=None, scheduler=None, placer=None):
     """
     Organize movie posters.
 
     Args:
         sorted_dir (str): Path to the sorted directory for movies.
         unsorted_dir (str): Path to the unsorted movies directory.
+        manifest (ScanManifest, optional): Scan of the unsorted and sorted trees, updated as files move.
+        plan (Plan, optional): Record the moves in this plan instead of performing them. Requires a manifest.
+        rules (RenameRules, optional): Movie rename rules, deciding which slot each image fills.
+        scheduler (PriorityScheduler, optional): Visits the directories by priority and skips
+            the titles outside the budget of the run.
+        placer (PosterPlacer, optional): Placer that already placed the directories resolved
+            during this run. They are skipped.
+
+    Returns:
+        set: Directories that received a poster.
     """
     movies_dir = os.path.join(sorted_dir, "movies")
+    placer = placer or PosterPlacer(unsorted_dir, manifest, plan, rules or load_rename_rules(None, "movies"), "movies")
+
+    # Loop through each directory in the sorted movies directory, most-watched titles first so
+    # their moves are applied first
+    directories = sorted_directories(movies_dir, manifest)
+    if scheduler:
+        directories = scheduler.order(directories, lambda dir_path: dir_path.name)
+    for dir_path in directories:
+        # Move only the best image for each slot of the directory
+        placer.place(dir_path)
 
-    # Loop through each directory in the sorted movies directory
-    for dir_path in Path(movies_dir).iterdir():
-        if dir_path.is_dir():
-            dir_name = dir_path.name
-            # Extract the first portion of the directory name up to the last ')'
-            match_name = dir_name.rsplit(")", 1)[0] + ")"
-
-            # Flag to ensure only one image is moved per directory
-            image_moved = False
-
-            # Search for image files in the unsorted directory and its subdirectories
-            for img_path in Path(unsorted_dir).rglob("*"):
-                if img_path.is_file() and img_path.suffix.lower() in [".jpg", ".jpeg", ".png", ".gif", ".bmp"]:
-                    # Check if the image filename matches the extracted portion of the directory name
-                    if match_name.lower() in img_path.name.lower():
-                        target_path = dir_path / img_path.name
-                        if target_path.exists():
-                            # File already exists, skip
-                            continue
-                        # Move the image file to the corresponding directory
-                        shutil.move(str(img_path), str(target_path))
-                        image_moved = True
-                        break  # Stop processing further images for this directory
-
-            # If no matching image was found, continue to the next directory
-            if not image_moved:
-                pass
-
-def series_poster_move(sorted_dir, unsorted_dir):
+    return placer.affected_dirs
+
+def series_poster_move(sorted_dir, unsorted_dir, manifest=None, plan=None, rules=None, scheduler=None, placer=None):
     """
     Organize series posters.
 
     Args:
         sorted_dir (str): Path to the sorted directory for series.
         unsorted_dir (str): Path to the unsorted series directory.
+        manifest (ScanManifest, optional): Scan of the unsorted and sorted trees, updated as files move.
+        plan (Plan, optional): Record the moves in this plan instead of performing them. Requires a manifest.
+        rules (RenameRules, optional): Series rename rules, deciding which slot each image fills.
+        scheduler (PriorityScheduler, optional): Visits the directories by priority and skips
+            the titles outside the budget of the run.
+        placer (PosterPlacer, optional): Placer that already placed the directories resolved
+            during this run. They are skipped.
+
+    Returns:
+        set: Directories that received a poster.
     """
     series_dir = os.path.join(sorted_dir, "series")
+    placer = placer or PosterPlacer(unsorted_dir, manifest, plan, rules or load_rename_rules(None, "series"), "series")
+
+    # Loop through each directory in the sorted series directory, most-watched titles first so
+    # their moves are applied first
+    directories = sorted_directories(series_dir, manifest)
+    if scheduler:
+        directories = scheduler.order(directories, lambda dir_path: dir_path.name)
+    for dir_path in directories:
+        # Move the best image for each slot (poster, seasons, specials) into the series directory
+        placer.place(dir_path)
 
-    # Loop through each directory in the sorted series directory
-    for dir_path in Path(series_dir).iterdir():
-        if dir_path.is_dir():
-            dir_name = dir_path.name
-            # Extract the first portion of the directory name up to the last ')'
-            match_name = dir_name.rsplit(")", 1)[0] + ")"
-
-            # Search for image files in the unsorted directory and its subdirectories
-            for img_path in Path(unsorted_dir).rglob("*"):
-                if img_path.is_file() and img_path.suffix.lower() in [".jpg", ".jpeg", ".png", ".gif", ".bmp"]:
-                    # Check if the image filename matches the extracted portion of the directory name
-                    if match_name.lower() in img_path.name.lower():
-                        target_path = dir_path / img_path.name
-                        if target_path.exists():
-                            # File already exists, skip
-                            continue
-                        # Move the image file to the corresponding directory
-                        shutil.move(str(img_path), str(target_path))
-                        
-def delete_empty_directories(unsorted_dir):
+    return placer.affected_dirs
+
+def delete_empty_directories(unsorted_dir, manifest=None, keep=(), plan=None):
     """
     Recursively delete all empty directories in the given directory.
 
     Args:
         unsorted_dir (str): Path to the directory to clean up.
+        manifest (ScanManifest, optional): Scan of the directory. Empty directories are then removed
+            bottom-up in one pass without walking the filesystem.
+        keep (iterable): Directories that are never deleted, even when empty.
+        plan (Plan, optional): Record the deletions in this plan instead of performing them. Requires a manifest.
     """
+    if manifest and manifest.ensure_listed(unsorted_dir):
+        manifest.delete_empty_directories(unsorted_dir, keep, plan)
+        return
+
+    keep = {Path(dir_path) for dir_path in keep}
     for dir_path in Path(unsorted_dir).rglob("*"):
+        if dir_path in keep:
+            continue
         if dir_path.is_dir() and not any(dir_path.iterdir()):  # Check if the directory is empty
             try:
                 dir_path.rmdir()  # Remove the empty directory
@@ -0,0 +1,148 @@
+import os
+import time
+import sqlite3
+import hashlib
+import metrics
+
+# Size of the blocks read when hashing file contents
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_hash(path, manifest=None):
+    """
+    Compute the SHA-256 digest of a file, reading it in blocks.
+
+    Args:
+        path (str): Path to the file.
+        manifest (ScanManifest, optional): Scan to open the file through, so archive members can be hashed.
+
+    Returns:
+        str: Hex digest of the file contents.
+    """
+    digest = hashlib.sha256()
+    with manifest.open(path) if manifest else open(path, "rb") as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ProcessedJournal:
+    """
+    SQLite-backed journal of unsorted poster files that were already resolved.
+
+    Files are identified by path, size and modification time. With use_hash enabled a
+    content hash is stored as well, so a file whose timestamp changed but whose contents
+    did not is still recognized as processed. A read-only journal answers lookups but
+    records nothing, for dry runs.
+    """
+
+    def __init__(self, db_path, use_hash=False, read_only=False):
+        self.use_hash = use_hash
+        self.read_only = read_only
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS processed (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                hash TEXT,
+                target TEXT,
+                processed REAL NOT NULL
+            )
+            """
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def stat(path, manifest=None):
+        """
+        Return (size, mtime) of a file, from the manifest when it holds them.
+        """
+        if manifest:
+            return manifest.stat(path)
+        metrics.record_stat()
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def processed_target(self, path, manifest=None):
+        """
+        Return the target recorded for an unchanged file, or None if the file is new or changed.
+
+        Args:
+            path (str): Path to the unsorted file.
+            manifest (ScanManifest, optional): Scan holding the size and modification time of the file.
+
+        Returns:
+            str: Sorted directory the file was resolved to, or None.
+        """
+        row = self.connection.execute(
+            "SELECT size, mtime, hash, target FROM processed WHERE path = ?", (str(path),)
+        ).fetchone()
+        if row is None:
+            return None
+
+        size, mtime, stored_hash, target = row
+        current_size, current_mtime = self.stat(path, manifest)
+        if current_size != size:
+            return None
+        if current_mtime != mtime:
+            # A touched file only counts as unchanged when its contents match
+            if not (self.use_hash and stored_hash and file_hash(path, manifest) == stored_hash):
+                return None
+        return target
+
+    def record(self, path, target, manifest=None):
+        """
+        Record that a file was resolved to a sorted directory.
+        """
+        if self.read_only:
+            return
+        # A file already placed by an earlier directory of the run has nothing left to skip
+        if manifest and manifest.get(path) is None:
+            return
+        size, mtime = self.stat(path, manifest)
+        content_hash = file_hash(path, manifest) if self.use_hash else None
+        self.connection.execute(
+            "INSERT OR REPLACE INTO processed (path, size, mtime, hash, target, processed) VALUES (?, ?, ?, ?, ?, ?)",
+            (str(path), size, mtime, content_hash, str(target), time.time()),
+        )
+        self.connection.commit()
+
+    def prune(self, existing_paths):
+        """
+        Forget files that no longer exist, for example because they were moved into the sorted tree.
+
+        Args:
+            existing_paths (iterable): Paths of the files that are still present.
+        """
+        if self.read_only:
+            return
+        existing_paths = {str(path) for path in existing_paths}
+        stale = [
+            (path,) for (path,) in self.connection.execute("SELECT path FROM processed")
+            if path not in existing_paths
+        ]
+        self.connection.executemany("DELETE FROM processed WHERE path = ?", stale)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def open_processed_journal(db_path, use_hash=False, read_only=False):
+    """
+    Open the processed-file journal, creating its parent directory if needed.
+
+    Args:
+        db_path (str): Path to the SQLite database, or None to disable the journal.
+        use_hash (bool): Whether to store and compare content hashes.
+        read_only (bool): Look up files without recording anything.
+
+    Returns:
+        ProcessedJournal: The opened journal, or None if it is disabled.
+    """
+    if not db_path:
+        return None
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    return ProcessedJournal(db_path, use_hash=use_hash, read_only=read_only)
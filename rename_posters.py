@@ -1,82 +1,115 @@
 import os
 from pathlib import Path
+from plan import rename_path
+from rename_rules import load_rename_rules
 
-def rename_movie_posters(sorted_dir):
+
+def list_directories(parent_dir, manifest=None, only_dirs=None):
+    """
+    List the subdirectories of a sorted directory.
+
+    Args:
+        parent_dir (str): Path to the sorted movies or series directory.
+        manifest (ScanManifest, optional): Scan to read the listing from instead of the filesystem.
+        only_dirs (iterable, optional): Directories to restrict the listing to. Those outside
+            parent_dir are ignored.
+
+    Returns:
+        list: Paths of the subdirectories.
+    """
+    if only_dirs is not None:
+        parent_dir = os.path.normpath(parent_dir)
+        return sorted(Path(dir_path) for dir_path in only_dirs if os.path.dirname(os.path.normpath(dir_path)) == parent_dir)
+    if manifest and manifest.ensure_listed(parent_dir):
+        return [Path(dir_path) for dir_path in manifest.subdirectories(parent_dir)]
+    return [dir_path for dir_path in Path(parent_dir).iterdir() if dir_path.is_dir()]
+
+
+def list_files(dir_path, manifest=None):
+    """
+    List the files of a sorted movie or series directory.
+
+    Args:
+        dir_path (Path): Path to the directory.
+        manifest (ScanManifest, optional): Scan to read the listing from instead of the filesystem.
+
+    Returns:
+        list: Paths of the files.
+    """
+    if manifest and manifest.ensure_listed(dir_path):
+        return [Path(entry.path) for entry in manifest.listdir(dir_path)]
+    return list(dir_path.iterdir())
+
+
+def rename_file(file, new_file, manifest=None, plan=None):
+    """
+    Rename a file unless the target already exists.
+
+    Args:
+        file (Path): File to rename.
+        new_file (Path): New path of the file.
+        manifest (ScanManifest, optional): Scan to check the target against and update.
+        plan (Plan, optional): Record the rename in this plan instead of performing it.
+    """
+    if manifest.exists(new_file) if manifest else new_file.exists():  # Avoid overwriting existing files
+        return
+    rename_path(file, new_file, plan)
+    if manifest:
+        manifest.move_file(file, new_file)
+    print(f"{'Planned rename of' if plan is not None else 'Renamed'} {file} to {new_file}")
+
+def rename_directory_files(dir_path, rules, manifest=None, plan=None):
+    """
+    Rename the images of one sorted directory in a single pass over its files.
+
+    Args:
+        dir_path (Path): Path to the movie or series directory.
+        rules (RenameRules): Compiled rename rules for the directory.
+        manifest (ScanManifest, optional): Scan to read the listing from and update.
+        plan (Plan, optional): Record the renames in this plan instead of performing them.
+    """
+    for file in list_files(dir_path, manifest):
+        matched = rules.match(file.name)
+        if matched and matched[1] != file.name:
+            rename_file(file, dir_path / matched[1], manifest, plan)
+
+
+def rename_movie_posters(sorted_dir, manifest=None, only_dirs=None, plan=None, rules=None):
     """
     Rename movie posters in the sorted directory.
 
     Args:
         sorted_dir (str): Path to the sorted directory for movies.
+        manifest (ScanManifest, optional): Scan of the sorted tree, used instead of listing directories.
+        only_dirs (iterable, optional): Restrict renaming to these movie directories.
+        plan (Plan, optional): Record the renames in this plan instead of performing them. Requires a manifest.
+        rules (RenameRules, optional): Rename rules. Defaults to renaming images to "poster".
     """
     movies_dir = os.path.join(sorted_dir, "movies")
-    if not os.path.isdir(movies_dir):
+    if not (manifest.exists(movies_dir) if manifest else os.path.isdir(movies_dir)):
         raise ValueError(f"Movies directory does not exist: {movies_dir}")
 
-    # Iterate through each movie directory
-    for dir_path in Path(movies_dir).iterdir():
-        if dir_path.is_dir():
-            for file in dir_path.iterdir():
-                # Check if the file is an image
-                if file.suffix.lower() in [".jpg", ".jpeg", ".png"]:
-                    # Rename the file to "poster.<extension>"
-                    new_file = dir_path / f"poster{file.suffix}"
-                    if not new_file.exists():  # Avoid overwriting existing files
-                        file.rename(new_file)
-                        print(f"Renamed {file} to {new_file}")
+    rules = rules or load_rename_rules(None, "movies")
+    for dir_path in list_directories(movies_dir, manifest, only_dirs):
+        rename_directory_files(dir_path, rules, manifest, plan)
 
 
-def rename_series_season_specials_posters(sorted_dir):
+def rename_series_season_specials_posters(sorted_dir, manifest=None, only_dirs=None, plan=None, rules=None):
     """
     Rename series posters for seasons and specials.
 
     Args:
         sorted_dir (str): Path to the sorted directory for series.
+        manifest (ScanManifest, optional): Scan of the sorted tree, used instead of listing directories.
+        only_dirs (iterable, optional): Restrict renaming to these series directories.
+        plan (Plan, optional): Record the renames in this plan instead of performing them. Requires a manifest.
+        rules (RenameRules, optional): Rename rules. Defaults to SeasonNN, Season00 for specials,
+            title cards, backgrounds and "poster".
     """
     series_dir = os.path.join(sorted_dir, "series")
-    if not os.path.isdir(series_dir):
+    if not (manifest.exists(series_dir) if manifest else os.path.isdir(series_dir)):
         raise ValueError(f"Series directory does not exist: {series_dir}")
 
-    # Loop through each series directory
-    for dir_path in Path(series_dir).iterdir():
-        if dir_path.is_dir():
-            # Handle renaming for seasons and specials
-            for file in dir_path.iterdir():
-                if file.suffix.lower() in [".jpg", ".jpeg", ".png", ".gif", ".bmp"]:
-                    file_name = file.name
-                    file_extension = file.suffix
-
-                    # Rename files for "Season #" (1-9)
-                    if "Season " in file_name:
-                        if any(f"Season {i}" in file_name for i in range(1, 10)):
-                            season_number = file_name.split("Season ")[1].split()[0]
-                            new_file_name = f"Season0{season_number}{file_extension}"
-                            new_file_path = dir_path / new_file_name
-                            if not new_file_path.exists():  # Avoid overwriting existing files
-                                file.rename(new_file_path)
-                                print(f"Renamed {file} to {new_file_path}")
-
-                    # Rename files for "Season ##" (10 or greater)
-                    elif any(f"Season {i}" in file_name for i in range(10, 100)):
-                        season_number = file_name.split("Season ")[1].split()[0]
-                        new_file_name = f"Season{season_number}{file_extension}"
-                        new_file_path = dir_path / new_file_name
-                        if not new_file_path.exists():  # Avoid overwriting existing files
-                            file.rename(new_file_path)
-                            print(f"Renamed {file} to {new_file_path}")
-
-                    # Rename files containing "Specials"
-                    elif "Specials" in file_name:
-                        new_file_name = f"Season00{file_extension}"
-                        new_file_path = dir_path / new_file_name
-                        if not new_file_path.exists():  # Avoid overwriting existing files
-                            file.rename(new_file_path)
-                            print(f"Renamed {file} to {new_file_path}")
-
-            # Handle renaming of non-season and non-specials posters
-            for file in dir_path.iterdir():
-                if file.suffix.lower() in [".jpg", ".jpeg", ".png", ".gif", ".bmp"] and "Season" not in file.name and "Specials" not in file.name:
-                    new_file_name = f"poster{file.suffix}"
-                    new_file_path = dir_path / new_file_name
-                    if not new_file_path.exists():  # Avoid overwriting existing files
-                        file.rename(new_file_path)
-                        print(f"Renamed {file} to {new_file_path}")
\ No newline at end of file
+    rules = rules or load_rename_rules(None, "series")
+    for dir_path in list_directories(series_dir, manifest, only_dirs):
+        rename_directory_files(dir_path, rules, manifest, plan)
\ No newline at end of file
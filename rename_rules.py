@@ -0,0 +1,139 @@
+import os
+import re
+import string
+
+# Default rules for series directories, tried in order. Targets are str.format templates
+# filled with the named groups of the pattern; digit-only groups are passed as integers.
+DEFAULT_SERIES_RULES = (
+    {"name": "title_card", "pattern": r".*\bS(?P<season>\d{1,4})E(?P<episode>\d{1,4})\b.*", "target": "S{season:02d}E{episode:02d}"},
+    {"name": "season", "pattern": r".*\bSeason\s*(?P<season>\d{1,4})\b.*", "target": "Season{season:02d}"},
+    {"name": "specials", "pattern": r".*\bSpecials\b.*", "target": "Season00"},
+    {"name": "background", "pattern": r".*\b(?:background|backdrop|fanart)\b.*", "target": "background"},
+    {"name": "poster", "pattern": r".*", "target": "poster"},
+)
+
+# Default rules for movie directories
+DEFAULT_MOVIE_RULES = (
+    {"name": "background", "pattern": r".*\b(?:background|backdrop|fanart)\b.*", "target": "background"},
+    {"name": "poster", "pattern": r".*", "target": "poster"},
+)
+
+# Image extensions renamed in each kind of directory
+SERIES_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp")
+MOVIE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# Named groups in a rule pattern, renamed so every rule can use the same group names
+GROUP_PATTERN = re.compile(r"\(\?P<(\w+)>")
+
+
+class RenameRules:
+    """
+    Table of rename rules compiled into a single regular expression.
+
+    Each rule is a dict with a "pattern" matched against the whole file name without its
+    extension, and a "target" template for the new name. Rules are tried in order and the
+    first one that matches wins, so a file name is classified with one regex match.
+
+    Args:
+        rules (iterable): Rule dicts with "name", "pattern" and "target".
+        extensions (iterable): Lowercase extensions of the files to rename.
+
+    Raises:
+        ValueError: If a rule is missing a field, its pattern does not compile, or its target
+            names a group the pattern lacks or has an invalid format spec.
+    """
+
+    def __init__(self, rules, extensions):
+        self.rules = []
+        self.extensions = tuple(extensions)
+        alternatives = []
+        for index, rule in enumerate(rules):
+            if "pattern" not in rule or "target" not in rule:
+                raise ValueError(f"Rename rule {rule.get('name', index)} needs a pattern and a target.")
+            check_target(rule, index)
+            prefix = f"r{index}_"
+            pattern = GROUP_PATTERN.sub(lambda match: f"(?P<{prefix}{match.group(1)}>", rule["pattern"])
+            alternatives.append(f"(?P<r{index}>{pattern})")
+            self.rules.append((prefix, rule))
+        try:
+            self.regex = re.compile("|".join(alternatives), re.IGNORECASE)
+        except re.error as e:
+            raise ValueError(f"Invalid rename rule pattern: {e}")
+
+    def match(self, file_name):
+        """
+        Find the rule matching a file name.
+
+        Args:
+            file_name (str): Name of the file, with its extension.
+
+        Returns:
+            tuple: (rule name, new file name), or None if the file is not an image or no rule matches.
+        """
+        stem, extension = os.path.splitext(file_name)
+        if extension.lower() not in self.extensions:
+            return None
+        match = self.regex.fullmatch(stem)
+        if not match:
+            return None
+
+        # The rule's own group closes last, so it is reported as the last group
+        prefix, rule = self.rules[int(match.lastgroup[1:])]
+        values = {
+            name[len(prefix):]: int(value) if value.isdigit() else value
+            for name, value in match.groupdict().items()
+            if value is not None and name.startswith(prefix)
+        }
+        return rule.get("name"), rule["target"].format(**values) + extension
+
+
+def check_target(rule, index):
+    """
+    Check that the target template of a rule can be filled from the groups of its pattern, so
+    a bad rule is rejected on load instead of failing halfway through renaming.
+
+    Raises:
+        ValueError: If the pattern does not compile, or the target names a field the pattern
+            does not define or has an invalid format spec.
+    """
+    name = rule.get("name", index)
+    try:
+        groups = re.compile(rule["pattern"]).groupindex
+    except re.error as e:
+        raise ValueError(f"Invalid rename rule pattern: {e}")
+    try:
+        fields = [field for _, field, _, _ in string.Formatter().parse(rule["target"]) if field is not None]
+    except ValueError as e:
+        raise ValueError(f"Invalid rename rule target in rule {name}: {e}")
+    for field in fields:
+        group = re.split(r"[.\[]", field, maxsplit=1)[0]
+        if group not in groups:
+            raise ValueError(f"Invalid rename rule target in rule {name}: "
+                             f"{{{field}}} is not a named group of the pattern.")
+    # Groups are filled with integers when they hold digits, which every numeric format spec accepts
+    try:
+        rule["target"].format(**{group: 1 for group in groups})
+    except (ValueError, TypeError, IndexError, KeyError, AttributeError) as e:
+        raise ValueError(f"Invalid rename rule target in rule {name}: {e}")
+
+
+def load_rename_rules(config, kind):
+    """
+    Build the rename rules of a kind of directory from the "rename_rules" configuration section.
+
+    Args:
+        config (dict): Parsed configuration dictionary.
+        kind (str): "movies" or "series".
+
+    Returns:
+        RenameRules: The compiled rules.
+
+    Raises:
+        ValueError: If a configured rule is invalid.
+    """
+    if kind == "series":
+        defaults, extensions = DEFAULT_SERIES_RULES, SERIES_EXTENSIONS
+    else:
+        defaults, extensions = DEFAULT_MOVIE_RULES, MOVIE_EXTENSIONS
+    rules = (config or {}).get("rename_rules", {}).get(kind) or defaults
+    return RenameRules(rules, extensions)
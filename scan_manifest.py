@@ -0,0 +1,412 @@
+import os
+import re
+from collections import namedtuple
+import metrics
+from archives import ArchiveCache, is_archive, list_archive
+
+# A file recorded in the manifest
+ManifestEntry = namedtuple("ManifestEntry", ["path", "name", "extension", "size", "mtime", "category"])
+
+# Matches season posters such as "Show (2001) - Season 2"
+SEASON_PATTERN = re.compile(r"Season \d+")
+
+# Categories of the files the series step groups into series
+SERIES_CATEGORIES = ("series", "season", "specials")
+
+
+def classify_poster(path):
+    """
+    Classify a poster file from its name and the drop folder it lies in.
+
+    Collection posters are told apart by name wherever they are, as the collection step picks
+    them. Other files take the kind of the innermost "movies" or "series" folder above them.
+
+    Args:
+        path (str): Path to the file.
+
+    Returns:
+        str: One of "collection", "movie", "series", "season", "specials" or "other".
+    """
+    name = os.path.basename(path)
+    if "collection" in name.lower():
+        return "collection"
+    parts = [part.lower() for part in os.path.normpath(path).split(os.sep)[:-1]]
+    kind = next((part for part in reversed(parts) if part in ("movies", "series")), None)
+    if kind == "movies":
+        return "movie"
+    if kind == "series":
+        if SEASON_PATTERN.search(name):
+            return "season"
+        if "Specials" in name:
+            return "specials"
+        return "series"
+    return "other"
+
+
+class ScanManifest:
+    """
+    In-memory manifest of one or more directory trees, built with a single os.scandir pass.
+
+    Pipeline steps read file listings from the manifest instead of walking the filesystem
+    again, and report every move, rename and directory creation back to it so the manifest
+    stays accurate for the steps that follow. Directories outside the scanned trees are
+    listed on first use, one os.scandir call each.
+
+    Poster-set archives can be listed as virtual directories: their members are recorded
+    like files at "<archive>/<member>" from the archive's member list, and read straight
+    from the archive through open().
+
+    Directory entries are told apart by the file type scandir reports, without a stat. With
+    stat_files disabled, for network filesystems where every stat is a round trip, files are
+    recorded without their size and modification time; stat() reads them on first use only.
+    """
+
+    def __init__(self, stat_files=True):
+        self.stat_files = stat_files
+        self.directories = {}  # Directory path -> {subdirectory path: None}, in scan order
+        self.entries = {}  # Directory path -> {file name: ManifestEntry}, in scan order
+        self.listed = set()  # Directories whose complete listing is known
+        self.archives = {}  # Virtual directory -> archive path
+        self.members = {}  # Virtual file path -> (archive path, member name)
+        self.archive_cache = ArchiveCache()
+
+    def scan(self, root, expand_archives=False):
+        """
+        Walk a directory tree once and record every directory and file in it.
+
+        Args:
+            root (str): Path to the tree to scan.
+            expand_archives (bool): List the members of the archives found instead of the archive files.
+        """
+        root = os.path.normpath(str(root))
+        stack = [root]
+        scanned = 0
+        stat_calls = 0
+        while stack:
+            dir_path = stack.pop()
+            subdirectories = []
+            archives = []
+            try:
+                entries = os.scandir(dir_path)
+            except (FileNotFoundError, NotADirectoryError):
+                # Only a missing root is expected; it is simply not recorded
+                continue
+            if dir_path == root:
+                self._track(root)
+            with entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        subdirectories.append(entry.path)
+                    elif entry.is_file():
+                        size = mtime = None
+                        if self.stat_files:
+                            stat = entry.stat()
+                            size, mtime = stat.st_size, stat.st_mtime_ns
+                            stat_calls += 1
+                        if expand_archives and is_archive(entry.name):
+                            archives.append((entry.path, size, mtime))
+                        else:
+                            self._record(entry.path, size, mtime)
+                        scanned += 1
+            self.listed.add(dir_path)
+            for subdirectory in subdirectories:
+                self._track(subdirectory)
+            for archive_path, size, mtime in archives:
+                # Unreadable archives, such as downloads still in progress, are kept as plain files
+                if self.add_archive(archive_path) is None:
+                    self._record(archive_path, size, mtime)
+            # Visit subdirectories in listing order, like os.walk
+            stack.extend(reversed(subdirectories))
+        metrics.record_files_scanned(scanned)
+        metrics.record_stat(stat_calls)
+
+    def _record(self, path, size, mtime=None):
+        dir_path, name = os.path.split(path)
+        extension = os.path.splitext(name)[1].lower()
+        self.entries.setdefault(dir_path, {})[name] = ManifestEntry(
+            path=path, name=name, extension=extension, size=size, mtime=mtime, category=classify_poster(path)
+        )
+
+    def add_archive(self, archive_path, root=None):
+        """
+        Record the members of an archive as files under a virtual directory, without extracting them.
+
+        Args:
+            archive_path (str): Path to the archive.
+            root (str, optional): Virtual directory to list the members under. Defaults to the
+                archive path, so an archive reads like a subdirectory of the folder holding it.
+                The parent of the virtual directory must already be tracked.
+
+        Returns:
+            int: Number of members recorded, or None if the archive could not be read.
+        """
+        archive_path = os.path.normpath(str(archive_path))
+        root = os.path.normpath(str(root or archive_path))
+        if root in self.directories:
+            print(f"Skipping archive {archive_path}: {root} is already a directory.")
+            return None
+        try:
+            members = list_archive(archive_path)
+        except OSError as e:
+            print(f"Skipping archive: {e}")
+            return None
+
+        self.archives[root] = archive_path
+        self._track(root)
+        self.listed.add(root)
+        for member, parts, size, mtime in members:
+            path = os.path.join(root, *parts)
+            missing = []
+            dir_path = os.path.dirname(path)
+            while dir_path not in self.directories:
+                missing.append(dir_path)
+                dir_path = os.path.dirname(dir_path)
+            for dir_path in reversed(missing):
+                self._track(dir_path)
+                self.listed.add(dir_path)
+            self._record(path, size, mtime)
+            self.members[path] = (archive_path, member)
+        metrics.record_files_scanned(len(members))
+        return len(members)
+
+    def member(self, path):
+        """
+        Return (archive path, member name) of a file read from an archive, or None for a regular file.
+        """
+        return self.members.get(os.path.normpath(str(path)))
+
+    def open(self, path):
+        """
+        Open a recorded file for reading in binary mode, from its archive if it has one.
+        """
+        member = self.member(path)
+        if member:
+            return self.archive_cache.open_member(*member)
+        return open(path, "rb")
+
+    def is_virtual(self, dir_path):
+        """
+        Check whether a directory only exists inside an archive.
+        """
+        dir_path = os.path.normpath(str(dir_path))
+        return any(dir_path == root or dir_path.startswith(root + os.sep) for root in self.archives)
+
+    def consumed_archives(self, under=None):
+        """
+        Return the archives whose members have all been moved or dropped.
+
+        Args:
+            under (str, optional): Only return archives stored inside this directory tree.
+
+        Returns:
+            list: Paths of the archives.
+        """
+        prefix = os.path.normpath(str(under)) + os.sep if under is not None else ""
+        return [
+            archive_path for root, archive_path in self.archives.items()
+            if archive_path.startswith(prefix) and not self.files(under=root)
+        ]
+
+    def close(self):
+        """
+        Close the archives opened to read members.
+        """
+        self.archive_cache.close()
+
+    def get(self, path):
+        """
+        Return the record of a file, or None if it is not tracked.
+        """
+        dir_path, name = os.path.split(os.path.normpath(str(path)))
+        return self.entries.get(dir_path, {}).get(name)
+
+    def stat(self, path):
+        """
+        Return (size, mtime in ns) of a file, reading them from disk on first use only.
+        """
+        path = os.path.normpath(str(path))
+        entry = self.get(path)
+        if entry and entry.size is not None and entry.mtime is not None:
+            return entry.size, entry.mtime
+        metrics.record_stat()
+        stat = os.stat(path)
+        if entry:
+            dir_path, name = os.path.split(path)
+            self.entries[dir_path][name] = entry._replace(size=stat.st_size, mtime=stat.st_mtime_ns)
+        return stat.st_size, stat.st_mtime_ns
+
+    def ensure_listed(self, dir_path):
+        """
+        Make sure the listing of a directory is known, reading it from disk if needed.
+
+        Only the directory itself is listed; its subdirectories are recorded but not entered.
+
+        Args:
+            dir_path (str): Path to the directory.
+
+        Returns:
+            bool: True if the listing is known, False if the directory does not exist.
+        """
+        dir_path = os.path.normpath(str(dir_path))
+        if dir_path in self.listed:
+            return True
+        # Listing a missing directory fails, so no separate existence check is needed
+        try:
+            entries = os.scandir(dir_path)
+        except (FileNotFoundError, NotADirectoryError):
+            return False
+
+        self._track(dir_path)
+        scanned = 0
+        with entries:
+            for entry in entries:
+                if entry.is_dir():
+                    self._track(entry.path)
+                elif entry.is_file() and entry.name not in self.entries[dir_path]:
+                    self._record(entry.path, None)
+                    scanned += 1
+        metrics.record_files_scanned(scanned)
+        self.listed.add(dir_path)
+        return True
+
+    def _track(self, dir_path):
+        if dir_path in self.directories:
+            return
+        self.directories[dir_path] = {}
+        self.entries.setdefault(dir_path, {})
+        parent = os.path.dirname(dir_path)
+        if parent in self.directories:
+            self.directories[parent][dir_path] = None
+
+    def add_directory(self, dir_path):
+        """
+        Record a directory created by the pipeline. Directories whose parent cannot be listed are
+        ignored, so a partial listing is never mistaken for a complete one.
+        """
+        dir_path = os.path.normpath(str(dir_path))
+        if dir_path in self.directories or not self.ensure_listed(os.path.dirname(dir_path)):
+            return
+        # The parent listing is complete, so the directory is new and empty
+        self._track(dir_path)
+        self.listed.add(dir_path)
+
+    def subdirectories(self, dir_path):
+        """
+        Return the paths of the immediate subdirectories of a directory.
+        """
+        return list(self.directories.get(os.path.normpath(str(dir_path)), {}))
+
+    def listdir(self, dir_path):
+        """
+        Return the files directly inside a directory.
+        """
+        return list(self.entries.get(os.path.normpath(str(dir_path)), {}).values())
+
+    def files(self, under=None, extensions=None, category=None):
+        """
+        Return the recorded files, optionally filtered.
+
+        Args:
+            under (str, optional): Only return files inside this directory tree.
+            extensions (iterable, optional): Only return files with one of these lowercase extensions.
+            category (str or tuple, optional): Only return files of this category, or of one of
+                these categories.
+
+        Returns:
+            list: Matching ManifestEntry records, in scan order.
+        """
+        if isinstance(category, str):
+            category = (category,)
+        prefix = None
+        if under is not None:
+            under = os.path.normpath(str(under))
+            prefix = under + os.sep
+
+        matches = []
+        for dir_path, files in self.entries.items():
+            if prefix and dir_path != under and not dir_path.startswith(prefix):
+                continue
+            for entry in files.values():
+                if extensions is not None and entry.extension not in extensions:
+                    continue
+                if category is not None and entry.category not in category:
+                    continue
+                matches.append(entry)
+        return matches
+
+    def exists(self, path):
+        """
+        Check whether a file or directory exists, answering from the manifest when possible.
+        """
+        path = os.path.normpath(str(path))
+        if path in self.directories:
+            return True
+        dir_path, name = os.path.split(path)
+        if self.ensure_listed(dir_path):
+            return name in self.entries[dir_path]
+        # Nothing exists inside a missing directory
+        return False
+
+    def add_file(self, path, size=None, mtime=None):
+        """
+        Record a file created by the pipeline. Files outside the scanned trees are ignored.
+        """
+        path = os.path.normpath(str(path))
+        if os.path.dirname(path) in self.listed:
+            self._record(path, size, mtime)
+
+    def remove_file(self, path):
+        """
+        Forget a file that was moved away or deleted.
+
+        Returns:
+            ManifestEntry: The removed record, or None if the file was not tracked.
+        """
+        path = os.path.normpath(str(path))
+        self.members.pop(path, None)
+        dir_path, name = os.path.split(path)
+        return self.entries.get(dir_path, {}).pop(name, None)
+
+    def move_file(self, source, target):
+        """
+        Record that a file was moved or renamed.
+        """
+        entry = self.remove_file(source)
+        self.add_file(target, entry.size if entry else None, entry.mtime if entry else None)
+
+    def delete_empty_directories(self, root, keep=(), plan=None):
+        """
+        Delete every empty directory below root in one bottom-up pass over the manifest.
+
+        Args:
+            root (str): Path to the tree to clean up. The root itself is kept.
+            keep (iterable): Directories that are never deleted, even when empty.
+            plan (Plan, optional): Record the deletions in this plan instead of performing them.
+        """
+        root = os.path.normpath(str(root))
+        prefix = root + os.sep
+        keep = {os.path.normpath(str(dir_path)) for dir_path in keep}
+        # Directories inside archives are never deleted; consumed archives are removed after the run
+        candidates = [
+            dir_path for dir_path in self.listed
+            if dir_path.startswith(prefix) and dir_path not in keep and not self.is_virtual(dir_path)
+        ]
+
+        # Deepest directories first, so parents emptied by the pass are removed as well
+        for dir_path in sorted(candidates, key=lambda path: path.count(os.sep), reverse=True):
+            if self.entries.get(dir_path) or self.directories.get(dir_path):
+                continue
+            if plan is not None:
+                plan.rmdir(dir_path)
+            else:
+                try:
+                    os.rmdir(dir_path)
+                except OSError as e:
+                    print(f"Failed to delete directory {dir_path}: {e}")
+                    continue
+            self.listed.discard(dir_path)
+            del self.directories[dir_path]
+            self.entries.pop(dir_path, None)
+            parent = self.directories.get(os.path.dirname(dir_path))
+            if parent is not None:
+                parent.pop(dir_path, None)
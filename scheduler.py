@@ -0,0 +1,201 @@
+import re
+import time
+import requests
+from api_client import api_get
+from id_tags import strip_id_tags
+from library_index import normalize_title
+
+# Number of items requested from each Tautulli library section
+DEFAULT_STATS_LENGTH = 100000
+
+# Tautulli section types whose items are scheduled
+SECTION_TYPES = ("movie", "show")
+
+# Extracts "Title (Year)" from the start of a file or directory name
+TITLE_YEAR_PATTERN = re.compile(r"^(.*?)\s*\((\d{4})\)")
+
+
+def title_key(name):
+    """
+    Return the key a file or directory name is scheduled by: its normalized title and year.
+
+    Names without a year, such as files named only by ID tags, are scheduled on their own.
+
+    Args:
+        name (str): File or directory name, for example "Heat (1995) - Season 1.jpg".
+
+    Returns:
+        tuple: (normalized title, year), or (name, None) if the name has no year.
+    """
+    match = TITLE_YEAR_PATTERN.match(strip_id_tags(name))
+    if not match:
+        return name.lower(), None
+    return normalize_title(match.group(1)), match.group(2)
+
+
+def tautulli_get(tautulli_config, cmd, **params):
+    """
+    Call a Tautulli API command.
+
+    Returns:
+        The "data" of the response, or None if the call failed.
+    """
+    try:
+        response = api_get(
+            "tautulli",
+            tautulli_config["base_url"],
+            params={"apikey": tautulli_config["api_key"], "cmd": cmd, **params},
+        )
+    except requests.RequestException as e:
+        print(f"Error calling Tautulli {cmd}: {e}")
+        return None
+    if response.status_code != 200:
+        print(f"Error calling Tautulli {cmd}: {response.status_code}")
+        return None
+
+    # An unreadable answer counts as a failed call, so the run keeps its scan order
+    try:
+        payload = response.json()
+    except ValueError as e:
+        print(f"Error reading Tautulli {cmd} response: {e}")
+        return None
+    payload = payload.get("response") if isinstance(payload, dict) else None
+    if not isinstance(payload, dict):
+        print(f"Error reading Tautulli {cmd} response: unexpected response")
+        return None
+    if payload.get("result") != "success":
+        print(f"Error calling Tautulli {cmd}: {payload.get('message')}")
+        return None
+    return payload.get("data")
+
+
+def fetch_watch_stats(tautulli_config):
+    """
+    Download the play count and date added of every movie and show from Tautulli.
+
+    Each library section is read in one bulk get_library_media_info call. Sections are
+    listed with get_libraries unless "section_ids" is set in the Tautulli configuration.
+
+    Args:
+        tautulli_config (dict): Configuration for accessing the Tautulli API.
+
+    Returns:
+        dict: Mapping of (normalized title, year) to (play count, added timestamp), or None if
+            Tautulli could not be reached.
+    """
+    if not tautulli_config.get("api_key") or not tautulli_config.get("base_url"):
+        raise ValueError("Tautulli API key or base URL is missing in configuration.")
+
+    section_ids = tautulli_config.get("section_ids")
+    if not section_ids:
+        libraries = tautulli_get(tautulli_config, "get_libraries")
+        if libraries is None:
+            return None
+        section_ids = [library["section_id"] for library in libraries if library.get("section_type") in SECTION_TYPES]
+
+    stats = {}
+    for section_id in section_ids:
+        data = tautulli_get(
+            tautulli_config,
+            "get_library_media_info",
+            section_id=section_id,
+            length=tautulli_config.get("length", DEFAULT_STATS_LENGTH),
+        )
+        if data is None:
+            return None
+        for item in data.get("data", []):
+            if not item.get("title"):
+                continue
+            key = (normalize_title(item["title"]), str(item.get("year") or ""))
+            stats[key] = (int(item.get("play_count") or 0), int(item.get("added_at") or 0))
+    return stats
+
+
+class PriorityScheduler:
+    """
+    Orders the resolve and move stages so the most-watched titles go first, within a budget.
+
+    Titles are ranked by Tautulli play count, then by how recently they were added. A count
+    budget admits only the top titles of the run; a time budget stops starting new titles
+    once it is spent. Titles left out stay in the unsorted directory for the next run.
+    """
+
+    def __init__(self, stats=None, max_items=None, max_seconds=None):
+        self.stats = stats or {}
+        self.max_items = max_items or None
+        self.max_seconds = max_seconds or None
+        self.started = time.monotonic()
+        self.admitted = None  # Keys allowed in this run, or None for every key
+        self.taken = set()
+        self.deferred = set()
+
+    def priority(self, name):
+        """
+        Return (play count, added timestamp) of the title a name belongs to, (0, 0) if unknown.
+        """
+        return self.stats.get(title_key(name), (0, 0))
+
+    def admit(self, names):
+        """
+        Admit the titles of the run under the count budget, most-watched first.
+
+        Args:
+            names (iterable): File names of every unsorted poster of the run.
+        """
+        if not self.max_items:
+            return
+        ranked = sorted(dict.fromkeys(title_key(name) for name in names),
+                        key=lambda key: self.stats.get(key, (0, 0)), reverse=True)
+        self.admitted = set(ranked[:self.max_items])
+        self.deferred.update(ranked[self.max_items:])
+
+    def allows(self, name):
+        """
+        Check whether the title a name belongs to may be processed in this run.
+        """
+        return self.admitted is None or title_key(name) in self.admitted
+
+    def order(self, items, name_of):
+        """
+        Return the admitted items, highest priority first. Items of equal priority keep their order.
+
+        Args:
+            items (iterable): Items to order.
+            name_of (callable): Returns the file or directory name of an item.
+
+        Returns:
+            list: The ordered items.
+        """
+        return sorted((item for item in items if self.allows(name_of(item))),
+                      key=lambda item: self.priority(name_of(item)), reverse=True)
+
+    def take(self, name):
+        """
+        Start work on the title a name belongs to, unless the time budget is spent.
+
+        Once the budget is spent, only titles already started are admitted, so the move stage
+        still places their posters.
+
+        Returns:
+            bool: True if the title may be processed now.
+        """
+        key = title_key(name)
+        if key in self.taken:
+            return True
+        if not self.allows(name):
+            self.deferred.add(key)
+            return False
+        if self.max_seconds and time.monotonic() - self.started > self.max_seconds:
+            print("The time budget of this run is spent. The remaining titles are left for the next run.")
+            self.admitted = set(self.taken)
+            self.deferred.add(key)
+            return False
+        self.taken.add(key)
+        return True
+
+    def report(self):
+        """
+        Print how many titles were left for the next run.
+        """
+        if self.deferred:
+            print(f"{len(self.deferred)} title(s) left in the unsorted directory for the next run by the schedule budget.")
@@ -0,0 +1,110 @@
+import time
+import queue
+import threading
+import metrics
+
+# Default number of handed-over items a stage holds before the producer has to wait
+DEFAULT_MAX_PENDING = 8
+
+# Seconds between two progress lines of a busy stage
+PROGRESS_INTERVAL = 5.0
+
+# Queued after the last item to stop the worker
+_DONE = object()
+
+
+class Stage:
+    """
+    Pipeline stage running on its own thread, fed by the stage before it through a bounded queue.
+
+    put blocks while max_pending items are waiting, so a producer that runs ahead is held back
+    instead of piling up work. Items that queued up while the stage was busy are handled
+    together in one call. Everything the worker records, and its busy time, is attributed to
+    a metrics step named after the stage.
+
+    Args:
+        name (str): Name of the stage and of its metrics step.
+        handle (callable): Called on the worker with a list of items. Returns False when the
+            stage failed; later items are then dropped.
+        max_pending (int): Number of items that can wait before put blocks.
+        describe (callable, optional): Returns a description of the progress of the stage,
+            printed every PROGRESS_INTERVAL seconds while it works.
+    """
+
+    def __init__(self, name, handle, max_pending=DEFAULT_MAX_PENDING, describe=None):
+        self.name = name
+        self.handle = handle
+        self.describe = describe
+        self.queue = queue.Queue(maxsize=max(1, max_pending))
+        self.items = 0
+        self.calls = 0
+        self.busy_seconds = 0.0
+        self.wait_seconds = 0.0  # Time the producer spent blocked on a full queue
+        self.failed = False
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name=f"{name}-stage", daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        """
+        Hand an item to the stage, waiting while the queue is full.
+        """
+        start = time.perf_counter()
+        self.queue.put(item)
+        self.wait_seconds += time.perf_counter() - start
+
+    def run(self):
+        last_progress = time.perf_counter()
+        done = False
+        while not done:
+            items = [self.queue.get()]
+            # Take everything that queued up meanwhile in the same call
+            while items[-1] is not _DONE:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if items[-1] is _DONE:
+                items.pop()
+                done = True
+            if not items or self.failed:
+                continue
+
+            start = time.perf_counter()
+            try:
+                with metrics.stage(self.name):
+                    if self.handle(items) is False:
+                        self.failed = True
+            except Exception as e:
+                # Raised again by close, on the producer's thread
+                self.error = e
+                self.failed = True
+            self.busy_seconds += time.perf_counter() - start
+            self.items += len(items)
+            self.calls += 1
+            if self.describe and time.perf_counter() - last_progress >= PROGRESS_INTERVAL:
+                last_progress = time.perf_counter()
+                print(f"[{self.name}] {self.describe()}, {self.queue.qsize()} waiting")
+
+    def close(self):
+        """
+        Wait for the stage to handle every item handed to it.
+
+        Returns:
+            bool: True if every item was handled.
+
+        Raises:
+            Exception: Whatever handle raised.
+        """
+        self.queue.put(_DONE)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return not self.failed
+
+    def summary(self):
+        """
+        Return a one-line report of the work done by the stage.
+        """
+        return (f"{self.name}: {self.items} item(s) in {self.calls} batch(es), busy {self.busy_seconds:.2f}s, "
+                f"producer waited {self.wait_seconds:.2f}s on a full queue")
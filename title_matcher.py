@@ -0,0 +1,181 @@
+import re
+from collections import Counter
+from library_index import normalize_title
+
+# Default minimum confidence for an automatic match
+DEFAULT_MATCH_THRESHOLD = 0.85
+
+# Minimum confidence lead of the best candidate over the runner-up
+DEFAULT_MATCH_MARGIN = 0.05
+
+# Confidence adjustments from comparing years
+YEAR_MATCH_BONUS = 0.1
+YEAR_MISMATCH_PENALTY = 0.25
+
+# Trigrams shared by more than this share of the titles are skipped when gathering candidates
+COMMON_TRIGRAM_SHARE = 0.05
+
+# Leading articles ignored when comparing titles, and the "Title, The" form used by some sets
+LEADING_ARTICLE = re.compile(r"^(?:the|a|an) ")
+TRAILING_ARTICLE = re.compile(r",\s*(?:the|a|an)\s*$", re.IGNORECASE)
+
+
+def title_key(title):
+    """
+    Reduce a title to the form compared by the matcher.
+
+    Args:
+        title (str): Title from a file name or a library.
+
+    Returns:
+        str: Normalized title without a leading or trailing article.
+    """
+    title = TRAILING_ARTICLE.sub("", title or "")
+    return LEADING_ARTICLE.sub("", normalize_title(title))
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleMatcher:
+    """
+    Offline title matcher over a library, using exact keys first and a trigram index second.
+
+    Confidence is the Dice coefficient of the trigram sets, raised when the year matches and
+    lowered when it is more than one year off.
+
+    Args:
+        entries (iterable): (title, year, record) tuples. The record is returned on a match.
+        threshold (float): Minimum confidence of an automatic match.
+        margin (float): Minimum confidence lead of an automatic match over the next candidate.
+    """
+
+    def __init__(self, entries, threshold=DEFAULT_MATCH_THRESHOLD, margin=DEFAULT_MATCH_MARGIN):
+        self.threshold = threshold
+        self.margin = margin
+        self.records = []
+        self.keys = []
+        self.years = []
+        self.grams = []
+        self.by_key = {}
+        self.postings = {}
+        for title, year, record in entries:
+            key = title_key(title)
+            if not key:
+                continue
+            entry_id = len(self.records)
+            self.records.append(record)
+            self.keys.append(key)
+            self.years.append(int(year) if str(year or "").isdigit() else None)
+            grams = trigrams(key)
+            self.grams.append(len(grams))
+            self.by_key.setdefault(key, []).append(entry_id)
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(entry_id)
+        self.common_limit = max(50, int(len(self.records) * COMMON_TRIGRAM_SHARE))
+
+    def __len__(self):
+        return len(self.records)
+
+    @classmethod
+    def from_radarr(cls, radarr_index, **options):
+        return cls(((movie.title, movie.year, movie) for movie in radarr_index.values()), **options)
+
+    @classmethod
+    def from_sonarr(cls, sonarr_index, **options):
+        return cls(((series.title, series.year, series) for series in sonarr_index.series), **options)
+
+    def score(self, entry_id, similarity, year):
+        entry_year = self.years[entry_id]
+        if year is None or entry_year is None:
+            return similarity
+        if entry_year == year:
+            return min(1.0, similarity + YEAR_MATCH_BONUS)
+        if abs(entry_year - year) > 1:
+            return similarity - YEAR_MISMATCH_PENALTY
+        return similarity
+
+    def candidates(self, title, year=None, limit=5):
+        """
+        Return the closest library entries to a title.
+
+        Args:
+            title (str): Title to look up.
+            year (str or int, optional): Release year, used to rank entries with the same title.
+            limit (int): Maximum number of candidates.
+
+        Returns:
+            list: (confidence, record) tuples, best first.
+        """
+        key = title_key(title)
+        if not key:
+            return []
+        year = int(year) if str(year or "").isdigit() else None
+
+        exact = self.by_key.get(key)
+        if exact:
+            scored = [(self.score(entry_id, 1.0, year), entry_id) for entry_id in exact]
+        else:
+            grams = trigrams(key)
+            shared = Counter()
+            for gram in grams:
+                posting = self.postings.get(gram)
+                if posting and len(posting) <= self.common_limit:
+                    shared.update(posting)
+            scored = [
+                (self.score(entry_id, 2 * count / (len(grams) + self.grams[entry_id]), year), entry_id)
+                for entry_id, count in shared.most_common(limit * 4)
+            ]
+
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [(round(confidence, 3), self.records[entry_id]) for confidence, entry_id in scored[:limit]]
+
+    def match(self, title, year=None):
+        """
+        Return the library entry a title confidently refers to.
+
+        Args:
+            title (str): Title to look up.
+            year (str or int, optional): Release year.
+
+        Returns:
+            tuple: (confidence, record), or None if no candidate is confident enough.
+        """
+        candidates = self.candidates(title, year, limit=2)
+        if not candidates or candidates[0][0] < self.threshold:
+            return None
+        if len(candidates) > 1 and candidates[0][0] - candidates[1][0] < self.margin:
+            return None
+        return candidates[0]
+
+
+# Matcher built for the last index of each kind, so watch mode only rebuilds after a refresh
+_matchers = {}
+
+
+def title_matcher_for(index, kind, threshold=DEFAULT_MATCH_THRESHOLD, margin=DEFAULT_MATCH_MARGIN):
+    """
+    Return the matcher of a library index, building it only when the index changed.
+
+    Args:
+        index (dict or SonarrIndex): Radarr index keyed by TMDB ID, or the Sonarr index.
+        kind (str): "movies" or "series".
+        threshold (float): Minimum confidence of an automatic match.
+        margin (float): Minimum confidence lead of an automatic match over the next candidate.
+
+    Returns:
+        TitleMatcher: The matcher, or None if there is no index.
+    """
+    if index is None:
+        return None
+    cached = _matchers.get(kind)
+    if cached and cached[0] is index and (cached[1].threshold, cached[1].margin) == (threshold, margin):
+        return cached[1]
+    if kind == "series":
+        matcher = TitleMatcher.from_sonarr(index, threshold=threshold, margin=margin)
+    else:
+        matcher = TitleMatcher.from_radarr(index, threshold=threshold, margin=margin)
+    _matchers[kind] = (index, matcher)
+    return matcher
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import sqlite3
+import metrics
+
+# Default lifetime of cached TMDB search results, in seconds
+DEFAULT_TMDB_TTL = 7 * 24 * 60 * 60
+
+# Default number of search results kept before the least recently used are evicted
+DEFAULT_TMDB_MAX_ENTRIES = 10000
+
+
+def normalize_query(query):
+    """
+    Normalize a search query so equivalent spellings share a cache entry.
+
+    Args:
+        query (str): Raw search query.
+
+    Returns:
+        str: Lowercased query with collapsed whitespace.
+    """
+    return " ".join(query.lower().split())
+
+
+class TMDBCache:
+    """
+    SQLite-backed cache of TMDB search results and per-file movie selections.
+
+    Search results are keyed by normalized query, year, language and page, expire after
+    a TTL and are evicted least recently used first once max_entries is exceeded.
+    Selections remember the TMDB movie chosen for a title and year so reruns skip both
+    the search and the manual pick. They are not keyed by file name, which libraries
+    and unsorted folders share freely.
+    """
+
+    def __init__(self, db_path, ttl=DEFAULT_TMDB_TTL, max_entries=DEFAULT_TMDB_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS searches (
+                key TEXT PRIMARY KEY,
+                results TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS searches_accessed ON searches (accessed);
+            CREATE TABLE IF NOT EXISTS title_selections (
+                key TEXT PRIMARY KEY,
+                tmdb_id INTEGER NOT NULL,
+                movie TEXT NOT NULL,
+                created REAL NOT NULL
+            );
+            """
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def search_key(query, year=None, language="en-US", page=1):
+        """
+        Build the cache key for a search request.
+        """
+        return f"{normalize_query(query)}|{year or ''}|{language}|{page}"
+
+    def get_search(self, query, year=None, language="en-US", page=1):
+        """
+        Return cached search results, or None on a miss or an expired entry.
+        """
+        key = self.search_key(query, year, language, page)
+        row = self.connection.execute("SELECT results, created FROM searches WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+
+        results, created = row
+        now = time.time()
+        if self.ttl and now - created > self.ttl:
+            self.connection.execute("DELETE FROM searches WHERE key = ?", (key,))
+            self.connection.commit()
+            return None
+
+        self.connection.execute("UPDATE searches SET accessed = ? WHERE key = ?", (now, key))
+        self.connection.commit()
+        metrics.record_cache_hit("tmdb_search")
+        return json.loads(results)
+
+    def put_search(self, results, query, year=None, language="en-US", page=1):
+        """
+        Store search results and evict the least recently used entries beyond max_entries.
+        """
+        key = self.search_key(query, year, language, page)
+        now = time.time()
+        self.connection.execute(
+            "INSERT OR REPLACE INTO searches (key, results, created, accessed) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(results), now, now),
+        )
+        if self.max_entries:
+            self.connection.execute(
+                "DELETE FROM searches WHERE key NOT IN "
+                "(SELECT key FROM searches ORDER BY accessed DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+        self.connection.commit()
+
+    @staticmethod
+    def selection_key(query, year=None):
+        """
+        Build the key of a selection from the search query and year of a poster.
+        """
+        return f"{normalize_query(query)}|{year or ''}"
+
+    def get_selection(self, query, year=None):
+        """
+        Return the TMDB movie previously chosen for a search query and year, or None.
+        """
+        row = self.connection.execute(
+            "SELECT movie FROM title_selections WHERE key = ?", (self.selection_key(query, year),)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_selection(self, query, year, movie):
+        """
+        Remember the TMDB movie chosen for a search query and year.
+        """
+        # Only keep the fields needed to skip the search on the next run
+        movie = {key: movie.get(key) for key in ("id", "title", "release_date")}
+        self.connection.execute(
+            "INSERT OR REPLACE INTO title_selections (key, tmdb_id, movie, created) VALUES (?, ?, ?, ?)",
+            (self.selection_key(query, year), movie["id"], json.dumps(movie), time.time()),
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def open_tmdb_cache(db_path, ttl=DEFAULT_TMDB_TTL, max_entries=DEFAULT_TMDB_MAX_ENTRIES):
+    """
+    Open the TMDB cache, creating its parent directory if needed.
+
+    Args:
+        db_path (str): Path to the SQLite database, or None to disable caching.
+        ttl (int): Lifetime of cached search results in seconds.
+        max_entries (int): Maximum number of cached search results.
+
+    Returns:
+        TMDBCache: The opened cache, or None if caching is disabled.
+    """
+    if not db_path:
+        return None
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    return TMDBCache(db_path, ttl=ttl, max_entries=max_entries)
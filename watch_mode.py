@@ -0,0 +1,221 @@
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+# inotify event masks, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+# Default number of quiet seconds before a burst of changes is processed
+DEFAULT_DEBOUNCE = 5.0
+
+# Default interval between scans when inotify is unavailable
+DEFAULT_POLL_INTERVAL = 2.0
+
+
+class InotifyWatcher:
+    """
+    Recursive inotify watcher for a directory tree, using libc through ctypes.
+
+    Raises OSError on creation when inotify is not available on this platform.
+    """
+
+    def __init__(self, root):
+        library = ctypes.util.find_library("c")
+        if not library:
+            raise OSError(errno.ENOSYS, "libc not found")
+        self.libc = ctypes.CDLL(library, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+        for dir_path, _, _ in os.walk(root):
+            self.add_watch(dir_path)
+
+    def add_watch(self, dir_path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir_path), WATCH_MASK)
+        if wd >= 0:
+            self.watches[wd] = dir_path
+
+    def read_changes(self, timeout):
+        """
+        Wait up to timeout seconds and return the paths that changed.
+
+        Returns:
+            set: Changed paths. A full rescan is signalled by returning the watched roots.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changes = set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changes
+
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                changes.update(self.watches.values())
+                continue
+            dir_path = self.watches.get(wd)
+            if dir_path is None:
+                continue
+            path = os.path.join(dir_path, os.fsdecode(name)) if name else dir_path
+            # New subdirectories are watched as well, including ones extracted in a burst
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                for sub_path, _, _ in os.walk(path):
+                    self.add_watch(sub_path)
+            changes.add(path)
+        return changes
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    Watcher that detects changes by comparing periodic snapshots of a directory tree.
+    """
+
+    def __init__(self, root, interval=DEFAULT_POLL_INTERVAL):
+        self.root = root
+        self.interval = interval
+        self.snapshot = self.take_snapshot()
+
+    def take_snapshot(self):
+        snapshot = {}
+        stack = [self.root]
+        while stack:
+            dir_path = stack.pop()
+            try:
+                with os.scandir(dir_path) as entries:
+                    for entry in entries:
+                        if entry.is_dir():
+                            stack.append(entry.path)
+                        elif entry.is_file():
+                            stat = entry.stat()
+                            snapshot[entry.path] = (stat.st_size, stat.st_mtime_ns)
+            except FileNotFoundError:
+                continue
+        return snapshot
+
+    def read_changes(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        snapshot = self.take_snapshot()
+        changes = {path for path, state in snapshot.items() if self.snapshot.get(path) != state}
+        changes.update(path for path in self.snapshot if path not in snapshot)
+        self.snapshot = snapshot
+        return changes
+
+    def close(self):
+        pass
+
+
+def create_watcher(root, use_polling=False, poll_interval=DEFAULT_POLL_INTERVAL):
+    """
+    Create an inotify watcher for a directory tree, falling back to polling.
+
+    Args:
+        root (str): Path to the tree to watch.
+        use_polling (bool): Skip inotify and always poll.
+        poll_interval (float): Seconds between scans when polling.
+
+    Returns:
+        InotifyWatcher or PollingWatcher: The watcher.
+    """
+    if not use_polling:
+        try:
+            return InotifyWatcher(root)
+        except OSError as e:
+            print(f"inotify unavailable ({e}). Falling back to polling every {poll_interval}s.")
+    return PollingWatcher(root, poll_interval)
+
+
+def drain_changes(watcher):
+    """
+    Consume every change already reported by a watcher.
+
+    Returns:
+        set: Changed paths that still exist.
+    """
+    leftover = set()
+    changes = watcher.read_changes(0)
+    while changes:
+        leftover.update(path for path in changes if os.path.exists(path))
+        changes = watcher.read_changes(0)
+    return leftover
+
+
+def watch_directory(root, on_batch, debounce=DEFAULT_DEBOUNCE, use_polling=False, poll_interval=DEFAULT_POLL_INTERVAL,
+                    initial_batch=True):
+    """
+    Watch a directory tree and call on_batch once every burst of changes has settled.
+
+    A batch is processed after no new change has been seen for `debounce` seconds.
+    Changes caused by on_batch itself, such as files moved out of the tree, are ignored
+    unless the changed path still exists afterwards.
+
+    Args:
+        root (str): Path to the tree to watch.
+        on_batch (callable): Called with the set of changed paths.
+        debounce (float): Quiet period in seconds before a batch is processed.
+        use_polling (bool): Skip inotify and always poll.
+        poll_interval (float): Seconds between scans when polling.
+        initial_batch (bool): Call on_batch once with an empty set as soon as the watcher is in place,
+            to catch up on files dropped while nothing was watching.
+    """
+    watcher = create_watcher(root, use_polling, poll_interval)
+    pending = set()
+    last_change = None
+
+    try:
+        if initial_batch:
+            on_batch(set())
+            pending = drain_changes(watcher)
+            last_change = time.monotonic() if pending else None
+
+        print(f"Watching {root} for new posters. Press Ctrl+C to stop.")
+        while True:
+            timeout = debounce if last_change is None else max(0.1, debounce - (time.monotonic() - last_change))
+            changes = watcher.read_changes(timeout)
+            if changes:
+                pending.update(changes)
+                last_change = time.monotonic()
+                continue
+
+            if pending and time.monotonic() - last_change >= debounce:
+                batch, pending, last_change = pending, set(), None
+                print(f"\nProcessing {len(batch)} change(s)...")
+                on_batch(batch)
+
+                # Drop the events caused by the batch; keep drops that landed meanwhile
+                pending = drain_changes(watcher)
+                if pending:
+                    last_change = time.monotonic()
+    except KeyboardInterrupt:
+        print("\nStopped watching.")
+    finally:
+        watcher.close()
@@ -0,0 +1,330 @@
+import os
+import json
+import base64
+import hmac
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from asset_index import AssetIndex, movie_directory, series_directory
+from file_transfer import DeviceCache
+from library_index import RadarrMovie, SonarrSeries
+from plan import Plan, execute_operation, make_directory, rename_path
+
+# Default address and port of the webhook listener
+DEFAULT_WEBHOOK_HOST = "0.0.0.0"
+DEFAULT_WEBHOOK_PORT = 8766
+
+# Events that add or update a library item
+UPDATE_EVENTS = ("MovieAdded", "SeriesAdd", "Download", "Rename", "MovieFileDelete", "EpisodeFileDelete")
+
+# Events that create the sorted directory of a new item
+ADD_EVENTS = ("MovieAdded", "SeriesAdd")
+
+# Events that remove an item from the library
+DELETE_EVENTS = ("MovieDelete", "SeriesDelete")
+
+# Largest webhook body accepted, in bytes
+MAX_BODY_SIZE = 1024 * 1024
+
+
+def is_under(path, root):
+    """
+    Check whether a path is a root folder or lies below it.
+    """
+    root = root.rstrip("/\\")
+    return path == root or path.startswith(root + "/") or path.startswith(root + "\\")
+
+
+def movie_from_webhook(movie, previous=None):
+    """
+    Convert the "movie" object of a Radarr webhook to a RadarrMovie.
+
+    Webhooks do not carry the root folder, so the root folder of the indexed movie is kept
+    while the movie folder stays below it. Otherwise the parent of the movie folder is used.
+
+    Args:
+        movie (dict): The "movie" object of the webhook payload.
+        previous (RadarrMovie, optional): The movie as indexed before the event.
+
+    Returns:
+        RadarrMovie: The updated movie.
+    """
+    path = movie.get("folderPath") or movie.get("path") or (previous.path if previous else None)
+    root_folder_path = previous.root_folder_path if previous else None
+    if path and not (root_folder_path and is_under(path, root_folder_path)):
+        root_folder_path = os.path.dirname(path.rstrip("/\\"))
+    return RadarrMovie(
+        tmdb_id=movie["tmdbId"],
+        imdb_id=movie.get("imdbId") or (previous.imdb_id if previous else None),
+        path=path,
+        root_folder_path=root_folder_path,
+        title=movie.get("title") or (previous.title if previous else None),
+        year=movie.get("year") or (previous.year if previous else None),
+    )
+
+
+def series_from_webhook(payload, previous=None):
+    """
+    Convert the "series" object of a Sonarr webhook to a SonarrSeries.
+
+    Webhooks do not list the seasons of a series, so the indexed seasons are kept and those
+    of the episodes in the event are added.
+
+    Args:
+        payload (dict): The webhook payload.
+        previous (SonarrSeries, optional): The series as indexed before the event.
+
+    Returns:
+        SonarrSeries: The updated series.
+    """
+    series = payload["series"]
+    seasons = set(previous.seasons or ()) if previous else set()
+    seasons.update(episode["seasonNumber"] for episode in payload.get("episodes") or ()
+                   if episode.get("seasonNumber") is not None)
+    return SonarrSeries(
+        tvdb_id=series["tvdbId"],
+        imdb_id=series.get("imdbId") or (previous.imdb_id if previous else None),
+        title=series.get("title") or (previous.title if previous else None),
+        year=series.get("year") or (previous.year if previous else None),
+        path=series.get("path") or (previous.path if previous else None),
+        seasons=sorted(seasons),
+        tmdb_id=series.get("tmdbId") or (previous.tmdb_id if previous else None),
+    )
+
+
+class LibraryWebhooks:
+    """
+    Applies Radarr and Sonarr webhook events to the persisted library indexes and the sorted tree.
+
+    Added, downloaded and renamed items are written to the index. When the folder of an item
+    changed, its sorted directory is renamed to match; added items get their sorted directory
+    created so posters can be dropped straight in. Deleted items leave the index, and their
+    sorted directory is removed when it holds no artwork. The asset index follows every change.
+
+    Events are applied one at a time.
+
+    Args:
+        sorted_dir (str): Path to the sorted directory.
+        indexes (dict): PersistedIndex of "radarr" and "sonarr", or None for a service without one.
+        refresh (callable): Called with "radarr" or "sonarr" to fetch and persist the full
+            library when its persisted index is missing or unreadable.
+        asset_index_path (str, optional): Path of the persisted asset index.
+        create_directories (bool): Create the sorted directory of added items.
+        exclusive (bool): Fail directory renames onto an existing path instead of replacing it.
+    """
+
+    def __init__(self, sorted_dir, indexes, refresh, asset_index_path=None, create_directories=True,
+                 exclusive=False):
+        self.sorted_dir = sorted_dir
+        self.indexes = indexes
+        self.refresh = refresh
+        self.asset_index_path = asset_index_path
+        self.create_directories = create_directories
+        self.exclusive = exclusive
+        self.lock = threading.Lock()
+
+    def handle(self, service, payload):
+        """
+        Apply one webhook event.
+
+        Args:
+            service (str): "radarr" or "sonarr".
+            payload (dict): The webhook payload.
+
+        Returns:
+            list: Descriptions of the changes made.
+
+        Raises:
+            ValueError: If the payload is not a usable event.
+            OSError: If a sorted directory could not be changed.
+        """
+        event = payload.get("eventType")
+        if event == "Test" or (event not in UPDATE_EVENTS and event not in DELETE_EVENTS):
+            return []
+
+        item_key, id_key, kind = ("movie", "tmdbId", "Radarr") if service == "radarr" else ("series", "tvdbId", "Sonarr")
+        item = payload.get(item_key)
+        if not isinstance(item, dict) or not item.get(id_key):
+            raise ValueError(f"{kind} {event} event without a {item_key} {id_key}.")
+
+        with self.lock:
+            index = self.indexes.get(service)
+            if index is not None and not index.load():
+                # Without a usable copy the full library is fetched once, already holding this event
+                self.refresh(service)
+                if not index.load():
+                    raise ValueError(f"The {kind} library index could not be loaded.")
+
+            changes = []
+            previous = index.get(item[id_key]) if index is not None else None
+            if event in DELETE_EVENTS:
+                if index is not None:
+                    index.remove(item[id_key])
+                    index.save()
+                    changes.append(f"Removed {item.get('title')} from the {kind} index")
+                plan = self.plan_removal(previous)
+            else:
+                record = movie_from_webhook(item, previous) if service == "radarr" else series_from_webhook(payload, previous)
+                if index is not None and record != previous:
+                    index.put(record)
+                    index.save()
+                    changes.append(f"{'Updated' if previous else 'Added'} {record.title} in the {kind} index")
+                plan = self.plan_directory(previous, record, event in ADD_EVENTS)
+            changes.extend(self.apply(plan))
+        return changes
+
+    def directory(self, record):
+        """
+        Return the absolute sorted directory of a RadarrMovie or SonarrSeries, or None.
+        """
+        relative = movie_directory(record) if isinstance(record, RadarrMovie) else series_directory(record)
+        if not relative:
+            return None
+        return os.path.join(self.sorted_dir, *relative.split("/"))
+
+    def plan_directory(self, previous, record, added):
+        """
+        Plan the rename or creation of the sorted directory of an updated item.
+        """
+        plan = Plan()
+        target = self.directory(record)
+        if not target:
+            return plan
+        source = self.directory(previous) if previous else None
+        if source and source != target and os.path.isdir(source):
+            if os.path.exists(target):
+                print(f"Not renaming {source}: {target} already exists.")
+                return plan
+            make_directory(os.path.dirname(target), plan)
+            rename_path(source, target, plan)
+        elif added and self.create_directories:
+            make_directory(target, plan)
+        return plan
+
+    def plan_removal(self, previous):
+        """
+        Plan the removal of the sorted directory of a deleted item, unless it holds artwork.
+        """
+        plan = Plan()
+        dir_path = self.directory(previous) if previous else None
+        if dir_path and os.path.isdir(dir_path) and not os.listdir(dir_path):
+            plan.rmdir(dir_path)
+        return plan
+
+    def apply(self, plan):
+        """
+        Perform the operations of a plan and record them in the persisted asset index.
+
+        Returns:
+            list: Descriptions of the operations.
+        """
+        if not plan.operations:
+            return []
+        devices = DeviceCache()
+        changes = []
+        for operation in plan.batched():
+            execute_operation(operation, devices, exclusive=self.exclusive)
+            if operation[0] == "rename":
+                changes.append(f"Renamed directory {operation[1]} -> {operation[2]}")
+            elif operation[0] == "mkdir":
+                changes.append(f"Created directory {operation[1]}")
+            else:
+                changes.append(f"Deleted empty directory {operation[1]}")
+
+        # A missing asset index is rebuilt by the next run, so only an existing one is patched
+        asset_index = AssetIndex.read(self.asset_index_path, self.sorted_dir) if self.asset_index_path else None
+        if asset_index is not None:
+            asset_index.record_operations(plan.operations)
+            asset_index.save(self.asset_index_path)
+        return changes
+
+
+def create_webhook_server(webhooks, host=DEFAULT_WEBHOOK_HOST, port=DEFAULT_WEBHOOK_PORT, username=None,
+                          password=None):
+    """
+    Create the HTTP server receiving Radarr webhooks on /radarr and Sonarr webhooks on /sonarr.
+
+    Args:
+        webhooks (LibraryWebhooks): Applies the events.
+        host (str): Address to listen on.
+        port (int): Port to listen on. 0 picks a free port.
+        username (str, optional): User name the webhook connections send. Requests without
+            matching credentials are refused when a user name or password is set.
+        password (str, optional): Password the webhook connections send.
+
+    Returns:
+        ThreadingHTTPServer: The server, not yet serving.
+    """
+    credentials = None
+    if username or password:
+        credentials = "Basic " + base64.b64encode(f"{username or ''}:{password or ''}".encode()).decode()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def reply(self, status, body, close=False):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            if close:
+                # Also stops the handler from reading the rest of the connection as a new request
+                self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > MAX_BODY_SIZE or length < 0:
+                # The unread body would be parsed as the next request on a keep-alive connection
+                self.reply(413 if length > 0 else 400, {"error": "Invalid webhook body size."}, close=True)
+                return
+            body = self.rfile.read(length) if length else b""
+            service = self.path.split("?", 1)[0].strip("/").lower()
+            if credentials and not hmac.compare_digest(self.headers.get("Authorization", ""), credentials):
+                self.reply(401, {"error": "Unauthorized"})
+                return
+            if service not in ("radarr", "sonarr"):
+                self.reply(404, {"error": "Post Radarr events to /radarr and Sonarr events to /sonarr."})
+                return
+            try:
+                payload = json.loads(body)
+                if not isinstance(payload, dict):
+                    raise ValueError("The webhook body is not a JSON object.")
+            except ValueError as e:
+                self.reply(400, {"error": f"Invalid webhook body: {e}"})
+                return
+
+            event = payload.get("eventType")
+            try:
+                changes = webhooks.handle(service, payload)
+            except ValueError as e:
+                print(f"Ignoring {service} {event} event: {e}")
+                self.reply(400, {"error": str(e)})
+                return
+            except OSError as e:
+                print(f"Failed to apply {service} {event} event: {e}")
+                self.reply(500, {"error": str(e)})
+                return
+            for change in changes:
+                print(f"{event}: {change}")
+            self.reply(200, {"event": event, "changes": changes})
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def serve_webhooks(server):
+    """
+    Serve webhook requests until interrupted with Ctrl+C.
+    """
+    host, port = server.server_address[:2]
+    print(f"Listening for Radarr webhooks on http://{host}:{port}/radarr and Sonarr webhooks on "
+          f"http://{host}:{port}/sonarr. Press Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopped listening.")
+    finally:
+        server.server_close()